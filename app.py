@@ -1,59 +1,187 @@
+from faststart import startup_report
+from settings import SESSION_PATH, get_settings
 from fastapi import FastAPI, Request, Form, HTTPException, Depends, Cookie, Response
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
+startup_report.mark("import_fastapi")
 from telethon import TelegramClient, events
-from telethon.errors import PhoneCodeInvalidError
+from telethon.errors import PhoneCodeInvalidError, FloodWaitError
+from telethon.tl.types import InputPhoto, InputFile, InputFileBig, InputPeerUser, InputPeerChannel, InputPeerChat, InputPeerSelf
+from telethon import utils as telethon_utils
+from telethon.tl.types.updates import State
+from telethon.sessions import MemorySession, StringSession
+from telethon.crypto import AuthKey
+from telethon.tl.functions.upload import SaveFilePartRequest, SaveBigFilePartRequest
+from telethon.tl.functions.updates import GetStateRequest
+startup_report.mark("import_telethon")
 import os
 import asyncio
 import logging
-from dotenv import load_dotenv
-from typing import Dict, Optional, Union
+import logging.handlers
+import queue
+import threading
+import atexit
+import contextvars
+from typing import Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple, Union
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 import re
 import datetime
+from dataclasses import dataclass
+from urllib.parse import quote
+import tempfile
+import json
+import time
+import functools
+import hashlib
+import hmac
+import csv
+import io
+import codecs
+import zipfile
+import struct
+import shutil
+import sqlite3
+import fnmatch
+import random
+import base64
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fcntl
+except ImportError:  # غير متوفر على Windows
+    fcntl = None
 
-# إعداد logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# تحميل .env والتحقق من الإعدادات (مرة واحدة في كل عملية، حتى عند التشغيل من run.py)
+settings = get_settings()
+startup_report.mark("settings")
+
+# إعداد logging: السجلات توضع في طابور وتُكتب إلى stdout من خيط منفصل حتى لا يتأخر حلقة الأحداث
+# LOG_FORMAT=text للصيغة النصية السابقة (افتراضي) أو json لسجلات منظمة
+log_level = settings.log_level
+log_format = settings.log_format
+log_queue_size = settings.log_queue_size
+# أقصى عدد لتكرار نفس الرسالة (نفس القالب) خلال LOG_RATE_WINDOW ثانية (0 لتعطيله)
+log_rate_limit = settings.log_rate_limit
+log_rate_window = settings.log_rate_window
+log_stats: Dict[str, int] = {"dropped": 0, "suppressed": 0}
+
+# معرف الارتباط للرسالة الجاري معالجتها (الحساب:المحادثة:رقم الرسالة)
+correlation_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('correlation_id', default=None)
+
+class LogRateLimiter(logging.Filter):
+    """تحديد عدد السجلات لكل قالب رسالة، مع إضافة عدد المحذوف إلى أول سجل في النافذة التالية"""
 
-load_dotenv()
+    MAX_KEYS = 1000
 
-# التحقق من وجود المتغيرات البيئية
-api_id = os.getenv('API_ID')
-api_hash = os.getenv('API_HASH')
-password = os.getenv('PASSWORD')
-source_channel = os.getenv('SOURCE_CHANNEL')
-receiver_account = os.getenv('RECEIVER_ACCOUNT')
-target_channel_id = os.getenv('TARGET_CHANNEL_ID')
-bot_ad = os.getenv('BOT_AD')
+    def __init__(self, limit: int, window: float):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.windows: Dict[Tuple[str, int, str], List[float]] = {}
 
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self.lock:
+            state = self.windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                if len(self.windows) >= self.MAX_KEYS:
+                    self.windows = {k: v for k, v in self.windows.items() if now - v[0] < self.window}
+                if state is not None and state[2]:
+                    record.suppressed = int(state[2])
+                self.windows[key] = [now, 1, 0]
+                return True
+            state[1] += 1
+            if state[1] <= self.limit:
+                return True
+            state[2] += 1
+            log_stats["suppressed"] += 1
+            return False
 
-if not api_id or not api_hash:
-    raise ValueError("يجب تعيين API_ID و API_HASH في ملف .env")
+class JsonFormatter(logging.Formatter):
+    """سجل JSON واحد في كل سطر"""
 
-if not password:
-    raise ValueError("يجب تعيين PASSWORD في ملف .env")
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process
+        }
+        if getattr(record, 'correlation_id', None):
+            entry["correlation_id"] = record.correlation_id
+        if getattr(record, 'suppressed', None):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
 
-if not source_channel:
-    raise ValueError("يجب تعيين SOURCE_CHANNEL في ملف .env")
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler لا ينتظر أبداً: يحذف السجل عند امتلاء الطابور، ويؤجل التنسيق الكامل إلى خيط الكتابة"""
 
-if not receiver_account:
-    raise ValueError("يجب تعيين RECEIVER_ACCOUNT في ملف .env")
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # نسخة سطحية فقط: دمج الوسائط (getMessage) وتنسيق JSON والـ traceback تتم كلها في خيط QueueListener.
+        # الطابور داخل نفس العملية فلا حاجة لتحويل الوسائط إلى نص هنا.
+        record = logging.makeLogRecord(record.__dict__)
+        record.correlation_id = correlation_id.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_stats["dropped"] += 1
+
+def setup_logging() -> logging.handlers.QueueListener:
+    output = logging.StreamHandler()
+    if log_format == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=log_queue_size))
+    handler.addFilter(LogRateLimiter(log_rate_limit, log_rate_window))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(log_level)
+    listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
 
-if not target_channel_id:
-    raise ValueError("يجب تعيين TARGET_CHANNEL_ID في ملف .env")
+log_listener = setup_logging()
+logger = logging.getLogger(__name__)
 
-api_id = int(api_id)
-source_channel = int(source_channel)
-if receiver_account.lstrip('-').isdigit():
-    receiver_account = int(receiver_account)
-target_channel_id = int(target_channel_id)
+api_id = settings.api_id
+api_hash = settings.api_hash
+password = settings.password
+source_channel = settings.source_channel
+receiver_account = settings.receiver_account
+target_channel_id = settings.target_channel_id
+bot_ad = settings.bot_ad
 
 app = FastAPI(title="Telegram Message Forwarder", version="1.0.0")
-templates = Jinja2Templates(directory="templates")
+
+class LazyTemplates:
+    """تحميل Jinja2 والقوالب عند أول صفحة تُعرض بدلاً من وقت الاستيراد"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.templates = None
+
+    def __getattr__(self, name: str):
+        if self.templates is None:
+            from fastapi.templating import Jinja2Templates
+            self.templates = Jinja2Templates(directory=self.directory)
+        return getattr(self.templates, name)
+
+templates = LazyTemplates(directory="templates")
 
 # إعداد مجلد الجلسات
-session_path = "session"
+session_path = SESSION_PATH
 if not os.path.exists(session_path):
     os.makedirs(session_path)
 
@@ -62,9 +190,409 @@ downloads_path = "downloads"
 if not os.path.exists(downloads_path):
     os.makedirs(downloads_path)
 
+# إعداد خط معالجة الوسائط
+# stream: التحميل إلى مخزن مؤقت في الذاكرة ينتقل إلى ملف مؤقت عند تجاوز الحد
+# disk: التحميل إلى مجلد التحميلات ثم القراءة منه (السلوك القديم)
+media_pipeline_mode = settings.media_pipeline_mode
+media_spool_threshold = settings.media_spool_threshold
+media_chunk_size = settings.media_chunk_size
+# مدة انتظار باقي صور الألبوم (نفس grouped_id) قبل معالجته كوحدة واحدة
+album_window = settings.album_window
+
+# نقل الملفات الكبيرة على أجزاء متوازية مع إمكانية الاستئناف (اختياري لأنه يمر عبر ملف على القرص،
+# 0 افتراضياً للإبقاء على التحميل في الذاكرة)
+media_parallel_threshold = settings.media_parallel_threshold
+media_parallel_workers = settings.media_parallel_workers
+media_part_size = settings.media_part_size
+media_parts_path = settings.media_parts_path
+if not os.path.exists(media_parts_path):
+    os.makedirs(media_parts_path)
+parallel_stats: Dict[str, int] = {"transfers": 0, "resumed": 0, "parts_downloaded": 0, "parts_uploaded": 0}
+
+# مجموعة خيوط محدودة لعمليات الملفات حتى لا تحجب حلقة الأحداث
+file_ops_workers = settings.file_ops_workers
+file_ops_executor = ThreadPoolExecutor(max_workers=file_ops_workers, thread_name_prefix="file-ops")
+file_ops_stats: Dict[str, int] = {"in_flight": 0, "max_in_flight": 0, "completed": 0, "failed": 0}
+
+# فهرس الوسائط: التاريخ -> نوع الوسائط -> أحدث عنصر
+# يمكن حفظه في ملف JSON عبر MEDIA_INDEX_FILE (خارج مجلد التحميلات لأنه يتم تنظيفه)
+media_index_file = settings.media_index_file
+media_index_days = settings.media_index_days
+media_index: Dict[str, Dict[str, dict]] = {}
+media_index_loaded = False
+
+# حالة الاستعادة عند بدء التشغيل (منفصلة عن /health)
+shutdown_timeout = settings.shutdown_timeout
+startup_state: Dict[str, object] = {
+    "ready": False,
+    "started_at": None,
+    "finished_at": None,
+    "restored": [],
+    "failed": []
+}
+
 # تخزين العملاء والجلسات النشطة
 clients: Dict[str, TelegramClient] = {}
 active_sessions: Dict[str, bool] = {}
+# تخزين هوية الحساب (نتيجة get_me) لكل رقم لتجنب طلبها مع كل رسالة
+me_cache: Dict[str, object] = {}
+
+# مقاييس بصيغة Prometheus النصية (بدون مكتبات إضافية)
+def format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    """تنسيق التسميات بصيغة Prometheus"""
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+class Counter:
+    """عداد تراكمي مع تسميات"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in self.values.items():
+            yield f"{self.name}{format_labels(key)} {value}"
+
+class Histogram:
+    """مدرج تكراري للمدد والأحجام مع تسميات"""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.values: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        # عدادات الحدود ثم المجموع ثم العدد
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        for key, series in self.values.items():
+            for bound, count in zip(self.buckets, series):
+                yield f"{self.name}_bucket{format_labels(key + (('le', repr(float(bound))),))} {count}"
+            yield f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {series[-1]}"
+            yield f"{self.name}_sum{format_labels(key)} {series[-2]}"
+            yield f"{self.name}_count{format_labels(key)} {series[-1]}"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+EVENTS_TOTAL = Counter("forwarder_events_total", "Telethon events received per handler and classification")
+DOWNLOAD_BYTES = Counter("forwarder_download_bytes_total", "Bytes downloaded from Telegram")
+UPLOAD_BYTES = Counter("forwarder_upload_bytes_total", "Bytes uploaded to Telegram")
+DOWNLOAD_SECONDS = Histogram("forwarder_download_seconds", "Media download duration", DURATION_BUCKETS)
+UPLOAD_SECONDS = Histogram("forwarder_upload_seconds", "Media upload duration", DURATION_BUCKETS)
+SEND_SECONDS = Histogram("forwarder_send_seconds", "Duration of a single outbound send call", DURATION_BUCKETS)
+JOB_WAIT_SECONDS = Histogram("forwarder_job_wait_seconds", "Time a job waited in the queue before a worker picked it up", DURATION_BUCKETS)
+DELIVERY_LATENCY = Histogram("forwarder_event_to_delivery_seconds", "Time from message date to completed delivery", DURATION_BUCKETS)
+LOOP_LAG = Histogram("forwarder_event_loop_lag_seconds", "Event loop scheduling lag", DURATION_BUCKETS)
+RECONNECTS = Counter("forwarder_reconnects_total", "Supervisor reconnect attempts per account and outcome")
+DEGRADED_SECONDS = Counter("forwarder_degraded_seconds_total", "Time a forwarding pipeline spent disconnected or stalled")
+metrics_registry = [
+    EVENTS_TOTAL, DOWNLOAD_BYTES, UPLOAD_BYTES, DOWNLOAD_SECONDS, UPLOAD_SECONDS,
+    SEND_SECONDS, JOB_WAIT_SECONDS, DELIVERY_LATENCY, LOOP_LAG, RECONNECTS, DEGRADED_SECONDS
+]
+
+loop_lag_interval = settings.loop_lag_interval
+loop_lag_state: Dict[str, float] = {"last": 0.0, "max": 0.0}
+
+async def monitor_event_loop_lag():
+    """قياس تأخر حلقة الأحداث بمقارنة مدة النوم الفعلية بالمطلوبة"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(loop_lag_interval)
+        lag = max(0.0, time.perf_counter() - start - loop_lag_interval)
+        loop_lag_state["last"] = lag
+        loop_lag_state["max"] = max(loop_lag_state["max"], lag)
+        LOOP_LAG.observe(lag)
+
+def observe_delivery(message, handler: str):
+    """تسجيل الزمن من تاريخ الرسالة إلى اكتمال التسليم"""
+    if message is not None and message.date is not None:
+        DELIVERY_LATENCY.observe(max(0.0, time.time() - message.date.timestamp()), handler=handler)
+
+async def refresh_me(client: TelegramClient, phone: str):
+    """تحديث هوية الحساب المخزنة بعد التفويض"""
+    try:
+        me = await client.get_me()
+        me_cache[phone] = me
+        logger.info("تم تخزين هوية الحساب %s: %s", phone, getattr(me, 'id', None))
+        return me
+    except Exception as e:
+        logger.error("فشل في جلب هوية الحساب %s: %s", phone, e)
+        me_cache.pop(phone, None)
+        return None
+
+async def get_cached_me(client: TelegramClient, phone: str):
+    """إرجاع هوية الحساب من الذاكرة، وجلبها مرة واحدة فقط عند عدم وجودها"""
+    me = me_cache.get(phone)
+    if me is None:
+        me = await refresh_me(client, phone)
+    return me
+
+def client_phone(client: TelegramClient) -> Optional[str]:
+    """رقم الحساب المرتبط بعميل"""
+    return next((phone for phone, known in clients.items() if known is client), None)
+
+async def run_file_op(func, *args):
+    """تنفيذ عملية ملفات متزامنة في مجموعة خيوط عمليات الملفات
+
+    الدوال المتزامنة التي تلمس القرص (قراءة وكتابة JSON، الحجر، الاستخراج...) تُستدعى عبرها دائماً.
+    """
+    loop = asyncio.get_running_loop()
+    file_ops_stats["in_flight"] += 1
+    file_ops_stats["max_in_flight"] = max(file_ops_stats["max_in_flight"], file_ops_stats["in_flight"])
+    try:
+        result = await loop.run_in_executor(file_ops_executor, functools.partial(func, *args))
+        file_ops_stats["completed"] += 1
+        return result
+    except Exception:
+        file_ops_stats["failed"] += 1
+        raise
+    finally:
+        file_ops_stats["in_flight"] -= 1
+
+def file_ops_metrics() -> Dict[str, int]:
+    """إحصائيات مجموعة خيوط عمليات الملفات"""
+    return {
+        "workers": file_ops_workers,
+        "queue_depth": max(0, file_ops_stats["in_flight"] - file_ops_workers),
+        **file_ops_stats
+    }
+
+async def aio_path_exists(path: str) -> bool:
+    """التحقق من وجود مسار دون حجب حلقة الأحداث"""
+    return await run_file_op(os.path.exists, path)
+
+async def aio_getsize(path: str) -> int:
+    """حجم الملف دون حجب حلقة الأحداث"""
+    return await run_file_op(os.path.getsize, path)
+
+async def aio_remove(path: str):
+    """حذف ملف دون حجب حلقة الأحداث"""
+    return await run_file_op(os.remove, path)
+
+async def aio_listdir(path: str) -> List[str]:
+    """محتويات مجلد دون حجب حلقة الأحداث"""
+    return await run_file_op(os.listdir, path)
+
+def read_json(path: str, default=None):
+    """قراءة ملف JSON أو إرجاع default إذا لم يوجد أو كان تالفاً"""
+    if not path or not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error("فشل في قراءة %s: %s", path, e)
+        return default
+
+def write_json_atomic(path: str, data):
+    """كتابة ملف JSON بشكل ذري: ملف مؤقت ثم os.replace حتى لا يبقى ملف نصف مكتوب"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+class DebouncedSaver:
+    """حفظ ملف JSON مؤجل ومجمّع تتشاركه المخازن
+
+    schedule() تجمع التغييرات خلال delay ثانية في كتابة واحدة، و save() تكتب فوراً.
+    اللقطة تؤخذ لحظة الكتابة والكتابات لا تتداخل، لذلك آخر ما يُكتب هو أحدث حالة دائماً.
+    إذا أعادت snapshot القيمة None لا يُكتب شيء.
+    """
+
+    def __init__(self, path: str, snapshot: Callable[[], object], delay: float = 2):
+        self.path = path
+        self.snapshot = snapshot
+        self.delay = delay
+        self.task: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+        self.writes = 0
+
+    def schedule(self):
+        if self.path and self.task is None:
+            # get_running_loop أولاً حتى لا يُنشأ coroutine بلا تنفيذ عند عدم وجود حلقة أحداث
+            self.task = asyncio.get_running_loop().create_task(self._delayed_save())
+
+    async def _delayed_save(self):
+        await asyncio.sleep(self.delay)
+        self.task = None
+        await self.save()
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def save(self) -> bool:
+        """كتابة اللقطة الحالية فوراً؛ تعيد True إذا تمت الكتابة"""
+        if not self.path:
+            return False
+        async with self.lock:
+            data = self.snapshot()
+            if data is None:
+                return False
+            try:
+                await run_file_op(write_json_atomic, self.path, data)
+                self.writes += 1
+                return True
+            except Exception as e:
+                logger.error("فشل في حفظ %s: %s", self.path, e)
+                return False
+
+    async def flush(self) -> bool:
+        """إلغاء الحفظ المؤجل والكتابة فوراً (عند الإيقاف)"""
+        self.cancel()
+        return await self.save()
+
+def sweep_downloads(extension: Optional[str] = None, stop_at: Optional[str] = None):
+    """حذف الملفات القديمة من مجلد التحميلات"""
+    for filename in os.listdir(downloads_path):
+        if stop_at and filename.endswith(stop_at):
+            break
+        if extension and not filename.endswith(extension):
+            continue
+        file_path = os.path.join(downloads_path, filename)
+        try:
+            if os.path.isfile(file_path) or os.path.islink(file_path):
+                os.unlink(file_path)
+        except Exception as e:
+            logger.error('Failed to delete %s. Reason: %s', file_path, e)
+
+def load_media_index() -> Dict[str, Dict[str, dict]]:
+    """تحميل فهرس الوسائط من الملف أو بنائه من مجلد التحميلات"""
+    stored = read_json(media_index_file)
+    if stored is not None:
+        return stored
+
+    index: Dict[str, Dict[str, dict]] = {}
+    for filename in os.listdir(downloads_path):
+        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
+            file_path = os.path.join(downloads_path, filename)
+            mtime = os.path.getmtime(file_path)
+            day = datetime.date.fromtimestamp(mtime).isoformat()
+            current = index.get(day, {}).get("photo")
+            if current is None or mtime > current["timestamp"]:
+                index.setdefault(day, {})["photo"] = {"path": file_path, "timestamp": mtime}
+    return index
+
+media_index_saver = DebouncedSaver(media_index_file, lambda: {day: dict(items) for day, items in media_index.items()})
+
+async def ensure_media_index():
+    """تحميل فهرس الوسائط مرة واحدة عند أول استخدام"""
+    global media_index, media_index_loaded
+    if not media_index_loaded:
+        media_index = await run_file_op(load_media_index)
+        media_index_loaded = True
+
+def media_entry(message, path: Optional[str] = None) -> dict:
+    """عنصر فهرس الوسائط لرسالة: المسار المحلي ومرجع ملف Telegram"""
+    entry = {
+        "path": path,
+        "timestamp": time.time(),
+        "chat_id": message.chat_id,
+        "message_id": message.id
+    }
+    if message.photo:
+        entry["photo_id"] = message.photo.id
+        entry["access_hash"] = message.photo.access_hash
+        entry["file_reference"] = message.photo.file_reference.hex()
+    return entry
+
+async def record_media(message, media_type: str, path: Optional[str] = None, album: Optional[List[dict]] = None):
+    """تسجيل وسائط جديدة في الفهرس مع مرجع ملف Telegram لإعادة إرسالها دون القرص
+
+    عند تمرير album يتم تسجيل الألبوم كاملاً كعنصر واحد حتى يُعاد إرساله دفعة واحدة.
+    """
+    await ensure_media_index()
+    entry = media_entry(message, path)
+    if album:
+        entry["album"] = album
+    media_index.setdefault(datetime.date.today().isoformat(), {})[media_type] = entry
+
+    # الاحتفاظ بآخر الأيام فقط
+    for day in sorted(media_index)[:-media_index_days]:
+        del media_index[day]
+
+    await media_index_saver.save()
+
+async def latest_media(media_type: str, day: Optional[datetime.date] = None) -> Optional[dict]:
+    """إرجاع أحدث عنصر من نوع معين في يوم معين (اليوم افتراضياً)"""
+    await ensure_media_index()
+    return media_index.get((day or datetime.date.today()).isoformat(), {}).get(media_type)
+
+async def send_indexed_album(client: TelegramClient, dest: Union[int, str], entry: dict, caption: str) -> bool:
+    """إرسال ألبوم من فهرس الوسائط في طلب send_file واحد، بالمراجع أولاً ثم من القرص"""
+    items = entry["album"]
+    if all(item.get("file_reference") is not None for item in items):
+        photos = [
+            InputPhoto(id=item["photo_id"], access_hash=item["access_hash"], file_reference=bytes.fromhex(item["file_reference"]))
+            for item in items
+        ]
+        try:
+            await outbound.call(client, dest, lambda peer: client.send_file(peer, photos, caption=caption))
+            return True
+        except Exception as e:
+            logger.warning("فشل في إرسال الألبوم بالمراجع، سيتم استخدام الملفات المحلية: %s", e)
+
+    paths = [item["path"] for item in items if item.get("path") and await aio_path_exists(item["path"])]
+    if paths:
+        await outbound.call(client, dest, lambda peer: client.send_file(peer, paths, caption=caption))
+        return True
+    return False
+
+async def send_indexed_media(client: TelegramClient, dest: Union[int, str], entry: dict, caption: str) -> bool:
+    """إرسال عنصر من فهرس الوسائط بالمرجع أولاً ثم من القرص عند انتهاء صلاحية المرجع"""
+    if entry.get("album"):
+        return await send_indexed_album(client, dest, entry, caption)
+    if entry.get("file_reference") is not None:
+        try:
+            photo = InputPhoto(
+                id=entry["photo_id"],
+                access_hash=entry["access_hash"],
+                file_reference=bytes.fromhex(entry["file_reference"])
+            )
+            await outbound.call(client, dest, lambda peer: client.send_file(peer, photo, caption=caption))
+            return True
+        except Exception as e:
+            logger.warning("فشل في إرسال الصورة بالمرجع، سيتم استخدام الملف المحلي: %s", e)
+
+    path = entry.get("path")
+    if path and await aio_path_exists(path):
+        await outbound.call(client, dest, lambda peer: client.send_file(peer, path, caption=caption))
+        return True
+    return False
 
 def validate_phone(phone: str) -> bool:
     """التحقق من صحة رقم الهاتف"""
@@ -81,6 +609,338 @@ def verify_password(entered_password: str) -> bool:
     """التحقق من صحة كلمة المرور"""
     return entered_password == password
 
+@dataclass
+class AccountConfig:
+    """إعدادات حساب واحد ووجهات التحويل الخاصة به"""
+    phone: str
+    source_channel: int
+    receiver_account: Union[int, str]
+    target_channel_id: int
+    bot_ad: Optional[str]
+
+def parse_peer(value: Union[int, str]) -> Union[int, str]:
+    """تحويل المعرف الرقمي إلى int وترك أسماء المستخدمين كما هي"""
+    if isinstance(value, str) and value.lstrip('-').isdigit():
+        return int(value)
+    return value
+
+def load_accounts() -> Dict[str, AccountConfig]:
+    """تحميل الحسابات من ACCOUNTS (قائمة JSON) أو من PHONE لحساب واحد
+
+    أي حقل غير محدد لحساب ما يأخذ القيمة العامة من ملف .env
+    """
+    entries = settings.accounts if settings.accounts is not None else [{"phone": settings.phone}]
+    if settings.phone_from_session:
+        logger.warning("PHONE غير محدد، تم استخدام رقم الجلسة المحفوظة %s؛ يُفضل تعيين PHONE في ملف .env", settings.phone)
+
+    result: Dict[str, AccountConfig] = {}
+    for entry in entries:
+        phone = re.sub(r'[\s\-\(\)]', '', str(entry["phone"]))
+        if not validate_phone(phone):
+            raise ValueError(f"رقم الهاتف غير صالح في ACCOUNTS: {phone}")
+        result[phone] = AccountConfig(
+            phone=phone,
+            source_channel=int(entry.get("source_channel", source_channel)),
+            receiver_account=parse_peer(entry.get("receiver_account", receiver_account)),
+            target_channel_id=int(entry.get("target_channel_id", target_channel_id)),
+            bot_ad=entry.get("bot_ad", bot_ad)
+        )
+    if not result:
+        raise ValueError("يجب تحديد حساب واحد على الأقل في ACCOUNTS")
+    return result
+
+accounts = load_accounts()
+default_phone = next(iter(accounts))
+
+def resolve_phone(phone: Optional[str] = None) -> str:
+    """إرجاع رقم الحساب المطلوب إذا كان مُعرّفاً، وإلا الحساب الافتراضي"""
+    if phone:
+        phone = re.sub(r'[\s\-\(\)]', '', phone)
+        if phone in accounts:
+            return phone
+    return default_phone
+
+def phone_url(path: str, phone: str) -> str:
+    """رابط صفحة مع رقم الحساب (لا حاجة له عند استخدام الحساب الافتراضي)"""
+    if phone == default_phone:
+        return path
+    return f"{path}?phone={quote(phone)}"
+
+class CachedSession(MemorySession):
+    """جلسة Telethon في الذاكرة (مفتاح التفويض وذاكرة الكيانات وحالة التحديثات)
+
+    لا تكتب على القرص مباشرة، بل تطلب من SessionStore حفظاً مؤجلاً يجمع عدة تغييرات في كتابة واحدة.
+    """
+
+    def __init__(self, store: "SessionStore", phone: str, snapshot: Optional[dict] = None):
+        super().__init__()
+        self.store = store
+        self.phone = phone
+        if snapshot:
+            string_session = StringSession(snapshot.get("session"))
+            self._dc_id = string_session.dc_id
+            self._server_address = string_session.server_address
+            self._port = string_session.port
+            self._auth_key = string_session.auth_key
+            self._entities = set(tuple(row) for row in snapshot.get("entities", []))
+            for entity_id, (pts, qts, date, seq) in snapshot.get("update_states", {}).items():
+                self._update_states[int(entity_id)] = State(
+                    pts=pts, qts=qts, date=datetime.datetime.fromtimestamp(date, tz=datetime.timezone.utc),
+                    seq=seq, unread_count=0
+                )
+
+    def snapshot(self) -> dict:
+        return {
+            "session": StringSession.save(self),
+            "entities": [list(row) for row in self._entities],
+            "update_states": {
+                str(entity_id): [state.pts, state.qts, state.date.timestamp(), state.seq]
+                for entity_id, state in self._update_states.items()
+            }
+        }
+
+    def save(self):
+        self.store.schedule_save(self.phone, self)
+
+    def process_entities(self, tlo):
+        count = len(self._entities)
+        super().process_entities(tlo)
+        if len(self._entities) != count:
+            self.save()
+
+    def delete(self):
+        # يستدعيها Telethon عند تسجيل الخروج: يجب ألا تُحمّل الجلسة من القرص مرة أخرى
+        self.store.forget(self.phone)
+
+class SessionStore:
+    """مخزن الجلسات القابل للتبديل
+
+    sqlite (افتراضي): ملفات .session في مجلد الجلسات (سلوك Telethon الافتراضي)
+    memory: جلسات في الذاكرة تُحمّل مرة واحدة من SESSION_STRINGS / SESSION_STRINGS_FILE أو من ملف
+    الكاش أو من ملف .session القديم، وتُحفظ في ملف JSON بكتابات مؤجلة ومجمعة.
+    الجلسات التالفة أو غير المصرح بها تُنقل إلى مجلد الحجر بدلاً من حذفها.
+    """
+
+    def __init__(self):
+        self.backend = settings.session_backend
+        self.quarantine_path = os.path.join(session_path, 'quarantine')
+        self.save_delay = settings.session_save_delay
+        self.strings = self._load_strings()
+        self.snapshots: Dict[str, Optional[dict]] = {}
+        self.pending: Dict[str, CachedSession] = {}
+        self.savers: Dict[str, DebouncedSaver] = {}
+        self.delete_tasks: Set[asyncio.Task] = set()
+        self.stats: Dict[str, int] = {"loads": 0, "coalesced": 0, "quarantined": 0}
+
+    @staticmethod
+    def _load_strings() -> Dict[str, str]:
+        """جلسات نصية من SESSION_STRINGS (JSON) أو SESSION_STRINGS_FILE (ملف سري) أو SESSION_STRING للحساب الافتراضي"""
+        strings: Dict[str, str] = {}
+        secrets_file = settings.session_strings_file
+        if secrets_file and os.path.exists(secrets_file):
+            with open(secrets_file, 'r', encoding='utf-8') as f:
+                strings.update(json.load(f))
+        strings.update(settings.session_strings)
+        if settings.session_string:
+            strings.setdefault(default_phone, settings.session_string)
+        return strings
+
+    @staticmethod
+    def session_name(phone: str) -> str:
+        return f"{session_path}/{phone.replace('+', '')}"
+
+    def session_file(self, phone: str) -> str:
+        return f"{self.session_name(phone)}.session"
+
+    def cache_file(self, phone: str) -> str:
+        return f"{self.session_name(phone)}.session.json"
+
+    def _quarantine_file(self, path: str) -> Optional[str]:
+        """نقل ملف جلسة إلى مجلد الحجر"""
+        if not os.path.exists(path):
+            return None
+        os.makedirs(self.quarantine_path, exist_ok=True)
+        target = os.path.join(self.quarantine_path, f"{os.path.basename(path)}.{int(time.time())}")
+        os.replace(path, target)
+        self.stats["quarantined"] += 1
+        return target
+
+    @staticmethod
+    def _read_sqlite(path: str) -> Optional[dict]:
+        """قراءة مفتاح التفويض والكيانات من ملف .session قديم"""
+        connection = sqlite3.connect(path)
+        try:
+            row = connection.execute("select dc_id, server_address, port, auth_key from sessions").fetchone()
+            if row is None or not row[3]:
+                return None
+            legacy = StringSession()
+            legacy.set_dc(row[0], row[1], row[2])
+            legacy.auth_key = AuthKey(row[3])
+            entities = [list(entity) for entity in connection.execute("select id, hash, username, phone, name from entities")]
+            update_states = {
+                str(entity_id): [pts, qts, date, seq]
+                for entity_id, pts, qts, date, seq in connection.execute("select id, pts, qts, date, seq from update_state")
+            }
+            return {"session": legacy.save(), "entities": entities, "update_states": update_states}
+        finally:
+            connection.close()
+
+    def _load(self, phone: str) -> Optional[dict]:
+        """تحميل الجلسة من ملف الكاش أو الجلسة النصية أو ملف .session القديم"""
+        cache_file = self.cache_file(phone)
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    snapshot = json.load(f)
+                StringSession(snapshot["session"])
+                return snapshot
+            except (OSError, ValueError, KeyError, TypeError, struct.error) as e:
+                logger.error("ملف كاش الجلسة %s تالف: %s، تم نقله إلى %s", cache_file, e, self._quarantine_file(cache_file))
+        if phone in self.strings:
+            try:
+                StringSession(self.strings[phone])
+                return {"session": self.strings[phone], "entities": [], "update_states": {}}
+            except (ValueError, struct.error) as e:
+                logger.error("الجلسة النصية للرقم %s غير صالحة: %s", phone, e)
+        session_file = self.session_file(phone)
+        if os.path.exists(session_file) and os.path.getsize(session_file) > 0:
+            try:
+                return self._read_sqlite(session_file)
+            except (sqlite3.Error, ValueError) as e:
+                logger.error("ملف الجلسة %s تالف: %s، تم نقله إلى %s", session_file, e, self._quarantine_file(session_file))
+        return None
+
+    async def _snapshot(self, phone: str) -> Optional[dict]:
+        if phone not in self.snapshots:
+            self.snapshots[phone] = await run_file_op(self._load, phone)
+            self.stats["loads"] += 1
+        return self.snapshots[phone]
+
+    async def exists(self, phone: str) -> bool:
+        """هل توجد جلسة محفوظة لهذا الرقم"""
+        if self.backend == 'sqlite':
+            session_file = self.session_file(phone)
+            if not await aio_path_exists(session_file):
+                return False
+            if await aio_getsize(session_file) < 1:
+                await self.quarantine(phone, "ملف جلسة فارغ")
+                return False
+            return True
+        return await self._snapshot(phone) is not None
+
+    async def phones(self) -> List[str]:
+        """الحسابات المعرفة التي لها جلسة محفوظة"""
+        results = await asyncio.gather(*(self.exists(phone) for phone in accounts))
+        return [phone for phone, found in zip(accounts, results) if found]
+
+    async def open(self, phone: str):
+        """الجلسة المستخدمة لإنشاء TelegramClient (مسار ملف أو جلسة في الذاكرة)"""
+        if self.backend == 'sqlite':
+            return self.session_name(phone)
+        return CachedSession(self, phone, await self._snapshot(phone))
+
+    def _saver(self, phone: str) -> DebouncedSaver:
+        saver = self.savers.get(phone)
+        if saver is None:
+            saver = self.savers[phone] = DebouncedSaver(self.cache_file(phone), functools.partial(self._take_pending, phone), self.save_delay)
+        return saver
+
+    def _take_pending(self, phone: str) -> Optional[dict]:
+        """لقطة الجلسة المعلقة لحظة الكتابة، أو None إذا لم يبق ما يُحفظ"""
+        session = self.pending.pop(phone, None)
+        if session is None or not session.auth_key:
+            return None
+        snapshot = session.snapshot()
+        self.snapshots[phone] = snapshot
+        return snapshot
+
+    def schedule_save(self, phone: str, session: CachedSession):
+        """طلب حفظ مؤجل؛ التغييرات خلال فترة التأجيل تُجمع في كتابة واحدة"""
+        self.pending[phone] = session
+        saver = self._saver(phone)
+        if saver.task is not None:
+            self.stats["coalesced"] += 1
+            return
+        try:
+            saver.schedule()
+        except RuntimeError:
+            # لا توجد حلقة أحداث (مثلاً عند إغلاق العميل بعد توقفها): الحفظ مباشرة بدلاً من فقدان التغييرات
+            self._save_now(phone)
+
+    def _save_now(self, phone: str):
+        snapshot = self._take_pending(phone)
+        if snapshot is None:
+            return
+        try:
+            write_json_atomic(self.cache_file(phone), snapshot)
+            self._saver(phone).writes += 1
+        except Exception as e:
+            logger.error("فشل في حفظ الجلسة للرقم %s: %s", phone, e)
+
+    async def flush(self):
+        """كتابة جميع الجلسات المعلقة فوراً (عند الإيقاف)"""
+        await asyncio.gather(*(self._saver(phone).flush() for phone in list(self.pending)), return_exceptions=True)
+
+    def metrics(self) -> Dict[str, int]:
+        return {**self.stats, "writes": sum(saver.writes for saver in self.savers.values())}
+
+    def discard(self, phone: str):
+        """نسيان الجلسة بعد تسجيل الخروج"""
+        self.pending.pop(phone, None)
+        self.snapshots[phone] = None
+        saver = self.savers.get(phone)
+        if saver is not None:
+            saver.cancel()
+
+    def _remove_files(self, phone: str):
+        for path in (self.cache_file(phone), self.session_file(phone)):
+            try:
+                os.remove(path)
+                logger.info("تم حذف ملف الجلسة %s", path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error("فشل في حذف ملف الجلسة %s: %s", path, e)
+
+    async def _delete_files(self, phone: str):
+        # تحت قفل الحفظ حتى لا تعيد كتابة جارية إنشاء ملف الكاش بعد حذفه
+        async with self._saver(phone).lock:
+            await run_file_op(self._remove_files, phone)
+
+    def forget(self, phone: str):
+        """حذف الجلسة نهائياً بعد تسجيل الخروج أو إلغائها: من الذاكرة وملف الكاش وملف .session القديم"""
+        self.discard(phone)
+        if self.strings.pop(phone, None) is not None:
+            logger.warning("تم تسجيل خروج الجلسة النصية للرقم %s، يجب حذفها من SESSION_STRINGS", phone)
+        try:
+            task = asyncio.get_running_loop().create_task(self._delete_files(phone))
+        except RuntimeError:
+            self._remove_files(phone)
+            return
+        self.delete_tasks.add(task)
+        task.add_done_callback(self.delete_tasks.discard)
+
+    async def quarantine(self, phone: str, reason: str):
+        """نقل ملفات الجلسة إلى مجلد الحجر بدلاً من حذفها"""
+        self.discard(phone)
+        for path in (self.session_file(phone), self.cache_file(phone)):
+            try:
+                target = await run_file_op(self._quarantine_file, path)
+                if target:
+                    logger.warning("تم نقل ملف الجلسة %s إلى الحجر (%s): %s", path, reason, target)
+            except OSError as e:
+                logger.error("فشل في نقل ملف الجلسة %s إلى الحجر: %s", path, e)
+
+    def export(self, phone: str) -> Optional[str]:
+        """الجلسة النصية لحساب (لاستخدامها في SESSION_STRINGS على أقراص مؤقتة مثل Render)"""
+        client = clients.get(phone)
+        if client is not None and client.session.auth_key:
+            return StringSession.save(client.session)
+        snapshot = self.snapshots.get(phone)
+        return snapshot["session"] if snapshot else None
+
+session_store = SessionStore()
+
 async def check_auth(auth_token: Optional[str] = Cookie(None)):
     """التحقق من تسجيل الدخول"""
     if auth_token != "authenticated":
@@ -88,11 +948,11 @@ async def check_auth(auth_token: Optional[str] = Cookie(None)):
     return True
 
 @app.get("/", response_class=HTMLResponse)
-async def login_page(request: Request, is_authenticated: bool = Depends(check_auth)):
+async def login_page(request: Request, phone: Optional[str] = None, is_authenticated: bool = Depends(check_auth)):
     """صفحة تسجيل الدخول"""
     if is_authenticated:
         # التحقق من وجود جلسة نشطة
-        phone = "+963980907351"  # الرقم المحدد
+        phone = resolve_phone(phone)
         has_active_session = False
         client_exists = False
         client_authorized = False
@@ -106,82 +966,59 @@ async def login_page(request: Request, is_authenticated: bool = Depends(check_au
                 client = clients[phone]
                 # التحقق من حالة الاتصال
                 if client.is_connected():
-                    logger.info(f"العميل {phone} متصل")
+                    logger.info("العميل %s متصل", phone)
                     # التحقق من حالة التفويض
                     if await client.is_user_authorized():
                         client_authorized = True
                         has_active_session = True
-                        logger.info(f"العميل {phone} مفوض ولديه جلسة نشطة")
+                        logger.info("العميل %s مفوض ولديه جلسة نشطة", phone)
                         active_sessions[phone] = True
                     else:
-                        logger.warning(f"العميل {phone} متصل ولكن غير مفوض")
+                        logger.warning("العميل %s متصل ولكن غير مفوض", phone)
                 else:
-                    logger.warning(f"العميل {phone} موجود ولكن غير متصل")
+                    logger.warning("العميل %s موجود ولكن غير متصل", phone)
             except Exception as e:
-                logger.error(f"خطأ في التحقق من حالة الجلسة: {e}")
-                import traceback
-                logger.error(traceback.format_exc())
+                logger.exception("خطأ في التحقق من حالة الجلسة: %s", e)
         else:
-            logger.info(f"لا يوجد عميل في الذاكرة للرقم {phone}، التحقق من ملف الجلسة")
-            
-            # التحقق من وجود ملف الجلسة
-            session_name = f"{session_path}/{phone.replace('+', '')}"
-            session_file = f"{session_name}.session"
+            logger.info("لا يوجد عميل في الذاكرة للرقم %s، التحقق من ملف الجلسة", phone)
             
-            if os.path.exists(session_file):
-                logger.info(f"تم العثور على ملف جلسة: {session_file}")
-                
-                # التحقق من حجم ملف الجلسة
-                file_size = os.path.getsize(session_file)
-                logger.info(f"حجم ملف الجلسة: {file_size} بايت")
-                
-                if file_size < 1:  # ملف صغير جداً قد يكون فارغاً أو تالفاً
-                    logger.warning(f"ملف الجلسة صغير جداً ({file_size} بايت)، سيتم حذفه")
-                    try:
-                        os.remove(session_file)
-                        logger.info(f"تم حذف ملف الجلسة الصغير: {session_file}")
-                    except Exception as e:
-                        logger.error(f"فشل في حذف ملف الجلسة: {e}")
-                else:
-                    # محاولة الاتصال بالجلسة
-                    try:
-                        logger.info(f"محاولة الاتصال بالجلسة للرقم {phone}")
-                        client = TelegramClient(session_name, api_id, api_hash)
-                        await client.connect()
+            # التحقق من وجود جلسة محفوظة
+            if await session_store.exists(phone):
+                logger.info("تم العثور على جلسة محفوظة للرقم %s", phone)
+                # محاولة الاتصال بالجلسة
+                try:
+                    logger.info("محاولة الاتصال بالجلسة للرقم %s", phone)
+                    client = TelegramClient(await session_store.open(phone), api_id, api_hash)
+                    await client.connect()
+                    
+                    # التحقق من حالة الاتصال
+                    if client.is_connected():
+                        logger.info("تم الاتصال بالخادم بنجاح")
                         
-                        # التحقق من حالة الاتصال
-                        if client.is_connected():
-                            logger.info(f"تم الاتصال بالخادم بنجاح")
+                        # التحقق من التفويض
+                        if await client.is_user_authorized():
+                            logger.info("تم الاتصال بنجاح بالجلسة للرقم %s", phone)
+                            clients[phone] = client
+                            active_sessions[phone] = True
+                            has_active_session = True
+                            client_exists = True
+                            client_authorized = True
+                            await refresh_me(client, phone)
                             
-                            # التحقق من التفويض
-                            if await client.is_user_authorized():
-                                logger.info(f"تم الاتصال بنجاح بالجلسة للرقم {phone}")
-                                clients[phone] = client
-                                active_sessions[phone] = True
-                                has_active_session = True
-                                client_exists = True
-                                client_authorized = True
-                                
-                                # بدء عملية تحويل الرسائل
-                                asyncio.create_task(start_message_forwarding(client, phone))
-                            else:
-                                logger.warning(f"الجلسة للرقم {phone} غير مصرح بها")
-                                await client.disconnect()
-                                # حذف الجلسة غير المصرح بها
-                                try:
-                                    os.remove(session_file)
-                                    logger.info(f"تم حذف ملف الجلسة غير المصرح بها: {session_file}")
-                                except Exception as e:
-                                    logger.error(f"فشل في حذف ملف الجلسة: {e}")
+                            # بدء عملية تحويل الرسائل
+                            await start_message_forwarding(client, phone)
                         else:
-                            logger.error("فشل الاتصال بالخادم")
+                            logger.warning("الجلسة للرقم %s غير مصرح بها", phone)
                             await client.disconnect()
-                    except Exception as e:
-                        logger.error(f"خطأ في الاتصال بالجلسة: {e}")
-                        import traceback
-                        logger.error(traceback.format_exc())
+                            # نقل الجلسة غير المصرح بها إلى الحجر
+                            await session_store.quarantine(phone, "غير مصرح بها")
+                    else:
+                        logger.error("فشل الاتصال بالخادم")
+                        await client.disconnect()
+                except Exception as e:
+                    logger.exception("خطأ في الاتصال بالجلسة: %s", e)
             else:
-                logger.info(f"لا توجد ملف جلسة للرقم {phone}")
+                logger.info("لا توجد جلسة محفوظة للرقم %s", phone)
         
         # تحديد الرسائل المناسبة بناءً على حالة الجلسة
         if has_active_session:
@@ -201,7 +1038,9 @@ async def login_page(request: Request, is_authenticated: bool = Depends(check_au
             "error": error_message,
             "success": success_message,
             "is_authenticated": True,
-            "has_active_session": has_active_session
+            "has_active_session": has_active_session,
+            "phone": phone,
+            "accounts": list(accounts)
         })
     else:
         return templates.TemplateResponse("login.html", {
@@ -213,13 +1052,13 @@ async def login_page(request: Request, is_authenticated: bool = Depends(check_au
         })
 
 @app.get("/verify_code", response_class=HTMLResponse)
-async def verify_code_page(request: Request, is_authenticated: bool = Depends(check_auth)):
+async def verify_code_page(request: Request, phone: Optional[str] = None, is_authenticated: bool = Depends(check_auth)):
     """صفحة التحقق من الكود المرسل تلقائيًا"""
     if not is_authenticated:
         return RedirectResponse(url="/", status_code=303)
     
     # التحقق من وجود جلسة نشطة
-    phone = "+963980907351"  # الرقم المحدد
+    phone = resolve_phone(phone)
     has_active_session = False
     
     if phone in clients and clients[phone] is not None:
@@ -227,10 +1066,10 @@ async def verify_code_page(request: Request, is_authenticated: bool = Depends(ch
             client = clients[phone]
             if await client.is_user_authorized():
                 has_active_session = True
-                logger.info(f"المستخدم {phone} مسجل الدخول بالفعل، إعادة التوجيه إلى الصفحة الرئيسية")
-                return RedirectResponse(url="/", status_code=303)
+                logger.info("المستخدم %s مسجل الدخول بالفعل، إعادة التوجيه إلى الصفحة الرئيسية", phone)
+                return RedirectResponse(url=phone_url("/", phone), status_code=303)
         except Exception as e:
-            logger.error(f"خطأ في التحقق من حالة الجلسة: {e}")
+            logger.error("خطأ في التحقق من حالة الجلسة: %s", e)
     
     # التحقق من وجود عميل للرقم
     client_exists = phone in clients and clients[phone] is not None
@@ -243,7 +1082,7 @@ async def verify_code_page(request: Request, is_authenticated: bool = Depends(ch
             if await client.is_user_authorized():
                 has_active_session = True
         except Exception as e:
-            logger.error(f"خطأ في التحقق من حالة التفويض: {e}")
+            logger.error("خطأ في التحقق من حالة التفويض: %s", e)
     
     return templates.TemplateResponse("login.html", {
         "request": request,
@@ -251,45 +1090,33 @@ async def verify_code_page(request: Request, is_authenticated: bool = Depends(ch
         "show_code": True,
         "phone": phone,
         "error": None if client_exists else "لم يتم إنشاء جلسة بعد، يرجى إرسال كود التحقق أولاً",
-        "success": "تم إرسال كود التحقق إلى الرقم +963980907351" if client_exists else None,
+        "success": f"تم إرسال كود التحقق إلى الرقم {phone}" if client_exists else None,
         "is_authenticated": True,
         "has_active_session": has_active_session
     })
 
 @app.post("/verify_code", response_class=HTMLResponse)
-async def verify_code(request: Request, code: str = Form(...), is_authenticated: bool = Depends(check_auth)):
+async def verify_code(request: Request, code: str = Form(...), phone: Optional[str] = Form(None), is_authenticated: bool = Depends(check_auth)):
     """التحقق من كود التفعيل"""
     if not is_authenticated:
         return RedirectResponse(url="/", status_code=303)
     
-    phone = "+963980907351"  # الرقم المحدد
-    logger.info(f"محاولة التحقق من كود التفعيل للرقم {phone}")
+    phone = resolve_phone(phone)
+    logger.info("محاولة التحقق من كود التفعيل للرقم %s", phone)
         
     try:
         if phone not in clients or clients[phone] is None:
             # إذا لم يكن العميل موجودًا، حاول إنشاء عميل جديد وإرسال كود التحقق
-            logger.warning(f"لا يوجد عميل للرقم {phone}، محاولة إنشاء عميل جديد وإرسال كود التحقق")
+            logger.warning("لا يوجد عميل للرقم %s، محاولة إنشاء عميل جديد وإرسال كود التحقق", phone)
             try:
-                # التحقق من وجود ملف جلسة قبل إرسال كود جديد
-                session_name = f"{session_path}/{phone.replace('+', '')}" 
-                session_file = f"{session_name}.session"
-                
-                if os.path.exists(session_file):
-                    logger.info(f"تم العثور على ملف جلسة: {session_file}")
-                    # التحقق من حجم الملف
-                    file_size = os.path.getsize(session_file)
-                    if file_size < 1:  # ملف صغير جداً قد يكون فارغاً أو تالفاً
-                        logger.warning(f"ملف الجلسة صغير جداً ({file_size} بايت)، سيتم حذفه وإنشاء جلسة جديدة")
-                        try:
-                            os.remove(session_file)
-                            logger.info(f"تم حذف ملف الجلسة الصغير: {session_file}")
-                        except Exception as e:
-                            logger.error(f"فشل في حذف ملف الجلسة: {e}")
+                # التحقق من وجود جلسة محفوظة قبل إرسال كود جديد
+                if await session_store.exists(phone):
+                    logger.info("تم العثور على جلسة محفوظة للرقم %s", phone)
                 
                 # إرسال كود جديد
-                phone_result = await auto_send_code()
+                phone_result = await auto_send_code(phone)
                 if phone_result:
-                    logger.info(f"تم إرسال كود تحقق جديد للرقم {phone_result}")
+                    logger.info("تم إرسال كود تحقق جديد للرقم %s", phone_result)
                     return templates.TemplateResponse("login.html", {
                         "request": request,
                         "error": None,
@@ -310,9 +1137,7 @@ async def verify_code(request: Request, code: str = Form(...), is_authenticated:
                         "has_active_session": False
                     })
             except Exception as e:
-                logger.error(f"خطأ في إرسال كود التحقق تلقائيًا: {e}")
-                import traceback
-                logger.error(traceback.format_exc())
+                logger.exception("خطأ في إرسال كود التحقق تلقائيًا: %s", e)
                 
                 # تحديد نوع الخطأ لعرض رسالة مناسبة للمستخدم
                 error_message = f"حدث خطأ في إرسال كود التحقق: {str(e)}"
@@ -334,20 +1159,22 @@ async def verify_code(request: Request, code: str = Form(...), is_authenticated:
         
         # التحقق من حالة الاتصال
         if not client.is_connected():
-            logger.warning(f"العميل {phone} غير متصل، محاولة إعادة الاتصال")
+            logger.warning("العميل %s غير متصل، محاولة إعادة الاتصال", phone)
             await client.connect()
         
         # تسجيل الدخول باستخدام الكود
-        logger.info(f"محاولة تسجيل الدخول باستخدام الكود للرقم {phone}")
+        logger.info("محاولة تسجيل الدخول باستخدام الكود للرقم %s", phone)
         await client.sign_in(phone, code)
         
         # التحقق من نجاح تسجيل الدخول
         if await client.is_user_authorized():
-            logger.info(f"تم تسجيل الدخول بنجاح للرقم {phone}")
+            logger.info("تم تسجيل الدخول بنجاح للرقم %s", phone)
             active_sessions[phone] = True
+            # إعادة تحميل الهوية لأن الجلسة أعيد تفويضها
+            await refresh_me(client, phone)
             
             # بدء عملية إعادة توجيه الرسائل
-            asyncio.create_task(start_message_forwarding(client, phone))
+            await start_message_forwarding(client, phone)
             
             return templates.TemplateResponse("login.html", {
                 "request": request,
@@ -358,7 +1185,7 @@ async def verify_code(request: Request, code: str = Form(...), is_authenticated:
                 "has_active_session": True
             })
         else:
-            logger.warning(f"فشل في تفويض العميل {phone} رغم عدم وجود أخطاء")
+            logger.warning("فشل في تفويض العميل %s رغم عدم وجود أخطاء", phone)
             return templates.TemplateResponse("login.html", {
                 "request": request,
                 "error": "فشل في تفويض الجلسة، يرجى المحاولة مرة أخرى",
@@ -369,7 +1196,7 @@ async def verify_code(request: Request, code: str = Form(...), is_authenticated:
                 "has_active_session": False
             })
     except PhoneCodeInvalidError:
-        logger.error(f"كود التحقق غير صحيح للرقم {phone}")
+        logger.error("كود التحقق غير صحيح للرقم %s", phone)
         return templates.TemplateResponse("login.html", {
             "request": request,
             "error": "كود التحقق غير صحيح، يرجى المحاولة مرة أخرى",
@@ -380,9 +1207,7 @@ async def verify_code(request: Request, code: str = Form(...), is_authenticated:
             "has_active_session": False
         })
     except Exception as e:
-        logger.error(f"خطأ في التحقق من الكود: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.exception("خطأ في التحقق من الكود: %s", e)
         
         # تحديد نوع الخطأ لعرض رسالة مناسبة للمستخدم
         error_message = f"حدث خطأ: {str(e)}"
@@ -402,99 +1227,54 @@ async def verify_code(request: Request, code: str = Form(...), is_authenticated:
             "is_authenticated": True
         })
 
-async def check_existing_sessions():
-    """التحقق من وجود جلسات سابقة والاتصال بها"""
+async def check_existing_sessions(phone: Optional[str] = None):
+    """التحقق من وجود جلسة سابقة لحساب معين والاتصال بها"""
     try:
-        # التحقق من وجود ملفات الجلسة
-        if not os.path.exists(session_path):
-            logger.info("لا توجد مجلدات جلسات")
-            return None
-            
-        # البحث عن ملفات الجلسة
-        session_files = [f for f in os.listdir(session_path) if f.endswith('.session')]
-        logger.info(f"ملفات الجلسات الموجودة: {session_files}")
-        
-        if not session_files:
-            logger.info("لا توجد ملفات جلسات")
-            return None
-            
-        # محاولة الاتصال بالجلسة الأولى
-        phone = "+963980907351"  # الرقم المحدد
-        session_name = f"{session_path}/{phone.replace('+', '')}"
-        session_file = f"{session_name}.session"
-        
-        logger.info(f"البحث عن ملف الجلسة: {session_file}")
-        if os.path.exists(session_file):
-            logger.info(f"تم العثور على جلسة للرقم {phone}")
-            
-            # التحقق من حجم ملف الجلسة
-            file_size = os.path.getsize(session_file)
-            logger.info(f"حجم ملف الجلسة: {file_size} بايت")
-            
-            if file_size < 1:  # ملف صغير جداً قد يكون فارغاً أو تالفاً
-                logger.warning(f"ملف الجلسة صغير جداً ({file_size} بايت)، سيتم حذفه وطلب كود تحقق جديد")
-                try:
-                    os.remove(session_file)
-                    logger.info(f"تم حذف ملف الجلسة الصغير: {session_file}")
-                except Exception as e:
-                    logger.error(f"فشل في حذف ملف الجلسة: {e}")
-                return None
+        # محاولة الاتصال بجلسة الحساب
+        phone = resolve_phone(phone)
+        logger.info("البحث عن جلسة محفوظة للرقم %s", phone)
+        if await session_store.exists(phone):
+            logger.info("تم العثور على جلسة للرقم %s", phone)
             
             # محاولة الاتصال بالجلسة
             try:
-                client = TelegramClient(session_name, api_id, api_hash)
+                client = TelegramClient(await session_store.open(phone), api_id, api_hash)
                 await client.connect()
                 
                 # التحقق من حالة الاتصال
                 is_connected = client.is_connected()
-                logger.info(f"حالة الاتصال: {is_connected}")
+                logger.info("حالة الاتصال: %s", is_connected)
                 
                 if not is_connected:
-                    logger.error("فشل الاتصال بالخادم، سيتم حذف ملف الجلسة وطلب كود تحقق جديد")
-                    try:
-                        await client.disconnect()
-                        os.remove(session_file)
-                        logger.info(f"تم حذف ملف الجلسة بسبب فشل الاتصال: {session_file}")
-                    except Exception as e:
-                        logger.error(f"فشل في حذف ملف الجلسة: {e}")
+                    # فشل الاتصال لا يعني أن الجلسة تالفة، لذلك يتم الاحتفاظ بها
+                    logger.error("فشل الاتصال بالخادم، سيتم الاحتفاظ بالجلسة لإعادة المحاولة لاحقاً")
+                    await client.disconnect()
                     return None
                 
                 # التحقق من التفويض
                 is_authorized = await client.is_user_authorized()
-                logger.info(f"حالة التفويض: {is_authorized}")
+                logger.info("حالة التفويض: %s", is_authorized)
                 
                 if is_authorized:
-                    logger.info(f"تم الاتصال بنجاح بالجلسة للرقم {phone}")
+                    logger.info("تم الاتصال بنجاح بالجلسة للرقم %s", phone)
                     clients[phone] = client
                     active_sessions[phone] = True
-                    asyncio.create_task(start_message_forwarding(client, phone))
+                    await refresh_me(client, phone)
+                    await start_message_forwarding(client, phone)
                     return phone
                 else:
-                    logger.info(f"الجلسة للرقم {phone} غير مصرح بها، سيتم حذفها وطلب كود تحقق جديد")
+                    logger.info("الجلسة للرقم %s غير مصرح بها، سيتم نقلها إلى الحجر وطلب كود تحقق جديد", phone)
                     await client.disconnect()
-                    # حذف الجلسة غير المصرح بها إذا كانت موجودة
-                    if os.path.exists(session_file):
-                        try:
-                            os.remove(session_file)
-                            logger.info(f"تم حذف ملف الجلسة غير المصرح بها: {session_file}")
-                        except Exception as e:
-                            logger.error(f"فشل في حذف ملف الجلسة: {e}")
+                    await session_store.quarantine(phone, "غير مصرح بها")
                     return None
             except Exception as e:
-                logger.error(f"خطأ أثناء محاولة الاتصال بالجلسة: {e}")
-                try:
-                    os.remove(session_file)
-                    logger.info(f"تم حذف ملف الجلسة بسبب خطأ في الاتصال: {session_file}")
-                except Exception as e2:
-                    logger.error(f"فشل في حذف ملف الجلسة: {e2}")
+                logger.error("خطأ أثناء محاولة الاتصال بالجلسة: %s", e)
                 return None
         else:
-            logger.info(f"لا توجد جلسة للرقم {phone}")
+            logger.info("لا توجد جلسة للرقم %s", phone)
             return None
     except Exception as e:
-        logger.error(f"خطأ في التحقق من الجلسات: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.exception("خطأ في التحقق من الجلسات: %s", e)
         return None
 
 @app.get("/health", include_in_schema=False)
@@ -505,14 +1285,23 @@ async def health_check():
 async def health_check_head():
     return ""
 
-async def auto_send_code():
+@app.get("/ready", include_in_schema=False)
+async def readiness_check():
+    """جاهزية هذه العملية: القائد بعد انتهاء استعادة الجلسات، والتابع عندما يستطيع الوصول إلى القائد
+
+    تُخدم محلياً في كل عملية (لا تُمرر إلى القائد) حتى تعبر عن حالة العملية نفسها.
+    """
+    if leader.is_leader:
+        return JSONResponse(status_code=200 if startup_state["ready"] else 503, content={"role": "leader", **startup_state})
+    reachable = await leader.leader_reachable()
+    return JSONResponse(status_code=200 if reachable else 503, content={"role": "follower", "ready": reachable})
+
+async def auto_send_code(phone: Optional[str] = None):
     """إرسال كود التحقق تلقائيًا للرقم المحدد"""
     try:
-        phone = "+963980907351"  # الرقم المحدد
-        session_name = f"{session_path}/{phone.replace('+', '')}"
-        session_file = f"{session_name}.session"
+        phone = resolve_phone(phone)
         
-        logger.info(f"محاولة إرسال كود التحقق للرقم: {phone}")
+        logger.info("محاولة إرسال كود التحقق للرقم: %s", phone)
         
         # التحقق من وجود جلسة نشطة ومفوضة أولاً
         if phone in clients and phone in active_sessions and active_sessions[phone]:
@@ -520,74 +1309,64 @@ async def auto_send_code():
             try:
                 client = clients[phone]
                 if client.is_connected() and await client.is_user_authorized():
-                    logger.info(f"يوجد جلسة نشطة ومفوضة للرقم {phone}، لا حاجة لإرسال كود جديد")
+                    logger.info("يوجد جلسة نشطة ومفوضة للرقم %s، لا حاجة لإرسال كود جديد", phone)
                     return phone
                 else:
-                    logger.warning(f"الجلسة الموجودة للرقم {phone} غير متصلة أو غير مفوضة، سيتم إنشاء جلسة جديدة")
+                    logger.warning("الجلسة الموجودة للرقم %s غير متصلة أو غير مفوضة، سيتم إنشاء جلسة جديدة", phone)
                     # إغلاق الجلسة الحالية
                     await client.disconnect()
                     active_sessions[phone] = False
+                    me_cache.pop(phone, None)
             except Exception as e:
-                logger.error(f"خطأ في التحقق من حالة الجلسة الحالية: {e}")
+                logger.error("خطأ في التحقق من حالة الجلسة الحالية: %s", e)
                 # إعادة تعيين حالة الجلسة
                 active_sessions[phone] = False
         
         # التحقق من وجود جلسة سابقة
-        if os.path.exists(session_file):
-            logger.info(f"تم العثور على ملف جلسة سابق: {session_file}")
-            # التحقق من حجم ملف الجلسة
-            file_size = os.path.getsize(session_file)
-            logger.info(f"حجم ملف الجلسة: {file_size} بايت")
-            
-            if file_size < 1:  # ملف صغير جداً قد يكون فارغاً أو تالفاً
-                logger.warning(f"ملف الجلسة صغير جداً ({file_size} بايت)، سيتم حذفه وإنشاء جلسة جديدة")
-                try:
-                    os.remove(session_file)
-                    logger.info(f"تم حذف ملف الجلسة الصغير: {session_file}")
-                except Exception as e:
-                    logger.error(f"فشل في حذف ملف الجلسة: {e}")
-            else:
-                # محاولة الاتصال بالجلسة الموجودة
-                try:
-                    client = TelegramClient(session_name, api_id, api_hash)
-                    await client.connect()
-                    
-                    # التحقق من حالة الاتصال
-                    is_connected = client.is_connected()
-                    logger.info(f"حالة الاتصال بالجلسة الموجودة: {is_connected}")
+        if await session_store.exists(phone):
+            logger.info("تم العثور على جلسة سابقة للرقم %s", phone)
+            # محاولة الاتصال بالجلسة الموجودة
+            client = None
+            try:
+                client = TelegramClient(await session_store.open(phone), api_id, api_hash)
+                await client.connect()
+                
+                # التحقق من حالة الاتصال
+                is_connected = client.is_connected()
+                logger.info("حالة الاتصال بالجلسة الموجودة: %s", is_connected)
+                
+                if is_connected:
+                    # التحقق من حالة التفويض
+                    is_authorized = await client.is_user_authorized()
+                    logger.info("حالة التفويض للجلسة الموجودة: %s", is_authorized)
                     
-                    if is_connected:
-                        # التحقق من حالة التفويض
-                        is_authorized = await client.is_user_authorized()
-                        logger.info(f"حالة التفويض للجلسة الموجودة: {is_authorized}")
-                        
-                        if is_authorized:
-                            # الجلسة متصلة ومفوضة
-                            logger.info(f"تم الاتصال بنجاح بالجلسة الموجودة للرقم {phone}")
-                            clients[phone] = client
-                            active_sessions[phone] = True
-                            asyncio.create_task(start_message_forwarding(client, phone))
-                            return phone
-                except Exception as e:
-                    logger.error(f"فشل في الاتصال بالجلسة الموجودة: {e}")
-                    try:
-                        # محاولة إغلاق الجلسة وحذف الملف
-                        if 'client' in locals() and client is not None:
-                            await client.disconnect()
-                        if os.path.exists(session_file):
-                            os.remove(session_file)
-                            logger.info(f"تم حذف ملف الجلسة التالف: {session_file}")
-                    except Exception as e2:
-                        logger.error(f"فشل في تنظيف الجلسة التالفة: {e2}")
+                    if is_authorized:
+                        # الجلسة متصلة ومفوضة
+                        logger.info("تم الاتصال بنجاح بالجلسة الموجودة للرقم %s", phone)
+                        clients[phone] = client
+                        active_sessions[phone] = True
+                        await refresh_me(client, phone)
+                        await start_message_forwarding(client, phone)
+                        return phone
+                    # الجلسة غير مصرح بها: نقلها إلى الحجر قبل إنشاء جلسة جديدة
+                    await client.disconnect()
+                    await session_store.quarantine(phone, "غير مصرح بها")
+            except Exception as e:
+                logger.error("فشل في الاتصال بالجلسة الموجودة: %s", e)
+                try:
+                    if client is not None:
+                        await client.disconnect()
+                except Exception as e2:
+                    logger.error("فشل في إغلاق الجلسة: %s", e2)
         
         # إنشاء عميل جديد وإرسال كود تحقق
         logger.info("إنشاء جلسة جديدة وإرسال كود تحقق")
-        client = TelegramClient(session_name, api_id, api_hash)
+        client = TelegramClient(await session_store.open(phone), api_id, api_hash)
         await client.connect()
         
         # التحقق من حالة الاتصال
         is_connected = client.is_connected()
-        logger.info(f"حالة الاتصال بالجلسة الجديدة: {is_connected}")
+        logger.info("حالة الاتصال بالجلسة الجديدة: %s", is_connected)
         
         if not is_connected:
             logger.error("فشل الاتصال بخادم Telegram")
@@ -595,31 +1374,30 @@ async def auto_send_code():
         
         # التحقق من حالة التفويض
         is_authorized = await client.is_user_authorized()
-        logger.info(f"حالة التفويض للجلسة الجديدة: {is_authorized}")
+        logger.info("حالة التفويض للجلسة الجديدة: %s", is_authorized)
         
         if not is_authorized:
-            logger.info(f"إرسال كود التحقق تلقائيًا للهاتف: {phone}")
+            logger.info("إرسال كود التحقق تلقائيًا للهاتف: %s", phone)
             try:
                 await client.send_code_request(phone)
                 clients[phone] = client
                 active_sessions[phone] = False  # تعيين الجلسة كغير نشطة حتى يتم التحقق من الكود
-                logger.info(f"تم إرسال كود التحقق بنجاح للرقم {phone}")
+                logger.info("تم إرسال كود التحقق بنجاح للرقم %s", phone)
                 return phone
             except Exception as e:
-                logger.error(f"فشل في إرسال كود التحقق: {e}")
+                logger.error("فشل في إرسال كود التحقق: %s", e)
                 await client.disconnect()
                 return None
         else:
             # المستخدم مسجل الدخول بالفعل
-            logger.info(f"المستخدم {phone} مسجل الدخول بالفعل")
+            logger.info("المستخدم %s مسجل الدخول بالفعل", phone)
             clients[phone] = client
             active_sessions[phone] = True
-            asyncio.create_task(start_message_forwarding(client, phone))
+            await refresh_me(client, phone)
+            await start_message_forwarding(client, phone)
             return phone
     except Exception as e:
-        logger.error(f"خطأ في إرسال كود التحقق تلقائيًا: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.exception("خطأ في إرسال كود التحقق تلقائيًا: %s", e)
         return None
 
 @app.post("/login", response_class=HTMLResponse)
@@ -629,8 +1407,9 @@ async def admin_login(request: Request, admin_password: str = Form(...)):
         # تسجيل محاولة تسجيل الدخول
         logger.info("تم التحقق من كلمة المرور بنجاح، جاري التحقق من الجلسات الموجودة")
         
-        # التحقق من وجود جلسات سابقة
-        connected_phone = await check_existing_sessions()
+        # التحقق من وجود جلسات سابقة لجميع الحسابات
+        results = await asyncio.gather(*(check_existing_sessions(account_phone) for account_phone in accounts))
+        connected_phone = next((result for result in results if result), None)
         
         # تعيين ملف تعريف الارتباط للمصادقة
         response = RedirectResponse(url="/", status_code=303)
@@ -638,7 +1417,7 @@ async def admin_login(request: Request, admin_password: str = Form(...)):
         
         if connected_phone:
             # تم الاتصال بجلسة موجودة
-            logger.info(f"تم الاتصال بنجاح بجلسة موجودة للرقم {connected_phone}")
+            logger.info("تم الاتصال بنجاح بجلسة موجودة للرقم %s", connected_phone)
         else:
             # لم يتم العثور على جلسات صالحة
             logger.info("لم يتم العثور على جلسات صالحة، سيتم عرض خيار إرسال كود التحقق")
@@ -655,7 +1434,7 @@ async def admin_login(request: Request, admin_password: str = Form(...)):
         })
 
 @app.post("/auto_send_code", response_class=HTMLResponse)
-async def auto_send_code_handler(request: Request, is_authenticated: bool = Depends(check_auth)):
+async def auto_send_code_handler(request: Request, phone: Optional[str] = Form(None), is_authenticated: bool = Depends(check_auth)):
     """معالجة إرسال كود التحقق تلقائيًا"""
     if not is_authenticated:
         return RedirectResponse(url="/", status_code=303)
@@ -663,36 +1442,34 @@ async def auto_send_code_handler(request: Request, is_authenticated: bool = Depe
     logger.info("بدء عملية إرسال كود التحقق تلقائيًا")
     
     # التحقق من وجود جلسة نشطة ومفوضة أولاً
-    phone = "+963980907351"  # الرقم المحدد
+    phone = resolve_phone(phone)
     
     # التحقق من وجود جلسة نشطة ومفوضة
     if phone in clients and clients[phone] is not None and phone in active_sessions and active_sessions[phone]:
         try:
             client = clients[phone]
             if await client.is_user_authorized():
-                logger.info(f"المستخدم {phone} مسجل الدخول بالفعل ولديه جلسة نشطة، لا حاجة لإرسال كود تحقق")
+                logger.info("المستخدم %s مسجل الدخول بالفعل ولديه جلسة نشطة، لا حاجة لإرسال كود تحقق", phone)
                 # المستخدم مسجل الدخول بالفعل، إعادة التوجيه إلى الصفحة الرئيسية
-                return RedirectResponse(url="/", status_code=303)
+                return RedirectResponse(url=phone_url("/", phone), status_code=303)
         except Exception as e:
-            logger.error(f"خطأ في التحقق من حالة الجلسة: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.exception("خطأ في التحقق من حالة الجلسة: %s", e)
     
     # إرسال كود التحقق تلقائيًا
     try:
         logger.info("محاولة إرسال كود التحقق تلقائيًا")
-        phone_result = await auto_send_code()
+        phone_result = await auto_send_code(phone)
         
         if phone_result:
             # تم إرسال الكود بنجاح أو العثور على جلسة نشطة
             if phone in active_sessions and active_sessions[phone]:
                 # تم العثور على جلسة نشطة ومفوضة
-                logger.info(f"تم العثور على جلسة نشطة ومفوضة للرقم {phone_result}")
-                return RedirectResponse(url="/", status_code=303)
+                logger.info("تم العثور على جلسة نشطة ومفوضة للرقم %s", phone_result)
+                return RedirectResponse(url=phone_url("/", phone), status_code=303)
             else:
                 # تم إرسال كود تحقق جديد
-                logger.info(f"تم إرسال كود التحقق بنجاح للرقم {phone_result}")
-                return RedirectResponse(url="/verify_code", status_code=303)
+                logger.info("تم إرسال كود التحقق بنجاح للرقم %s", phone_result)
+                return RedirectResponse(url=phone_url("/verify_code", phone), status_code=303)
         else:
             logger.error("فشل في إرسال كود التحقق تلقائيًا")
             # فشل في إرسال الكود تلقائيًا
@@ -703,12 +1480,11 @@ async def auto_send_code_handler(request: Request, is_authenticated: bool = Depe
                 "error": "فشل في إرسال كود التحقق تلقائيًا، يرجى المحاولة مرة أخرى",
                 "success": None,
                 "is_authenticated": True,
-                "has_active_session": False
+                "has_active_session": False,
+                "phone": phone
             })
     except Exception as e:
-        logger.error(f"استثناء أثناء إرسال كود التحقق: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.exception("استثناء أثناء إرسال كود التحقق: %s", e)
         
         return templates.TemplateResponse("login.html", {
             "request": request,
@@ -716,7 +1492,8 @@ async def auto_send_code_handler(request: Request, is_authenticated: bool = Depe
             "show_code": False,
             "error": f"حدث خطأ أثناء إرسال كود التحقق: {str(e)}",
             "success": None,
-            "is_authenticated": True
+            "is_authenticated": True,
+            "phone": phone
         })
 
 # تم إزالة وظيفة send_code لأننا نستخدم الآن auto_send_code
@@ -735,194 +1512,2325 @@ async def send_code(request: Request, phone: str = Form(...), code: str = Form(N
         "is_authenticated": True
     })
 
-async def start_message_forwarding(client: TelegramClient, phone: str):
-    """بدء عملية تحويل الرسائل"""
+def media_file_name(message) -> str:
+    """استخراج اسم ملف الوسائط من الرسالة"""
+    if message.document:
+        file_name = next((attr.file_name for attr in message.document.attributes if hasattr(attr, 'file_name')), None)
+        if file_name:
+            return file_name
+    return f"{message.id}{message.file.ext if message.file else ''}"
+
+async def download_media_stream(client: TelegramClient, message, content_hashes: Optional[List[str]] = None) -> Tuple[tempfile.SpooledTemporaryFile, int]:
+    """تحميل الوسائط على دفعات إلى مخزن في الذاكرة ينتقل إلى ملف مؤقت عند تجاوز الحد
+
+    عند تمرير content_hashes تُضاف إليها بصمة SHA-256 للمحتوى المحسوبة أثناء نفس التحميل.
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=media_spool_threshold)
+    digest = hashlib.sha256() if content_hashes is not None else None
+    size = 0
     try:
-        logger.info(f"بدء تحويل الرسائل للمستخدم {phone}")
+        with DOWNLOAD_SECONDS.time(mode="stream"):
+            async for chunk in client.iter_download(message.media, request_size=media_chunk_size):
+                buffer.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+                size += len(chunk)
+    except Exception:
+        buffer.close()
+        raise
+    if digest is not None:
+        content_hashes.append(digest.hexdigest())
+    DOWNLOAD_BYTES.inc(size, mode="stream")
+    buffer.seek(0)
+    logger.info("تم تحميل %s بايت إلى الذاكرة (%s)", size, 'ملف مؤقت' if size > media_spool_threshold else 'ذاكرة')
+    return buffer, size
 
-        @client.on(events.NewMessage(chats=source_channel))
-        async def message_handler(event):
-            try:
-                if event.is_private and event.sender_id == (await client.get_me()).id:
-                    return
+class ParallelTransfer:
+    """نقل ملف كبير على أجزاء متوازية مع حفظ التقدم على القرص لاستئنافه بعد انقطاع الاتصال
 
-                message = event.message
-                to_id = receiver_account
+    يتم تحميل الأجزاء بطلبات iter_download متزامنة حسب الإزاحة إلى ملف جزئي، ثم رفعها بطلبات
+    SaveBigFilePartRequest متزامنة بنفس معرف الملف. الحالة (الأجزاء المكتملة ومعرف الرفع) تحفظ
+    في ملف JSON بجانب الملف الجزئي. الأجزاء المحملة صالحة لأي حساب، أما جلسة الرفع فتخص الحساب
+    الذي أنشأها، لذلك يُعاد الرفع من البداية إذا استأنف النقل حساب آخر من مجموعة التسليم.
+    """
 
-                # await client.forward_messages(source_channel, message)
-                
-                if message.photo : # and message.text == "العلامات التي سوف تصدر اليوم"
-                    logger.info("Cleaning downloads directory before new image download.")
-                    for filename in os.listdir(downloads_path):
-                        if filename.endswith('zip'):
-                            break
-                        file_path = os.path.join(downloads_path, filename)
-                        try:
-                            if os.path.isfile(file_path) or os.path.islink(file_path):
-                                os.unlink(file_path)
-                        except Exception as e:
-                            logger.error(f'Failed to delete {file_path}. Reason: {e}')
-                    
-                    logger.info("تم العثور على صورة بالوصف المطلوب، جاري تحميلها...")
-                    file_path = await message.download_media(file=downloads_path)
-                    logger.info(f"تم تحميل الصورة: {file_path}")
-                    return
+    # الحد الذي يعتبر Telegram بعده الملف كبيراً
+    BIG_FILE_SIZE = 10 * 1024 * 1024
 
-                if message.document:
-                    file_name = next((attr.file_name for attr in message.document.attributes if hasattr(attr, 'file_name')), None)
-                    if file_name == "علامات_كلية_الآداب_والعلوم_الانسانية_ـ_ف2_ـ_2024_2025.zip":
-                        logger.info("Cleaning downloads directory before new zip download.")
-                        for filename in os.listdir(downloads_path):
-                            if filename.endswith('zip'):
-                                file_path = os.path.join(downloads_path, filename)
-                                try:
-                                    if os.path.isfile(file_path) or os.path.islink(file_path):
-                                        os.unlink(file_path)
-                                except Exception as e:
-                                    logger.error(f'Failed to delete {file_path}. Reason: {e}')
-
-                        logger.info("تم العثور على ملف ZIP للعلامات، جاري تحميله وإرساله...")
-                        file_path = await message.download_media(file=downloads_path)
-                        logger.info(f"تم تحميل الملف: {file_path}")
-                        
-                        await client.send_file(to_id, file_path, caption="ملف العلامات")
-                        await client.send_file(target_channel_id, file_path, caption="لا تنسوا إخوانكم في غزة 🇵🇸")
-                        logger.info(f"تم إرسال الملف إلى {to_id}")
-
-                        try:
-                            os.remove(file_path)
-                            logger.info(f"تم حذف الملف المؤقت: {file_path}")
-                        except OSError as e:
-                            logger.error(f"خطأ في حذف الملف {file_path}: {e}")
-                        return
-                # logger.info(f"تم تحويل رسالة من {phone} من القناة {source_channel}")
+    def __init__(self, client: TelegramClient, message):
+        self.client = client
+        self.message = message
+        self.phone = client_phone(client)
+        self.size = message.file.size
+        self.file_name = media_file_name(message)
+        self.part_count = (self.size + media_part_size - 1) // media_part_size
+        self.is_big = self.size > self.BIG_FILE_SIZE
+        key = f"{message.document.id}"
+        self.data_path = os.path.join(media_parts_path, f"{key}.part")
+        self.state_path = os.path.join(media_parts_path, f"{key}.json")
+        self.state: Dict[str, object] = {}
+        self.downloaded: Set[int] = set()
+        self.uploaded: Set[int] = set()
+        self.saver = DebouncedSaver(self.state_path, self._snapshot)
 
-            except Exception as e:
-                logger.error(f"خطأ في معالجة الرسالة: {e}")
-                import traceback
-                logger.error(traceback.format_exc())
-        
-        @client.on(events.NewMessage(chats=receiver_account))
-        async def receiver_message_handler(event):
-            if event.raw_text.strip() == 'تم':
-                logger.info(f"Received 'تم' from {receiver_account}. Looking for today's image.")
-                
-                try:
-                    today = datetime.date.today()
-                    latest_image_path = None
-                    latest_mtime = 0
-
-                    for filename in os.listdir(downloads_path):
-                        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                            file_path = os.path.join(downloads_path, filename)
-                            mtime = os.path.getmtime(file_path)
-                            file_date = datetime.date.fromtimestamp(mtime)
-
-                            if file_date == today and mtime > latest_mtime:
-                                latest_image_path = file_path
-                                latest_mtime = mtime
-                    
-                    message_text = "تم إضافة علامات جديدة إلى بوت علاماتي 😍❤️"
-                    if latest_image_path:
-                        logger.info(f"Found latest image from today: {latest_image_path}")
-                        await client.send_file(target_channel_id, latest_image_path, caption=message_text)
-                        logger.info(f"Sent image to target channel {target_channel_id}")
-                    else:
-                        logger.info("No image from today found. Sending text message instead.")
-                        await client.send_message(target_channel_id, message_text)
-                        logger.info(f"Sent text-only message to target channel {target_channel_id}")
+    def _load(self) -> dict:
+        """قراءة حالة نقل سابق أو تجهيز ملف جزئي جديد"""
+        state = read_json(self.state_path) if os.path.exists(self.data_path) else None
+        if isinstance(state, dict) and state.get("size") == self.size and state.get("part_size") == media_part_size:
+            if state.get("phone") != self.phone:
+                # أجزاء الرفع غير موجودة على خوادم هذا الحساب (FILE_PART_MISSING)
+                logger.info("استئناف نقل بحساب مختلف (%s بدلاً من %s)، سيعاد الرفع", self.phone, state.get("phone"))
+                state.update({"phone": self.phone, "file_id": None, "uploaded": []})
+            return state
+        with open(self.data_path, 'wb') as f:
+            f.truncate(self.size)
+        return {"size": self.size, "part_size": media_part_size, "downloaded": [], "phone": self.phone, "file_id": None, "uploaded": []}
 
-                except Exception as e:
-                    logger.error(f"Error in receiver_message_handler: {e}")
-                    import traceback
-                    logger.error(traceback.format_exc())
+    def _snapshot(self) -> dict:
+        self.state["downloaded"] = sorted(self.downloaded)
+        self.state["uploaded"] = sorted(self.uploaded)
+        return dict(self.state)
 
-            if event.raw_text.strip() == 'test':
-                logger.info(f"Received 'test' from {receiver_account}. Looking for today's image.")    
-                try:
-                    message_text = "working"
-                    await client.send_message(receiver_account, message_text)
-                except Exception as e:
-                    logger.error(f"Error in receiver_message_handler: {e}")
-                    import traceback
-                    logger.error(traceback.format_exc())            
-            
-            message = event.message
-            if message.document:
-                    file_name = next((attr.file_name for attr in message.document.attributes if hasattr(attr, 'file_name')), None)
-                    if file_name == "marks.csv":
-                        logger.info("Cleaning downloads directory before new csv download.")
-                        for filename in os.listdir(downloads_path):
-                            if filename.endswith('csv'):
-                                file_path = os.path.join(downloads_path, filename)
-                                try:
-                                    if os.path.isfile(file_path) or os.path.islink(file_path):
-                                        os.unlink(file_path)
-                                except Exception as e:
-                                    logger.error(f'Failed to delete {file_path}. Reason: {e}')
-
-                        logger.info("تم العثور على ملف ZIP للعلامات، جاري تحميله وإرساله...")
-                        file_path = await message.download_media(file=downloads_path)
-                        logger.info(f"تم تحميل الملف: {file_path}")
-                        
-                        await client.send_file(bot_ad, file_path, caption="ملف العلامات")
-                        logger.info(f"تم إرسال الملف إلى {bot_ad}")
-
-                        try:
-                            os.remove(file_path)
-                            logger.info(f"تم حذف الملف المؤقت: {file_path}")
-                        except OSError as e:
-                            logger.error(f"خطأ في حذف الملف {file_path}: {e}")
-                        return
-        # تشغيل العميل
-        await client.run_until_disconnected()
+    def _write_part(self, index: int, data: bytes):
+        with open(self.data_path, 'r+b') as f:
+            f.seek(index * media_part_size)
+            f.write(data)
 
-    except Exception as e:
-        logger.error(f"خطأ في عملية تحويل الرسائل للمستخدم {phone}: {e}")
-    finally:
-        active_sessions[phone] = False
-        logger.info(f"انتهت عملية تحويل الرسائل للمستخدم {phone}")
+    def _read_part(self, index: int) -> bytes:
+        with open(self.data_path, 'rb') as f:
+            f.seek(index * media_part_size)
+            return f.read(media_part_size)
 
-@app.get("/status")
-async def get_status():
-    """عرض حالة الجلسات النشطة"""
-    active_count = sum(active_sessions.values())
-    total_clients = len(clients)
-    
-    return {
-        "active_sessions": active_count,
-        "total_clients": total_clients,
-        "sessions": active_sessions
-    }
+    def _md5(self) -> str:
+        digest = hashlib.md5()
+        with open(self.data_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(media_part_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
 
-@app.get("/logout/{phone}")
-async def logout(phone: str):
-    """تسجيل الخروج من حساب معين"""
-    try:
-        if phone in clients:
-            client = clients[phone]
-            await client.disconnect()
-            del clients[phone]
-            active_sessions[phone] = False
-            return {"message": f"تم تسجيل الخروج من {phone}"}
-        else:
-            raise HTTPException(status_code=404, detail="الحساب غير موجود")
-    except Exception as e:
-        logger.error(f"خطأ في تسجيل الخروج: {e}")
-        raise HTTPException(status_code=500, detail="خطأ في تسجيل الخروج")
+    def _discard(self):
+        for path in (self.data_path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """إغلاق جميع الجلسات عند إيقاف التطبيق"""
-    pass
-    # logger.info("إغلاق جميع الجلسات...")
-    # for phone, client in clients.items():
-    #     try:
-    #         await client.disconnect()
-    #     except Exception as e:
-    #         logger.error(f"خطأ في إغلاق جلسة {phone}: {e}")
-    # clients.clear()
-    # active_sessions.clear()
+    async def prepare(self):
+        self.state = await run_file_op(self._load)
+        self.downloaded = set(self.state["downloaded"])
+        self.uploaded = set(self.state["uploaded"])
+        if self.state["file_id"] is None:
+            self.state["file_id"] = random.randrange(-2 ** 63, 2 ** 63)
+        parallel_stats["transfers"] += 1
+        if self.downloaded:
+            parallel_stats["resumed"] += 1
+            logger.info("استئناف نقل %s: %s/%s جزء محمل، %s جزء مرفوع", self.file_name, len(self.downloaded), self.part_count, len(self.uploaded))
+
+    async def checkpoint(self):
+        await self.saver.save()
+
+    async def _run_parts(self, pending: List[int], transfer_part: Callable[[int], object]):
+        """تنفيذ الأجزاء المتبقية بعدد محدود من العمال مع حفظ التقدم بعد كل جزء"""
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in pending:
+            queue.put_nowait(index)
+
+        async def worker():
+            while not queue.empty():
+                index = queue.get_nowait()
+                await transfer_part(index)
+                await self.checkpoint()
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(media_parallel_workers, len(pending)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def download(self) -> int:
+        """تحميل الأجزاء غير المكتملة وإرجاع عدد البايتات المحملة"""
+        pending = [index for index in range(self.part_count) if index not in self.downloaded]
+        transferred = 0
+
+        async def download_part(index: int):
+            nonlocal transferred
+            data = b''
+            async for chunk in self.client.iter_download(self.message.media, offset=index * media_part_size,
+                                                         request_size=media_part_size, limit=1):
+                data += chunk
+            await run_file_op(self._write_part, index, data)
+            self.downloaded.add(index)
+            transferred += len(data)
+            parallel_stats["parts_downloaded"] += 1
+
+        await self._run_parts(pending, download_part)
+        return transferred
+
+    async def upload(self) -> Tuple[Union[InputFile, InputFileBig], int]:
+        """رفع الأجزاء غير المرفوعة وإرجاع الملف المرفوع وعدد البايتات المرفوعة"""
+        file_id = self.state["file_id"]
+        pending = [index for index in range(self.part_count) if index not in self.uploaded]
+        transferred = 0
+
+        async def upload_part(index: int):
+            nonlocal transferred
+            data = await run_file_op(self._read_part, index)
+            if self.is_big:
+                request = SaveBigFilePartRequest(file_id, index, self.part_count, data)
+            else:
+                request = SaveFilePartRequest(file_id, index, data)
+            if not await self.client(request):
+                raise ConnectionError(f"فشل في رفع الجزء {index} من {self.file_name}")
+            self.uploaded.add(index)
+            transferred += len(data)
+            parallel_stats["parts_uploaded"] += 1
+
+        await self._run_parts(pending, upload_part)
+        if self.is_big:
+            return InputFileBig(file_id, self.part_count, self.file_name), transferred
+        return InputFile(file_id, self.part_count, self.file_name, await run_file_op(self._md5)), transferred
+
+    async def discard(self):
+        await run_file_op(self._discard)
+
+async def upload_message_media_parallel(client: TelegramClient, message):
+    """نقل ملف كبير على أجزاء متوازية، مع الاحتفاظ بالأجزاء المكتملة إذا انقطع الاتصال"""
+    transfer = ParallelTransfer(client, message)
+    await transfer.prepare()
+    with DOWNLOAD_SECONDS.time(mode="parallel"):
+        downloaded = await transfer.download()
+    DOWNLOAD_BYTES.inc(downloaded, mode="parallel")
+    logger.info("تم تحميل %s على %s جزء (%s طلبات متزامنة)", transfer.file_name, transfer.part_count, media_parallel_workers)
+    with UPLOAD_SECONDS.time(mode="parallel"):
+        uploaded, sent = await transfer.upload()
+    UPLOAD_BYTES.inc(sent, mode="parallel")
+    await transfer.discard()
+    return uploaded
+
+async def upload_message_media(client: TelegramClient, message, content_hashes: Optional[List[str]] = None,
+                               before_upload: Optional[Callable[[], bool]] = None):
+    """تحميل وسائط الرسالة مرة واحدة ورفعها مرة واحدة وإرجاع الملف المرفوع
+
+    بصمة المحتوى (content_hashes) تُحسب فقط في وضع stream لأنه يمر على البيانات بالترتيب.
+    before_upload تُستدعى بعد التحميل وقبل الرفع، وإذا أعادت False لا يتم الرفع وتُعاد None.
+    """
+    file_name = media_file_name(message)
+    if media_parallel_threshold and message.document and message.file and message.file.size >= media_parallel_threshold:
+        return await upload_message_media_parallel(client, message)
+
+    if media_pipeline_mode == 'stream':
+        buffer, size = await download_media_stream(client, message, content_hashes)
+        if before_upload is not None and not before_upload():
+            buffer.close()
+            return None
+        with buffer, UPLOAD_SECONDS.time(mode="stream"):
+            uploaded = await client.upload_file(buffer, file_size=size, file_name=file_name)
+        UPLOAD_BYTES.inc(size, mode="stream")
+        return uploaded
+
+    size = message.file.size if message.file else 0
+    with DOWNLOAD_SECONDS.time(mode="disk"):
+        file_path = await message.download_media(file=downloads_path)
+    DOWNLOAD_BYTES.inc(size or 0, mode="disk")
+    logger.info("تم تحميل الملف: %s", file_path)
+    try:
+        with UPLOAD_SECONDS.time(mode="disk"):
+            uploaded = await client.upload_file(file_path, file_name=file_name)
+        UPLOAD_BYTES.inc(size or 0, mode="disk")
+        return uploaded
+    finally:
+        try:
+            await aio_remove(file_path)
+            logger.info("تم حذف الملف المؤقت: %s", file_path)
+        except OSError as e:
+            logger.error("خطأ في حذف الملف %s: %s", file_path, e)
+
+class PeerCache:
+    """ذاكرة الوجهات المحلولة (InputPeer) لكل حساب
+
+    تُحل الوجهات المعرفة مسبقاً عند بدء خط التحويل، وتُحفظ في ملف JSON، ويتم تحديثها في الخلفية
+    على فترات متباعدة لتجنب ResolveUsername المقيد بشدة مع كل إرسال.
+    """
+
+    def __init__(self):
+        self.cache_file = settings.peer_cache_file
+        self.refresh_interval = settings.peer_refresh_interval
+        self.peers: Dict[str, object] = {}
+        self.resolved_at: Dict[str, float] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.loaded = False
+        self.saver = DebouncedSaver(self.cache_file, self._snapshot)
+        self.refresh_task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "refreshes": 0, "failures": 0, "invalidated": 0}
+
+    @staticmethod
+    def key(phone: str, dest: Union[int, str]) -> str:
+        return f"{phone}:{dest}"
+
+    @staticmethod
+    def _to_row(peer) -> Optional[list]:
+        if isinstance(peer, InputPeerUser):
+            return ["user", peer.user_id, peer.access_hash]
+        if isinstance(peer, InputPeerChannel):
+            return ["channel", peer.channel_id, peer.access_hash]
+        if isinstance(peer, InputPeerChat):
+            return ["chat", peer.chat_id, 0]
+        if isinstance(peer, InputPeerSelf):
+            return ["self", 0, 0]
+        return None
+
+    @staticmethod
+    def _from_row(row: list):
+        kind, peer_id, access_hash = row
+        if kind == "user":
+            return InputPeerUser(peer_id, access_hash)
+        if kind == "channel":
+            return InputPeerChannel(peer_id, access_hash)
+        if kind == "chat":
+            return InputPeerChat(peer_id)
+        return InputPeerSelf()
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            loaded = await run_file_op(read_json, self.cache_file, {})
+            for key, entry in loaded.items():
+                if key not in self.peers:
+                    self.peers[key] = self._from_row(entry["peer"])
+                    self.resolved_at[key] = entry["resolved_at"]
+            self.loaded = True
+
+    def _snapshot(self) -> Dict[str, dict]:
+        return {
+            key: {"peer": self._to_row(peer), "resolved_at": self.resolved_at.get(key, 0)}
+            for key, peer in self.peers.items() if self._to_row(peer) is not None
+        }
+
+    def _store(self, key: str, peer):
+        self.peers[key] = peer
+        self.resolved_at[key] = time.time()
+        self.saver.schedule()
+
+    async def get(self, client: TelegramClient, dest: Union[int, str]):
+        """الوجهة المحلولة من الذاكرة، أو حلها مرة واحدة حتى مع الطلبات المتزامنة"""
+        phone = client_phone(client)
+        if phone is None:
+            return dest
+        await self.ensure_loaded()
+        key = self.key(phone, dest)
+        peer = self.peers.get(key)
+        if peer is not None:
+            self.stats["hits"] += 1
+            return peer
+        async with self.locks.setdefault(key, asyncio.Lock()):
+            if key not in self.peers:
+                self.stats["misses"] += 1
+                self._store(key, await client.get_input_entity(dest))
+        return self.peers[key]
+
+    def invalidate(self, client: TelegramClient, dest: Union[int, str]):
+        """حذف وجهة من الذاكرة بعد خطأ يدل على أن المرجع لم يعد صالحاً"""
+        phone = client_phone(client)
+        if phone is not None and self.peers.pop(self.key(phone, dest), None) is not None:
+            self.stats["invalidated"] += 1
+            logger.warning("تم حذف الوجهة %s من ذاكرة الوجهات للحساب %s", dest, phone)
+
+    async def refresh(self, client: TelegramClient, phone: str, dest: Union[int, str]):
+        """حل الوجهة من الخادم (ResolveUsername لأسماء المستخدمين) وتحديث الذاكرة"""
+        try:
+            peer = telethon_utils.get_input_peer(await client.get_entity(dest))
+            self._store(self.key(phone, dest), peer)
+            self.stats["refreshes"] += 1
+        except FloodWaitError as e:
+            logger.warning("FloodWait لمدة %s ثانية عند تحديث الوجهة %s", e.seconds, dest)
+            await asyncio.sleep(e.seconds)
+        except Exception as e:
+            self.stats["failures"] += 1
+            logger.error("فشل في حل الوجهة %s للحساب %s: %s", dest, phone, e)
+
+    async def warm_up(self, client: TelegramClient, phone: str):
+        """حل جميع وجهات الحساب المعرفة مسبقاً إذا لم تكن في الذاكرة"""
+        await self.ensure_loaded()
+        account = accounts[phone]
+        for dest in (account.receiver_account, account.target_channel_id, account.bot_ad):
+            # الوجهات غير المعرفة (مثل BOT_AD عند عدم تعيينه) لا يتم حلها
+            if dest is None or dest == '':
+                continue
+            if self.key(phone, dest) not in self.peers:
+                await self.refresh(client, phone, dest)
+        logger.info("تم تجهيز ذاكرة الوجهات للحساب %s", phone)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(60)
+            now = time.time()
+            for key in list(self.peers):
+                if now - self.resolved_at.get(key, 0) < self.refresh_interval:
+                    continue
+                phone, dest = key.split(":", 1)
+                client = clients.get(phone)
+                if client is None or not active_sessions.get(phone):
+                    continue
+                await self.refresh(client, phone, parse_peer(dest))
+                # تباعد بين طلبات الحل لتجنب حدود المعدل
+                await asyncio.sleep(1)
+
+    async def start(self):
+        await self.ensure_loaded()
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+            await asyncio.gather(self.refresh_task, return_exceptions=True)
+            self.refresh_task = None
+
+peers = PeerCache()
+
+class TokenBucket:
+    """دلو رموز لتحديد معدل الإرسال إلى وجهة واحدة"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class OutboundScheduler:
+    """جدولة جميع عمليات الإرسال: تحديد المعدل لكل وجهة، احترام FloodWait، وإعادة المحاولة
+
+    عمليات التسليم التي تفشل نهائياً تُحفظ في طابور إعادة محاولة دائم (ملف JSON)
+    ويعاد تنفيذها في الخلفية مع تأخير تصاعدي.
+    """
+
+    def __init__(self):
+        self.rate = settings.outbound_rate
+        self.burst = settings.outbound_burst
+        self.max_retries = settings.outbound_max_retries
+        self.max_inline_wait = settings.outbound_max_inline_wait
+        self.retry_file = settings.outbound_retry_file
+        self.retry_interval = settings.outbound_retry_interval
+        self.retry_max_attempts = settings.outbound_retry_max_attempts
+        self.buckets: Dict[Union[int, str], TokenBucket] = {}
+        self.retry_queue: List[dict] = []
+        self.saver = DebouncedSaver(self.retry_file, lambda: list(self.retry_queue))
+        self.retry_task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, float] = {
+            "sent": 0, "retries": 0, "flood_waits": 0, "flood_wait_seconds": 0,
+            "send_errors": 0, "failed": 0, "queued": 0, "recovered": 0, "dropped": 0
+        }
+
+    def bucket(self, dest: Union[int, str]) -> TokenBucket:
+        if dest not in self.buckets:
+            self.buckets[dest] = TokenBucket(self.rate, self.burst)
+        return self.buckets[dest]
+
+    async def call(self, client: TelegramClient, dest: Union[int, str], factory):
+        """تنفيذ عملية إرسال إلى وجهة مع تحديد المعدل وإعادة المحاولة
+
+        يتم تمرير الوجهة المحلولة من ذاكرة الوجهات إلى factory.
+        يتم انتظار FloodWait القصير داخلياً، أما الطويل فيُعاد كخطأ
+        حتى يتمكن المستدعي من نقل التسليم إلى حساب آخر.
+        """
+        attempt = 0
+        while True:
+            await self.bucket(dest).acquire()
+            try:
+                peer = await peers.get(client, dest)
+                with SEND_SECONDS.time():
+                    result = await factory(peer)
+                self.stats["sent"] += 1
+                return result
+            except FloodWaitError as e:
+                self.stats["flood_waits"] += 1
+                self.stats["flood_wait_seconds"] += e.seconds
+                if e.seconds > self.max_inline_wait or attempt >= self.max_retries:
+                    self.stats["send_errors"] += 1
+                    raise
+                logger.warning("FloodWait لمدة %s ثانية عند الإرسال إلى %s، سيتم الانتظار ثم إعادة المحاولة", e.seconds, dest)
+                await asyncio.sleep(e.seconds + random.uniform(0, 1))
+            except (ConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    self.stats["send_errors"] += 1
+                    raise
+                delay = min(30, 2 ** attempt) + random.uniform(0, 1)
+                logger.warning("خطأ مؤقت عند الإرسال إلى %s: %s، إعادة المحاولة بعد %.1f ثانية", dest, e, delay)
+                await asyncio.sleep(delay)
+            except Exception as e:
+                # قد ينجح التسليم لاحقاً بالرفع الاحتياطي أو حساب آخر أو طابور إعادة المحاولة،
+                # لذلك لا يُحسب كفشل نهائي هنا
+                self.stats["send_errors"] += 1
+                if any(marker in str(e).upper() for marker in ('PEER', 'ENTITY', 'CHANNEL_INVALID', 'CHANNEL_PRIVATE')):
+                    peers.invalidate(client, dest)
+                raise
+            attempt += 1
+            self.stats["retries"] += 1
+
+    async def enqueue(self, kind: str, phone: str, dest: Union[int, str], **payload):
+        """حفظ عملية تسليم فاشلة في طابور إعادة المحاولة الدائم"""
+        self.retry_queue.append({
+            "kind": kind,
+            "phone": phone,
+            "dest": dest,
+            "attempts": 0,
+            "next_attempt": time.time() + self.retry_interval,
+            **payload
+        })
+        self.stats["queued"] += 1
+        logger.warning("تمت إضافة عملية تسليم (%s) إلى %s إلى طابور إعادة المحاولة", kind, dest)
+        await self.save()
+
+    async def enqueue_media(self, phone: str, message, deliveries: List[Tuple[Union[int, str], str]]):
+        """حفظ تسليمات وسائط فاشلة بمعرف الرسالة المصدر لإعادة جلبها لاحقاً"""
+        for dest, caption in deliveries:
+            await self.enqueue("media", phone, dest, caption=caption, chat_id=message.chat_id, message_id=message.id)
+
+    async def save(self):
+        await self.saver.save()
+
+    async def execute(self, job: dict) -> bool:
+        """إعادة تنفيذ عملية تسليم محفوظة"""
+        client = clients.get(job["phone"])
+        if client is None or not active_sessions.get(job["phone"]):
+            return False
+        if job["kind"] == "message":
+            await self.call(client, job["dest"], lambda peer: client.send_message(peer, job["text"]))
+            return True
+        if job["kind"] == "media":
+            message = await client.get_messages(job["chat_id"], ids=job["message_id"])
+            if message is None or message.media is None:
+                logger.error("الرسالة المصدر %s لم تعد موجودة، سيتم حذف العملية", job['message_id'])
+                self.stats["failed"] += 1
+                self.retry_queue.remove(job)
+                return False
+            errors = await fan_out_media(client, message, [(job["dest"], job["caption"])])
+            return errors[job["dest"]] is None
+        logger.error("نوع عملية غير معروف في طابور إعادة المحاولة: %s", job['kind'])
+        return True
+
+    async def _retry_loop(self):
+        while True:
+            await asyncio.sleep(self.retry_interval)
+            now = time.time()
+            due = [job for job in self.retry_queue if job["next_attempt"] <= now]
+            if not due:
+                continue
+            for job in due:
+                try:
+                    done = await self.execute(job)
+                except Exception as e:
+                    logger.error("فشلت إعادة محاولة التسليم إلى %s: %s", job['dest'], e)
+                    done = False
+                if job not in self.retry_queue:
+                    continue
+                if done:
+                    self.retry_queue.remove(job)
+                    self.stats["recovered"] += 1
+                    continue
+                job["attempts"] += 1
+                if job["attempts"] >= self.retry_max_attempts:
+                    self.retry_queue.remove(job)
+                    self.stats["dropped"] += 1
+                    self.stats["failed"] += 1
+                    logger.error("تم التخلي عن التسليم إلى %s بعد %s محاولات", job['dest'], job['attempts'])
+                else:
+                    job["next_attempt"] = now + self.retry_interval * (2 ** job["attempts"]) + random.uniform(0, self.retry_interval)
+            await self.save()
+
+    async def start(self):
+        """تحميل الطابور الدائم وبدء عامل إعادة المحاولة"""
+        self.retry_queue = await run_file_op(read_json, self.retry_file, [])
+        if self.retry_queue:
+            logger.info("تم تحميل %s عملية من طابور إعادة المحاولة", len(self.retry_queue))
+        if self.retry_task is None or self.retry_task.done():
+            self.retry_task = asyncio.create_task(self._retry_loop())
+
+    async def stop(self):
+        if self.retry_task is not None:
+            self.retry_task.cancel()
+            await asyncio.gather(self.retry_task, return_exceptions=True)
+            self.retry_task = None
+        await self.save()
+
+    def metrics(self) -> Dict[str, float]:
+        return {**self.stats, "retry_queue": len(self.retry_queue), "destinations": len(self.buckets)}
+
+outbound = OutboundScheduler()
+
+async def send_to_all(client: TelegramClient, file, deliveries: List[Tuple[Union[int, str], str]], **kwargs) -> Dict[Union[int, str], Optional[Exception]]:
+    """إرسال نفس الملف (مرجع وسائط أو ملف مرفوع) إلى جميع الوجهات بالتوازي"""
+    results = await asyncio.gather(
+        *(outbound.call(client, dest, functools.partial(client.send_file, file=file, caption=caption, **kwargs))
+          for dest, caption in deliveries),
+        return_exceptions=True
+    )
+    return {
+        dest: (result if isinstance(result, Exception) else None)
+        for (dest, _), result in zip(deliveries, results)
+    }
+
+class MediaDedupCache:
+    """ذاكرة LRU محدودة بمدة صلاحية للوسائط التي تم تسليمها إلى كل وجهة
+
+    المفتاح هو معرف المستند أو الصورة في Telegram مع access_hash والحجم، دون تحميل أي بيانات.
+    مع MEDIA_DEDUP_CONTENT_HASH=1 تُحسب بصمة SHA-256 من البيانات التي يحملها الرفع الاحتياطي أصلاً
+    (وضع stream)، وقبل الرفع تُحذف الوجهات التي استلمت نفس المحتوى بمعرف آخر (إعادة نشر نفس الملف).
+    الإرسال بالمرجع لا يحمّل البيانات، لذلك لا يمر بفحص البصمة.
+    """
+
+    def __init__(self):
+        self.max_entries = settings.media_dedup_max
+        self.ttl = settings.media_dedup_ttl
+        self.content_hash = settings.media_dedup_content_hash
+        self.cache_file = settings.media_dedup_file
+        self.entries: "OrderedDict[str, float]" = OrderedDict()
+        self.loaded = False
+        self.saver = DebouncedSaver(self.cache_file, lambda: dict(self.entries))
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "content_duplicates": 0}
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            loaded = await run_file_op(read_json, self.cache_file, {})
+            for key, added_at in sorted(loaded.items(), key=lambda item: item[1]):
+                self.entries.setdefault(key, added_at)
+            self.loaded = True
+
+    def seen(self, key: str) -> bool:
+        added_at = self.entries.get(key)
+        if added_at is None:
+            return False
+        if time.time() - added_at > self.ttl:
+            del self.entries[key]
+            return False
+        self.entries.move_to_end(key)
+        return True
+
+    def add(self, key: str):
+        self.entries[key] = time.time()
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.saver.schedule()
+
+    async def keys_for(self, message) -> List[str]:
+        """مفاتيح إزالة التكرار لوسائط الرسالة (من البيانات الوصفية فقط)"""
+        await self.ensure_loaded()
+        if message.document:
+            document = message.document
+            return [f"document:{document.id}:{document.access_hash}:{document.size}"]
+        if message.photo:
+            return [f"photo:{message.photo.id}:{message.photo.access_hash}"]
+        return []
+
+    def fresh_content(self, content_hash: str, deliveries: List[Tuple[Union[int, str], str]]) -> List[Tuple[Union[int, str], str]]:
+        """الوجهات التي لم تستلم هذا المحتوى من قبل (بأي معرف)"""
+        fresh = []
+        for dest, caption in deliveries:
+            if self.seen(f"sha256:{content_hash}:{dest}"):
+                self.stats["content_duplicates"] += 1
+                logger.info("تم تخطي إرسال محتوى سبق إرساله إلى %s بمعرف مختلف", dest)
+            else:
+                fresh.append((dest, caption))
+        return fresh
+
+media_dedup = MediaDedupCache()
+
+async def fan_out_media(client: TelegramClient, message, deliveries: List[Tuple[Union[int, str], str]]) -> Dict[Union[int, str], Optional[Exception]]:
+    """إرسال وسائط الرسالة إلى عدة وجهات مع تخطي الوجهات التي استلمت نفس الملف سابقاً"""
+    keys = await media_dedup.keys_for(message)
+    errors: Dict[Union[int, str], Optional[Exception]] = {}
+    fresh = []
+    for dest, caption in deliveries:
+        if any(media_dedup.seen(f"{key}:{dest}") for key in keys):
+            logger.info("تم تخطي إرسال ملف مكرر إلى %s", dest)
+            media_dedup.stats["hits"] += 1
+            errors[dest] = None
+        else:
+            media_dedup.stats["misses"] += 1
+            fresh.append((dest, caption))
+    if not fresh:
+        return errors
+
+    content_hashes: Optional[List[str]] = [] if media_dedup.content_hash and message.document else None
+    errors.update(await transfer_media(client, message, fresh, content_hashes))
+    for dest, _ in fresh:
+        if errors[dest] is None:
+            for key in keys:
+                media_dedup.add(f"{key}:{dest}")
+            for content_hash in content_hashes or []:
+                media_dedup.add(f"sha256:{content_hash}:{dest}")
+    return errors
+
+async def transfer_media(client: TelegramClient, message, deliveries: List[Tuple[Union[int, str], str]],
+                         content_hashes: Optional[List[str]] = None) -> Dict[Union[int, str], Optional[Exception]]:
+    """رفع الملف مرة واحدة وإرساله إلى عدة وجهات
+
+    تتم المحاولة أولاً بإعادة إرسال الوسائط بالمرجع دون تحميل أو رفع،
+    وعند فشل ذلك يتم تحميل الملف مرة واحدة ورفعه مرة واحدة ثم إعادة استخدامه لكل الوجهات.
+    تُرجع خطأ كل وجهة (None عند النجاح).
+    """
+    # المحاولة الأولى: إعادة الإرسال بالمرجع (بدون استخدام القرص)
+    errors = await send_to_all(client, message.media, deliveries)
+    for dest, _ in deliveries:
+        if errors[dest] is None:
+            logger.info("تم إرسال الملف بالمرجع إلى %s", dest)
+        else:
+            logger.warning("فشل الإرسال بالمرجع إلى %s: %s", dest, errors[dest])
+    # لا فائدة من الرفع عند FloodWait، يتم ترك هذه الوجهات للحساب التالي
+    pending = [(dest, caption) for dest, caption in deliveries
+               if errors[dest] is not None and not isinstance(errors[dest], FloodWaitError)]
+    if not pending:
+        return errors
+
+    def before_upload() -> bool:
+        """حذف الوجهات التي استلمت نفس المحتوى (حسب البصمة) قبل الرفع"""
+        nonlocal pending
+        if content_hashes:
+            remaining = media_dedup.fresh_content(content_hashes[0], pending)
+            for dest, _ in pending:
+                if all(dest != other for other, _ in remaining):
+                    errors[dest] = None
+            pending = remaining
+        return bool(pending)
+
+    # المحاولة الثانية: تحميل مرة واحدة ورفع مرة واحدة
+    uploaded = await upload_message_media(client, message, content_hashes, before_upload)
+    if uploaded is None:
+        return errors
+    upload_errors = await send_to_all(client, uploaded, pending, force_document=message.document is not None)
+    for dest, error in upload_errors.items():
+        if error is None:
+            logger.info("تم إرسال الملف المرفوع إلى %s", dest)
+        else:
+            logger.error("فشل في إرسال الملف إلى %s: %s", dest, error)
+    errors.update(upload_errors)
+    return errors
+
+class MarksCsvRelay:
+    """مرحلة marks.csv: قراءة الملف سطراً بسطر، التحقق من بنية الصفوف، حساب ملخص، وإرسال التغييرات فقط
+
+    في وضع delta يحفظ لكل وجهة رأس الملف وبصمة كل صف (حسب MARKS_CSV_KEY_COLUMNS أو الصف كاملاً) من آخر
+    ملف تم تسليمه، ثم يُرسل ملف باسم مختلف (marks.delta.csv) بعمود أول op: upsert للصفوف الجديدة أو
+    المعدلة و delete لمفاتيح الصفوف المحذوفة. عند عدم وجود ملف سابق أو تغير رأس الملف يُرسل الملف كاملاً.
+    الوضع الافتراضي full لأن المستقبل يجب أن يدعم ملفات التغييرات أولاً.
+    """
+
+    DELTA_OP_COLUMN = "op"
+
+    def __init__(self):
+        self.mode = settings.marks_csv_mode
+        self.key_columns = list(settings.marks_csv_key_columns)
+        self.course_column = settings.marks_csv_course_column
+        self.state_file = settings.marks_csv_state_file
+        self.snapshots: Dict[str, dict] = {}
+        self.summaries: Dict[str, dict] = {}
+        self.loaded = False
+        self.saver = DebouncedSaver(self.state_file, lambda: dict(self.snapshots))
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            loaded = await run_file_op(read_json, self.state_file, {})
+            for dest, snapshot in loaded.items():
+                self.snapshots.setdefault(dest, snapshot)
+            self.loaded = True
+
+    def diff(self, source, previous: Optional[dict], delta) -> dict:
+        """مقارنة الملف مع آخر ملف مرسل وكتابة الصفوف المتغيرة في delta"""
+        reader = csv.reader(codecs.iterdecode(iter(source.readline, b''), 'utf-8-sig'))
+        header = next(reader, None)
+        if not header:
+            raise ValueError("ملف CSV فارغ أو بدون رأس")
+        key_indexes = [header.index(column) for column in self.key_columns if column in header] or list(range(len(header)))
+        course_index = header.index(self.course_column) if self.course_column in header else None
+        full = previous is None or previous.get("header") != header
+        old_rows: Dict[str, str] = {} if full else previous["rows"]
+
+        line = io.StringIO()
+        writer = csv.writer(line)
+
+        def write_row(row: List[str]):
+            writer.writerow(row)
+            delta.write(line.getvalue().encode('utf-8'))
+            line.seek(0)
+            line.truncate()
+
+        write_row([self.DELTA_OP_COLUMN, *header])
+        rows: Dict[str, str] = {}
+        summary = {"rows": 0, "invalid": 0, "duplicates": 0, "added": 0, "changed": 0, "unchanged": 0,
+                   "removed": 0, "courses": {}, "invalid_lines": [], "full": full}
+        for row in reader:
+            summary["rows"] += 1
+            if len(row) != len(header) or not any(cell.strip() for cell in row):
+                summary["invalid"] += 1
+                if len(summary["invalid_lines"]) < 10:
+                    summary["invalid_lines"].append(reader.line_num)
+                continue
+            key = "\x1f".join(row[index] for index in key_indexes)
+            if key in rows:
+                summary["duplicates"] += 1
+            rows[key] = hashlib.sha1("\x1f".join(row).encode('utf-8')).hexdigest()[:16]
+            if course_index is not None:
+                course = row[course_index].strip()
+                summary["courses"][course] = summary["courses"].get(course, 0) + 1
+            old_digest = old_rows.get(key)
+            if old_digest == rows[key]:
+                summary["unchanged"] += 1
+                continue
+            summary["added" if old_digest is None else "changed"] += 1
+            write_row(["upsert", *row])
+        for key in old_rows:
+            if key in rows:
+                continue
+            # الصف المحذوف: أعمدة المفتاح فقط لأن اللقطة المحفوظة لا تحتوي على باقي القيم
+            removed = [''] * len(header)
+            for index, value in zip(key_indexes, key.split("\x1f")):
+                removed[index] = value
+            write_row(["delete", *removed])
+            summary["removed"] += 1
+        return {"header": header, "rows": rows, "summary": summary}
+
+    async def relay(self, client: TelegramClient, message, dest: Union[int, str], caption: str) -> Optional[Exception]:
+        """إرسال marks.csv إلى وجهة واحدة كملف تغييرات، مع الرجوع إلى الملف الكامل عند الحاجة"""
+        if self.mode != 'delta':
+            return (await fan_out_media(client, message, [(dest, caption)]))[dest]
+        await self.ensure_loaded()
+        source, _ = await download_media_stream(client, message)
+        delta = tempfile.SpooledTemporaryFile(max_size=media_spool_threshold)
+        with source, delta:
+            try:
+                result = await run_file_op(self.diff, source, self.snapshots.get(str(dest)), delta)
+            except (ValueError, UnicodeDecodeError, csv.Error) as e:
+                logger.error("ملف marks.csv غير صالح، سيتم إرساله كما هو: %s", e)
+                return (await fan_out_media(client, message, [(dest, caption)]))[dest]
+            summary = result["summary"]
+            self.summaries[str(dest)] = summary
+            logger.info(
+                "marks.csv: %s صف، %s غير صالح، %s جديد، %s معدل، %s محذوف، %s مادة",
+                summary['rows'], summary['invalid'], summary['added'],
+                summary['changed'], summary['removed'], len(summary['courses'])
+            )
+            if summary["invalid_lines"]:
+                logger.warning("صفوف غير صالحة في marks.csv (أول الأسطر): %s", summary['invalid_lines'])
+
+            if summary["full"]:
+                error = (await fan_out_media(client, message, [(dest, caption)]))[dest]
+            elif summary["added"] or summary["changed"] or summary["removed"]:
+                size = delta.tell()
+                delta.seek(0)
+                stem, extension = os.path.splitext(media_file_name(message))
+                try:
+                    with UPLOAD_SECONDS.time(mode="csv_delta"):
+                        uploaded = await client.upload_file(delta, file_size=size, file_name=f"{stem}.delta{extension or '.csv'}")
+                    UPLOAD_BYTES.inc(size, mode="csv_delta")
+                    delta_caption = (f"{caption} (ملف تغييرات فقط: {summary['added']} جديد، "
+                                     f"{summary['changed']} معدل، {summary['removed']} محذوف)")
+                    error = (await send_to_all(client, uploaded, [(dest, delta_caption)]))[dest]
+                except Exception as e:
+                    error = e
+            else:
+                logger.info("لا توجد تغييرات في marks.csv، لن يتم إرسال شيء إلى %s", dest)
+                error = None
+
+        if error is None:
+            self.snapshots[str(dest)] = {"header": result["header"], "rows": result["rows"]}
+            await self.saver.save()
+        return error
+
+marks_csv = MarksCsvRelay()
+
+async def download_range(client: TelegramClient, message, start: int, length: int) -> bytes:
+    """تحميل جزء محدد من ملف الوسائط دون تحميل الملف كاملاً"""
+    aligned = start - start % 4096
+    end = start + length
+    limit = (end - aligned + media_part_size - 1) // media_part_size
+    data = b''
+    async for chunk in client.iter_download(message.media, offset=aligned, request_size=media_part_size, limit=limit):
+        data += chunk
+    return data[start - aligned:end - aligned]
+
+class SparseRemoteFile:
+    """ملف للقراءة فقط مكون من أجزاء محملة من ملف بعيد
+
+    يكفي لأن يقرأ zipfile الفهرس المركزي لملف ZIP (نهاية الملف والفهرس) دون تحميل باقي الملف.
+    """
+
+    def __init__(self, size: int, segments: Dict[int, bytes]):
+        self.size = size
+        self.segments = segments
+        self.position = 0
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+        self.position = offset
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def read(self, n: int = -1) -> bytes:
+        if n < 0:
+            n = self.size - self.position
+        for start, data in self.segments.items():
+            if start <= self.position and self.position + n <= start + len(data):
+                chunk = data[self.position - start:self.position - start + n]
+                self.position += len(chunk)
+                return chunk
+        raise OSError(f"الجزء {self.position}-{self.position + n} غير محمل")
+
+class MarksZipIndex:
+    """فهرس أعضاء ملف ZIP للعلامات (الاسم، الحجم، CRC) من آخر إصدار وحساب التغييرات لكل ملف
+
+    يُقرأ الفهرس المركزي فقط من نهاية الملف عبر طلبات تحميل جزئية. حسب MARKS_ZIP_DELIVERY يتم:
+    full: إرسال الملف كاملاً كما في السابق دون قراءة الفهرس
+    changed: إرسال ملف ZIP أصغر يحتوي فقط على الملفات الجديدة أو المعدلة
+    files: إرسال الملفات الجديدة أو المعدلة كملفات منفصلة
+    الفهرس الجديد لا يُحفظ إلا بعد نجاح التسليم إلى جميع الوجهات (commit)، حتى لا تضيع التغييرات
+    إذا توقفت العملية قبل الإرسال أو أعيدت معالجة نفس الملف.
+    """
+
+    # أقصى حجم لسجل نهاية الفهرس المركزي مع التعليق وسجلات ZIP64
+    TAIL_SIZE = 22 + 65535 + 20 + 56
+
+    def __init__(self):
+        self.delivery = settings.marks_zip_delivery
+        self.index_file = settings.marks_zip_index_file
+        self.indexes: Dict[str, dict] = {}
+        self.changes: Dict[str, dict] = {}
+        self.loaded = False
+        self.saver = DebouncedSaver(self.index_file, lambda: dict(self.indexes))
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            loaded = await run_file_op(read_json, self.index_file, {})
+            for source, index in loaded.items():
+                self.indexes.setdefault(source, index)
+            self.loaded = True
+
+    @staticmethod
+    def _read_members(remote: SparseRemoteFile) -> Dict[str, List[int]]:
+        with zipfile.ZipFile(remote) as archive:
+            return {info.filename: [info.CRC, info.file_size] for info in archive.infolist() if not info.is_dir()}
+
+    async def read_members(self, client: TelegramClient, message) -> Dict[str, List[int]]:
+        """قراءة أسماء وأحجام و CRC أعضاء ملف ZIP من الفهرس المركزي فقط"""
+        size = message.file.size
+        tail_start = max(0, size - self.TAIL_SIZE)
+        tail = await download_range(client, message, tail_start, size - tail_start)
+        end = tail.rfind(b'PK\x05\x06')
+        if end < 0:
+            raise zipfile.BadZipFile("لم يتم العثور على نهاية الفهرس المركزي")
+        cd_size, cd_offset = struct.unpack('<LL', tail[end + 12:end + 20])
+        if cd_offset == 0xFFFFFFFF and end >= 20 and tail[end - 20:end - 16] == b'PK\x06\x07':
+            record_offset = struct.unpack('<Q', tail[end - 12:end - 4])[0] - tail_start
+            cd_size, cd_offset = struct.unpack('<QQ', tail[record_offset + 40:record_offset + 56])
+        segments = {tail_start: tail}
+        if cd_offset < tail_start:
+            segments[cd_offset] = await download_range(client, message, cd_offset, cd_size)
+        return await run_file_op(self._read_members, SparseRemoteFile(size, segments))
+
+    async def inspect(self, client: TelegramClient, message, source: Union[int, str]) -> Optional[dict]:
+        """حساب التغييرات مقارنة بالإصدار السابق من نفس المصدر (الفهرس الجديد في members دون حفظه)"""
+        await self.ensure_loaded()
+        try:
+            members = await self.read_members(client, message)
+        except (zipfile.BadZipFile, OSError, struct.error) as e:
+            logger.error("فشل في قراءة فهرس ملف ZIP، سيتم إرساله كاملاً: %s", e)
+            return None
+        previous = self.indexes.get(str(source))
+        old_members = previous["members"] if previous else {}
+        changes = {
+            "archive": media_file_name(message),
+            "previous": previous["archive"] if previous else None,
+            "added": [name for name in members if name not in old_members],
+            "changed": [name for name in members if name in old_members and old_members[name] != members[name]],
+            "removed": [name for name in old_members if name not in members],
+            "unchanged": sum(1 for name in members if old_members.get(name) == members[name]),
+            "changed_bytes": sum(members[name][1] for name in members if old_members.get(name) != members[name]),
+            "total_bytes": sum(member[1] for member in members.values())
+        }
+        self.changes[str(source)] = {
+            key: len(value) if isinstance(value, list) else value for key, value in changes.items()
+        }
+        changes["members"] = members
+        logger.info(
+            "ملف ZIP %s: %s جديد، %s معدل، %s محذوف، %s بدون تغيير",
+            changes['archive'], len(changes['added']), len(changes['changed']),
+            len(changes['removed']), changes['unchanged']
+        )
+        return changes
+
+    async def commit(self, source: Union[int, str], changes: dict):
+        """حفظ فهرس الإصدار بعد تسليمه إلى جميع الوجهات"""
+        self.indexes[str(source)] = {"archive": changes["archive"], "members": changes["members"]}
+        await self.saver.save()
+
+    @staticmethod
+    def _extract(source, names: List[str], as_archive: bool) -> List[Tuple[str, tempfile.SpooledTemporaryFile, int]]:
+        """استخراج الأعضاء المتغيرة إلى ملفات مؤقتة"""
+        outputs = []
+        with zipfile.ZipFile(source) as archive:
+            if as_archive:
+                buffer = tempfile.SpooledTemporaryFile(max_size=media_spool_threshold)
+                with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as changed:
+                    for name in names:
+                        with archive.open(name) as member, changed.open(archive.getinfo(name), 'w') as target:
+                            shutil.copyfileobj(member, target, media_chunk_size)
+                outputs.append(("", buffer, buffer.tell()))
+            else:
+                for name in names:
+                    buffer = tempfile.SpooledTemporaryFile(max_size=media_spool_threshold)
+                    with archive.open(name) as member:
+                        shutil.copyfileobj(member, buffer, media_chunk_size)
+                    outputs.append((os.path.basename(name), buffer, buffer.tell()))
+        for _, buffer, _ in outputs:
+            buffer.seek(0)
+        return outputs
+
+    async def deliver_changes(self, client: TelegramClient, message, changes: dict,
+                              deliveries: List[Tuple[Union[int, str], str]]) -> List[Tuple[Union[int, str], str]]:
+        """إرسال الملفات الجديدة أو المعدلة فقط وإرجاع الوجهات التي فشل الإرسال إليها"""
+        names = changes["added"] + changes["changed"]
+        source, _ = await download_media_stream(client, message)
+        with source:
+            outputs = await run_file_op(self._extract, source, names, self.delivery == 'changed')
+        try:
+            uploaded = []
+            for name, buffer, size in outputs:
+                if not name:
+                    name = f"{os.path.splitext(changes['archive'])[0]}_changes.zip"
+                with UPLOAD_SECONDS.time(mode="zip_delta"):
+                    uploaded.append(await client.upload_file(buffer, file_size=size, file_name=name))
+                UPLOAD_BYTES.inc(size, mode="zip_delta")
+        finally:
+            for _, buffer, _ in outputs:
+                buffer.close()
+
+        summary = f"{len(changes['added'])} جديد، {len(changes['changed'])} معدل"
+        errors: Dict[Union[int, str], Optional[Exception]] = {}
+        # Telegram يسمح بعشرة ملفات كحد أقصى في الرسالة الواحدة
+        for start in range(0, len(uploaded), 10):
+            batch = uploaded[start:start + 10]
+            results = await send_to_all(client, batch if len(batch) > 1 else batch[0],
+                                        [(dest, f"{caption} ({summary})") for dest, caption in deliveries])
+            for dest, error in results.items():
+                errors[dest] = errors.get(dest) or error
+        return [(dest, caption) for dest, caption in deliveries if errors.get(dest) is not None]
+
+marks_zip = MarksZipIndex()
+
+# حالة التسليم لكل حساب لتوزيع الحمل وتجاوز الحسابات المقيدة بـ FloodWait
+delivery_state: Dict[str, Dict[str, float]] = {}
+
+def delivery_pool(phone: str) -> List[str]:
+    """الحسابات التي تشترك في نفس القناة المصدر والقناة الهدف ويمكنها التسليم بدلاً من بعضها"""
+    account = accounts[phone]
+    return [
+        other.phone for other in accounts.values()
+        if other.source_channel == account.source_channel and other.target_channel_id == account.target_channel_id
+    ]
+
+def is_pool_leader(phone: str) -> bool:
+    """أول حساب نشط في المجموعة هو الذي يعالج رسائل القناة المصدر لتجنب التكرار"""
+    for other in delivery_pool(phone):
+        if active_sessions.get(other) and other in clients:
+            return other == phone
+    return True
+
+def pick_delivery_phone(candidates: List[str]) -> Optional[str]:
+    """اختيار الحساب الأقل حملاً من بين الحسابات النشطة غير المقيدة بـ FloodWait"""
+    now = time.time()
+    available = [
+        phone for phone in candidates
+        if active_sessions.get(phone) and phone in clients
+        and delivery_state.get(phone, {}).get("flood_until", 0) <= now
+    ]
+    if not available:
+        return None
+    return min(available, key=lambda phone: delivery_state.get(phone, {}).get("in_flight", 0))
+
+async def deliver_message_media(phone: str, message, deliveries: List[Tuple[Union[int, str], str]]) -> List[Tuple[Union[int, str], str]]:
+    """تسليم وسائط رسالة من القناة المصدر مع توزيع الحمل على حسابات المجموعة
+
+    عند تقييد حساب بـ FloodWait يتم نقل الوجهات المتبقية إلى حساب آخر في المجموعة،
+    والذي يجلب نفس الرسالة بنفسه لأن مراجع الوسائط خاصة بكل حساب.
+    تُرجع التسليمات التي فشلت.
+    """
+    candidates = delivery_pool(phone)
+    pending = list(deliveries)
+    failed: List[Tuple[Union[int, str], str]] = []
+    while pending and candidates:
+        chosen = pick_delivery_phone(candidates)
+        if chosen is None:
+            logger.error("لا يوجد حساب متاح لتسليم الرسالة %s", message.id)
+            break
+        candidates.remove(chosen)
+        client = clients[chosen]
+        state = delivery_state.setdefault(chosen, {"in_flight": 0, "flood_until": 0, "delivered": 0, "flood_waits": 0})
+        state["in_flight"] += 1
+        try:
+            source_message = message
+            if chosen != phone:
+                logger.info("تسليم الرسالة %s عبر الحساب %s", message.id, chosen)
+                source_message = await client.get_messages(message.chat_id, ids=message.id)
+                if source_message is None:
+                    continue
+            errors = await fan_out_media(client, source_message, pending)
+        except FloodWaitError as e:
+            errors = {dest: e for dest, _ in pending}
+        except Exception as e:
+            logger.error("خطأ في التسليم عبر الحساب %s: %s", chosen, e)
+            continue
+        finally:
+            state["in_flight"] -= 1
+
+        state["delivered"] += sum(1 for dest, _ in pending if errors.get(dest) is None)
+        flood_errors = [error for error in errors.values() if isinstance(error, FloodWaitError)]
+        if flood_errors:
+            state["flood_waits"] += 1
+            state["flood_until"] = time.time() + max(error.seconds for error in flood_errors)
+            logger.warning("الحساب %s مقيد بـ FloodWait لمدة %s ثانية", chosen, max(error.seconds for error in flood_errors))
+        failed += [(dest, caption) for dest, caption in pending
+                   if errors.get(dest) is not None and not isinstance(errors.get(dest), FloodWaitError)]
+        pending = [(dest, caption) for dest, caption in pending if isinstance(errors.get(dest), FloodWaitError)]
+    return failed + pending
+
+class JobQueue:
+    """طابور مهام محدود بين أحداث Telethon ومعالجة الوسائط
+
+    لكل مسار (text للردود الخفيفة، media للوسائط الثقيلة) طابوره وعماله الخاصون،
+    لذلك لا تنتظر الردود النصية خلف رفع ملف كبير.
+    """
+
+    def __init__(self, workers: Dict[str, int], max_depth: int):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.tasks: List[asyncio.Task] = []
+        self.stats: Dict[str, Dict[str, int]] = {
+            lane: {"submitted": 0, "completed": 0, "failed": 0, "running": 0} for lane in workers
+        }
+
+    def _ensure_started(self):
+        if self.tasks:
+            return
+        for lane, count in self.workers.items():
+            self.queues[lane] = asyncio.Queue(maxsize=self.max_depth)
+            for i in range(count):
+                self.tasks.append(asyncio.create_task(self._worker(lane), name=f"job-{lane}-{i}"))
+
+    async def submit(self, lane: str, name: str, job):
+        """إضافة مهمة إلى المسار المحدد، مع الانتظار عند امتلاء الطابور (ضغط عكسي)"""
+        self._ensure_started()
+        queue = self.queues[lane]
+        if queue.full():
+            logger.warning("طابور المهام %s ممتلئ (%s)، انتظار مكان فارغ للمهمة %s", lane, self.max_depth, name)
+        # معرف الارتباط ينتقل مع المهمة لأن العمال مهام طويلة لا ترث سياق الحدث
+        await queue.put((name, job, time.perf_counter(), correlation_id.get()))
+        self.stats[lane]["submitted"] += 1
+
+    async def _worker(self, lane: str):
+        queue = self.queues[lane]
+        stats = self.stats[lane]
+        while True:
+            name, job, enqueued_at, job_correlation_id = await queue.get()
+            JOB_WAIT_SECONDS.observe(time.perf_counter() - enqueued_at, lane=lane)
+            token = correlation_id.set(job_correlation_id)
+            stats["running"] += 1
+            try:
+                await job()
+                stats["completed"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logger.exception("خطأ في تنفيذ المهمة %s (%s): %s", name, lane, e)
+            finally:
+                stats["running"] -= 1
+                correlation_id.reset(token)
+                queue.task_done()
+
+    def metrics(self) -> Dict[str, Dict[str, int]]:
+        """إحصائيات الطوابير لكل مسار"""
+        return {
+            lane: {
+                "workers": self.workers[lane],
+                "depth": self.queues[lane].qsize() if lane in self.queues else 0,
+                "max_depth": self.max_depth,
+                **stats
+            }
+            for lane, stats in self.stats.items()
+        }
+
+    async def join(self):
+        """انتظار انتهاء جميع المهام الموجودة في الطوابير"""
+        await asyncio.gather(*(queue.join() for queue in self.queues.values()))
+
+    async def stop(self):
+        """إيقاف جميع العمال"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queues = {}
+
+job_queue = JobQueue(
+    workers={
+        "text": settings.text_job_workers,
+        "media": settings.media_job_workers
+    },
+    max_depth=settings.job_queue_max_depth
+)
+
+class CatchUpState:
+    """آخر رسالة تمت معالجتها لكل حساب ومحادثة، مع إزالة التكرار بين الأحداث المباشرة والمستعادة"""
+
+    def __init__(self):
+        self.state_file = settings.catchup_state_file
+        self.batch_size = settings.catchup_batch_size
+        self.batch_delay = settings.catchup_batch_delay
+        self.limit = settings.catchup_limit
+        self.max_age = settings.catchup_max_age
+        self.last_ids: Dict[str, int] = {}
+        # رسائل تمت مطالبتها ولم تنتهِ مهمتها بعد، ورسائل فشلت مهمتها: المؤشر المحفوظ لا يتجاوزها
+        self.pending: Dict[str, Set[int]] = {}
+        self.failed: Dict[str, Set[int]] = {}
+        self.completed: Dict[str, int] = {}
+        self.recent: Dict[str, Deque[int]] = {}
+        self.recent_sets: Dict[str, Set[int]] = {}
+        self.loaded = False
+        self.saver = DebouncedSaver(self.state_file, lambda: dict(self.last_ids))
+        self.stats: Dict[str, int] = {"replayed": 0, "duplicates": 0, "failed": 0}
+
+    @staticmethod
+    def key(phone: str, chat: Union[int, str]) -> str:
+        return f"{phone}:{chat}"
+
+    async def ensure_loaded(self):
+        """تحميل الحالة مرة واحدة ودمجها مع ما تمت معالجته منذ بدء التشغيل"""
+        if not self.loaded:
+            for key, value in (await run_file_op(read_json, self.state_file, {})).items():
+                self.last_ids[key] = max(int(value), self.last_ids.get(key, 0))
+            self.loaded = True
+
+    def cursors(self, phone: str, chats: List[Union[int, str]]) -> Dict[Union[int, str], Optional[int]]:
+        """آخر رسالة معالجة لكل محادثة قبل تسجيل المعالجات (نقطة بداية الاستدراك)"""
+        return {chat: self.last_ids.get(self.key(phone, chat)) for chat in chats}
+
+    def claim(self, phone: str, chat: Union[int, str], message_id: int) -> bool:
+        """حجز الرسالة للمعالجة، وإرجاع False إذا سبقت مطالبتها (المؤشر يتقدم فقط في finish)"""
+        key = self.key(phone, chat)
+        seen = self.recent_sets.setdefault(key, set())
+        if message_id in seen:
+            self.stats["duplicates"] += 1
+            return False
+        recent = self.recent.setdefault(key, deque())
+        recent.append(message_id)
+        seen.add(message_id)
+        if len(recent) > 1000:
+            seen.discard(recent.popleft())
+        self.pending.setdefault(key, set()).add(message_id)
+        return True
+
+    def finish(self, phone: str, chat: Union[int, str], message_id: int, ok: bool):
+        """إنهاء رسالة بعد انتهاء مهمتها، وتقديم المؤشر المحفوظ حتى أول رسالة لم تكتمل"""
+        key = self.key(phone, chat)
+        self.pending.get(key, set()).discard(message_id)
+        failed = self.failed.setdefault(key, set())
+        if ok:
+            failed.discard(message_id)
+            self.completed[key] = max(message_id, self.completed.get(key, 0))
+        else:
+            # إتاحة إعادة معالجتها عند الاستدراك التالي
+            failed.add(message_id)
+            self.recent_sets.get(key, set()).discard(message_id)
+            self.stats["failed"] += 1
+
+        blocking = self.pending.get(key, set()) | failed
+        cursor = min(blocking) - 1 if blocking else self.completed.get(key, 0)
+        cursor = min(cursor, self.completed.get(key, 0))
+        if cursor > self.last_ids.get(key, 0):
+            self.last_ids[key] = cursor
+            # تجميع عمليات الحفظ بدلاً من الكتابة مع كل رسالة
+            self.saver.schedule()
+
+    async def catch_up(self, client: TelegramClient, phone: str, chats: List[Tuple[Union[int, str], object, Optional[int]]]):
+        """جلب الرسائل الفائتة منذ آخر رسالة معالجة وتمريرها عبر نفس المعالجات على دفعات"""
+        min_date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=self.max_age)
+        for chat, callback, last_id in chats:
+            if not last_id:
+                # لا توجد حالة سابقة لهذه المحادثة، لا يتم استعادة السجل القديم
+                continue
+            replayed = 0
+            batch = 0
+            try:
+                async for message in client.iter_messages(chat, min_id=last_id, reverse=True, limit=self.limit):
+                    if message.date is not None and message.date < min_date:
+                        continue
+                    await callback(CatchUpEvent(message))
+                    replayed += 1
+                    batch += 1
+                    if batch >= self.batch_size:
+                        batch = 0
+                        await asyncio.sleep(self.batch_delay)
+            except Exception as e:
+                logger.error("خطأ في استدراك الرسائل الفائتة من %s للمستخدم %s: %s", chat, phone, e)
+            if replayed:
+                self.stats["replayed"] += replayed
+                logger.info("تم استدراك %s رسالة فائتة من %s للمستخدم %s", replayed, chat, phone)
+
+class CatchUpEvent:
+    """حدث بديل لرسالة فائتة يمر عبر نفس معالجات NewMessage"""
+
+    def __init__(self, message):
+        self.message = message
+        self.raw_text = message.raw_text or ''
+        self.is_private = message.is_private
+        self.sender_id = message.sender_id
+
+catchup = CatchUpState()
+
+# قواعد التوجيه الافتراضية (يمكن استبدالها عبر ROUTING_RULES أو ROUTING_RULES_FILE)
+DEFAULT_ROUTING_RULES = [
+    {"name": "photo", "chat": "source", "media": "photo", "action": "photo"},
+    {"name": "marks_zip", "chat": "source", "media": "document",
+     "file_name": "علامات_كلية_الآداب_والعلوم_الانسانية_ـ_ف2_ـ_2024_2025.zip", "action": "marks_zip"},
+    {"name": "done", "chat": "receiver", "text": "تم", "action": "done"},
+    {"name": "test", "chat": "receiver", "text": "test", "action": "test"},
+    {"name": "marks_csv", "chat": "receiver", "media": "document", "file_name": "marks.csv", "action": "marks_csv"}
+]
+
+# المسار الافتراضي لكل إجراء في طابور المهام
+ROUTING_ACTION_LANES = {"photo": "media", "marks_zip": "media", "marks_csv": "media", "done": "text", "test": "text"}
+
+@dataclass
+class RoutingRule:
+    """قاعدة توجيه: شروط المطابقة والإجراء الذي يتم تنفيذه"""
+    name: str
+    chat: str
+    action: str
+    lane: str
+    media: str = "any"
+    file_name: Optional[str] = None
+    file_glob: Optional[str] = None
+    file_regex: Optional[str] = None
+    mime: Optional[str] = None
+    text: Optional[str] = None
+    text_regex: Optional[str] = None
+
+    def mime_matches(self, mime: Optional[str]) -> bool:
+        return self.mime is None or self.mime == mime
+
+class RoutingTable:
+    """فهرس قواعد التوجيه المترجم مرة واحدة
+
+    يتم تجميع القواعد حسب (المحادثة، نوع الوسائط)، ثم البحث بقاموس لأسماء الملفات والنصوص
+    المطابقة تماماً، فتبقى مطابقة الشروط الثابتة ثابتة التكلفة مهما زاد عدد القواعد. الأنماط تُترجم
+    كل منها على حدة عند التحميل وتُجرب بترتيب القواعد (دمجها في تعبير واحد يكسر الأعلام المضمنة
+    مثل (?i) والمجموعات المسماة والمراجع الخلفية).
+
+    لذلك تتم المطابقة حسب أولوية نوع الشرط وليس ترتيب القواعد: نوع الوسائط المحدد قبل any، ثم
+    اسم الملف المطابق تماماً، ثم النص المطابق تماماً، ثم الأنماط (file_glob/file_regex ثم text_regex)،
+    ثم نوع MIME، ثم القاعدة بدون شروط. الترتيب يحسم فقط بين قواعد من نفس النوع.
+    """
+
+    def __init__(self, rules: List[dict]):
+        self.rules: List[RoutingRule] = []
+        self.index: Dict[Tuple[str, str], dict] = {}
+        for position, raw in enumerate(rules):
+            rule = self._parse(raw, position)
+            self.rules.append(rule)
+            bucket = self.index.setdefault((rule.chat, rule.media), {
+                "files": {}, "texts": {}, "mimes": {}, "patterns": [], "default": None
+            })
+            if rule.file_name is not None:
+                bucket["files"].setdefault(rule.file_name, rule)
+            elif rule.text is not None:
+                bucket["texts"].setdefault(rule.text, rule)
+            elif rule.file_glob or rule.file_regex:
+                bucket["patterns"].append(("file", re.compile(rule.file_regex or fnmatch.translate(rule.file_glob)), rule))
+            elif rule.text_regex:
+                bucket["patterns"].append(("text", re.compile(rule.text_regex), rule))
+            elif rule.mime is not None:
+                bucket["mimes"].setdefault(rule.mime, rule)
+            elif bucket["default"] is None:
+                bucket["default"] = rule
+
+    @staticmethod
+    def _parse(raw: dict, position: int) -> RoutingRule:
+        action = raw.get("action")
+        if action not in ROUTING_ACTION_LANES:
+            raise ValueError(f"إجراء غير معروف في قاعدة التوجيه {raw}: {action}")
+        chat = raw.get("chat", "source")
+        if chat not in ("source", "receiver"):
+            raise ValueError(f"المحادثة في قاعدة التوجيه يجب أن تكون source أو receiver: {raw}")
+        media = raw.get("media", "any")
+        if media not in ("any", "photo", "document", "text"):
+            raise ValueError(f"نوع وسائط غير معروف في قاعدة التوجيه {raw}: {media}")
+        lane = raw.get("lane", ROUTING_ACTION_LANES[action])
+        if lane not in job_queue.workers:
+            raise ValueError(f"مسار غير معروف في قاعدة التوجيه {raw}: {lane} (المسارات المتاحة: {', '.join(job_queue.workers)})")
+        name = raw.get("name", f"rule_{position}")
+        for field in ("file_regex", "text_regex"):
+            if raw.get(field) is not None:
+                try:
+                    re.compile(raw[field])
+                except (re.error, TypeError) as e:
+                    raise ValueError(f"تعبير {field} غير صالح في قاعدة التوجيه {name}: {e}") from None
+        return RoutingRule(
+            name=name,
+            chat=chat,
+            action=action,
+            lane=lane,
+            media=media,
+            file_name=raw.get("file_name"),
+            file_glob=raw.get("file_glob"),
+            file_regex=raw.get("file_regex"),
+            mime=raw.get("mime"),
+            text=raw.get("text"),
+            text_regex=raw.get("text_regex")
+        )
+
+    @staticmethod
+    def _match_bucket(bucket: dict, file_name: Optional[str], mime: Optional[str], text: str) -> Optional[RoutingRule]:
+        if file_name is not None:
+            rule = bucket["files"].get(file_name)
+            if rule is not None and rule.mime_matches(mime):
+                return rule
+        rule = bucket["texts"].get(text)
+        if rule is not None and rule.mime_matches(mime):
+            return rule
+        for field, value in (("file", file_name), ("text", text)):
+            if value is None:
+                continue
+            for kind, pattern, rule in bucket["patterns"]:
+                if kind != field:
+                    continue
+                found = pattern.fullmatch(value) if field == "file" else pattern.search(value)
+                if found is not None and rule.mime_matches(mime):
+                    return rule
+        if mime is not None and mime in bucket["mimes"]:
+            return bucket["mimes"][mime]
+        return bucket["default"]
+
+    def match(self, chat: str, message, text: str) -> Optional[RoutingRule]:
+        """إيجاد القاعدة المطابقة للرسالة في محادثة معينة (source أو receiver) حسب أولوية نوع الشرط"""
+        media = "photo" if message.photo else "document" if message.document else "text"
+        file_name = media_file_name(message) if message.document else None
+        mime = message.document.mime_type if message.document else None
+        text = (text or '').strip()
+        for key in ((chat, media), (chat, "any")):
+            bucket = self.index.get(key)
+            if bucket is not None:
+                rule = self._match_bucket(bucket, file_name, mime, text)
+                if rule is not None:
+                    return rule
+        return None
+
+def load_routing_rules() -> List[dict]:
+    """تحميل قواعد التوجيه من ROUTING_RULES (JSON) أو ROUTING_RULES_FILE أو القواعد الافتراضية"""
+    if settings.routing_rules is not None:
+        return settings.routing_rules
+    rules_file = settings.routing_rules_file
+    if rules_file:
+        with open(rules_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return DEFAULT_ROUTING_RULES
+
+routing = RoutingTable(load_routing_rules())
+
+def build_forwarding_handlers(client: TelegramClient, phone: str) -> List[Tuple[object, events.NewMessage, Union[int, str]]]:
+    """إنشاء معالجات تحويل الرسائل لحساب معين دون تسجيلها (المعالج، الحدث، المحادثة)
+
+    تقوم المعالجات بتصنيف الرسالة فقط، ثم تضع العمل الفعلي في طابور المهام.
+    """
+    account = accounts[phone]
+    async def handle_photo(message):
+        logger.info("Cleaning downloads directory before new image download.")
+        await run_file_op(sweep_downloads, None, 'zip')
+
+        logger.info("تم العثور على صورة بالوصف المطلوب، جاري تحميلها...")
+        with DOWNLOAD_SECONDS.time(mode="photo"):
+            file_path = await message.download_media(file=downloads_path)
+        DOWNLOAD_BYTES.inc(message.file.size or 0 if message.file else 0, mode="photo")
+        logger.info("تم تحميل الصورة: %s", file_path)
+        await record_media(message, "photo", file_path)
+        observe_delivery(message, "photo")
+
+    async def handle_album(messages):
+        logger.info("Cleaning downloads directory before new album download.")
+        await run_file_op(sweep_downloads, None, 'zip')
+
+        logger.info("تم العثور على ألبوم من %s صور، جاري تحميلها بالتوازي...", len(messages))
+        with DOWNLOAD_SECONDS.time(mode="album"):
+            paths = await asyncio.gather(*(message.download_media(file=downloads_path) for message in messages))
+        DOWNLOAD_BYTES.inc(sum(message.file.size or 0 for message in messages if message.file), mode="album")
+        logger.info("تم تحميل الألبوم: %s", paths)
+        await record_media(messages[0], "photo", paths[0], album=[media_entry(message, path) for message, path in zip(messages, paths)])
+        for message in messages:
+            observe_delivery(message, "photo")
+
+    async def handle_marks_zip(message):
+        logger.info("Cleaning downloads directory before new zip download.")
+        await run_file_op(sweep_downloads, 'zip')
+
+        logger.info("تم العثور على ملف ZIP للعلامات، جاري إرساله...")
+        deliveries = [
+            (account.receiver_account, "ملف العلامات"),
+            (account.target_channel_id, "لا تنسوا إخوانكم في غزة 🇵🇸")
+        ]
+        # وضع full لا يحتاج الفهرس، فلا داعي لتحميل الفهرس المركزي
+        changes = None
+        if marks_zip.delivery != 'full':
+            changes = await marks_zip.inspect(client, message, account.source_channel)
+        if changes is not None and changes["previous"]:
+            if not changes["added"] and not changes["changed"]:
+                logger.info("لا توجد ملفات جديدة أو معدلة في ملف ZIP، لن يتم إرسال شيء")
+                await marks_zip.commit(account.source_channel, changes)
+                observe_delivery(message, "marks_zip")
+                return
+            try:
+                failed = await marks_zip.deliver_changes(client, message, changes, deliveries)
+            except Exception as e:
+                logger.error("فشل في إرسال التغييرات فقط، سيتم إرسال الملف كاملاً: %s", e)
+                failed = await deliver_message_media(phone, message, deliveries)
+        else:
+            failed = await deliver_message_media(phone, message, deliveries)
+        if failed:
+            # الفهرس يبقى على الإصدار السابق حتى لا تُعتبر التغييرات مُسلّمة
+            await outbound.enqueue_media(phone, message, failed)
+        elif changes is not None:
+            await marks_zip.commit(account.source_channel, changes)
+        observe_delivery(message, "marks_zip")
+        logger.info("تم إرسال الملف إلى %s", account.receiver_account)
+
+    async def handle_done(message):
+        latest_image = await latest_media("photo")
+
+        message_text = "تم إضافة علامات جديدة إلى بوت علاماتي 😍❤️"
+        sent_image = False
+        if latest_image:
+            try:
+                sent_image = await send_indexed_media(client, account.target_channel_id, latest_image, message_text)
+            except Exception as e:
+                # مثلاً حُذف الملف المحلي بعد انتهاء صلاحية المرجع: الإعلان النصي أفضل من فقدانه
+                logger.error("فشل في إرسال الصورة المفهرسة إلى %s، سيتم إرسال النص فقط: %s", account.target_channel_id, e)
+        if sent_image:
+            logger.info("Found latest image from today: %s", latest_image.get('path'))
+            logger.info("Sent image to target channel %s", account.target_channel_id)
+        else:
+            logger.info("No image from today found. Sending text message instead.")
+            try:
+                await outbound.call(client, account.target_channel_id, lambda peer: client.send_message(peer, message_text))
+            except Exception as e:
+                logger.error("فشل في إرسال الرسالة إلى %s: %s", account.target_channel_id, e)
+                await outbound.enqueue("message", phone, account.target_channel_id, text=message_text)
+                return
+            logger.info("Sent text-only message to target channel %s", account.target_channel_id)
+        observe_delivery(message, "done")
+
+    async def handle_test(message):
+        await outbound.call(client, account.receiver_account, lambda peer: client.send_message(peer, "working"))
+
+    async def handle_marks_csv(message):
+        logger.info("Cleaning downloads directory before new csv download.")
+        await run_file_op(sweep_downloads, 'csv')
+
+        logger.info("تم العثور على ملف CSV للعلامات، جاري إرساله...")
+        error = await marks_csv.relay(client, message, account.bot_ad, "ملف العلامات")
+        if error is not None:
+            await outbound.enqueue_media(phone, message, [(account.bot_ad, "ملف العلامات")])
+        observe_delivery(message, "marks_csv")
+        logger.info("تم إرسال الملف إلى %s", account.bot_ad)
+
+    actions = {
+        "photo": handle_photo,
+        "marks_zip": handle_marks_zip,
+        "done": handle_done,
+        "test": handle_test,
+        "marks_csv": handle_marks_csv
+    }
+
+    # صور الألبومات المنتظرة حسب grouped_id
+    albums: Dict[int, List[object]] = {}
+
+    def finish_all(chat_id: Union[int, str], messages: List[object], ok: bool):
+        for item in messages:
+            catchup.finish(phone, chat_id, item.id, ok)
+
+    async def submit_tracked(rule_lane: str, name: str, chat_id: Union[int, str], messages: List[object], job):
+        """وضع مهمة في الطابور بحيث لا يتقدم مؤشر الاستدراك المحفوظ إلا بعد نجاحها"""
+        async def tracked():
+            ok = False
+            try:
+                await job()
+                ok = True
+            finally:
+                finish_all(chat_id, messages, ok)
+        await job_queue.submit(rule_lane, name, tracked)
+
+    async def flush_album(grouped_id: int, rule: RoutingRule, chat_id: Union[int, str]):
+        """انتظار وصول باقي صور الألبوم ثم معالجته كمهمة واحدة"""
+        correlation_id.set(f"{phone}:album:{grouped_id}")
+        await asyncio.sleep(album_window)
+        messages = sorted(albums.pop(grouped_id), key=lambda item: item.id)
+        try:
+            await submit_tracked(rule.lane, f"{rule.name}_album", chat_id, messages, lambda: handle_album(messages))
+        except Exception as e:
+            finish_all(chat_id, messages, False)
+            logger.error("فشل في جدولة الألبوم %s: %s", grouped_id, e)
+
+    async def dispatch(chat: str, chat_id: Union[int, str], event):
+        """مطابقة الرسالة مع قواعد التوجيه ووضع الإجراء المناسب في طابور المهام"""
+        message = event.message
+        correlation_id.set(f"{phone}:{chat}:{message.id}")
+        rule = routing.match(chat, message, event.raw_text)
+        if rule is None:
+            EVENTS_TOTAL.inc(handler=chat, kind="ignored")
+            catchup.finish(phone, chat_id, message.id, True)
+            return
+        logger.info("الرسالة %s من %s تطابق القاعدة %s", message.id, chat, rule.name)
+        EVENTS_TOTAL.inc(handler=chat, kind=rule.name)
+        if rule.action == "photo" and message.grouped_id:
+            pending = albums.setdefault(message.grouped_id, [])
+            pending.append(message)
+            if len(pending) == 1:
+                asyncio.create_task(flush_album(message.grouped_id, rule, chat_id))
+            return
+        action = actions[rule.action]
+        await submit_tracked(rule.lane, rule.name, chat_id, [message], lambda: action(message))
+
+    async def message_handler(event):
+        try:
+            if event.is_private:
+                me = await get_cached_me(client, phone)
+                if me is not None and event.sender_id == me.id:
+                    return
+
+            # حساب واحد فقط من المجموعة يعالج رسائل القناة المصدر
+            if not is_pool_leader(phone):
+                return
+
+            if not catchup.claim(phone, account.source_channel, event.message.id):
+                return
+
+            # await client.forward_messages(account.source_channel, message)
+            await dispatch("source", account.source_channel, event)
+
+        except Exception as e:
+            catchup.finish(phone, account.source_channel, event.message.id, False)
+            logger.exception("خطأ في معالجة الرسالة: %s", e)
+
+    async def receiver_message_handler(event):
+        try:
+            # نفس القاعدة لأحداث حساب المستقبل حتى لا تكرر حسابات المجموعة الاستجابة لها
+            if not is_pool_leader(phone):
+                return
+
+            if not catchup.claim(phone, account.receiver_account, event.message.id):
+                return
+            await dispatch("receiver", account.receiver_account, event)
+        except Exception as e:
+            catchup.finish(phone, account.receiver_account, event.message.id, False)
+            logger.exception("Error in receiver_message_handler: %s", e)
+
+    return [
+        (message_handler, events.NewMessage(chats=account.source_channel), account.source_channel),
+        (receiver_message_handler, events.NewMessage(chats=account.receiver_account), account.receiver_account)
+    ]
+
+# مراقب الاتصال: فترة الفحص، نافذة انقطاع التحديثات، وحدود التأخير بين محاولات إعادة الاتصال
+supervisor_interval = settings.supervisor_interval
+heartbeat_window = settings.heartbeat_window
+reconnect_base_delay = settings.reconnect_base_delay
+reconnect_max_delay = settings.reconnect_max_delay
+
+class ForwardingRuntime:
+    """خط تحويل الرسائل لحساب واحد: يملك المعالجات المسجلة ومهمة run_until_disconnected
+
+    يراقبه مراقب اتصال يكتشف الانقطاع وتوقف التحديثات، ويعيد الاتصال مع تأخير أسي عشوائي
+    ثم يعيد تشغيل خط التحويل واستدراك الرسائل الفائتة.
+    """
+
+    def __init__(self, client: TelegramClient, phone: str):
+        self.client = client
+        self.phone = phone
+        self.handlers: List[Tuple[object, events.NewMessage, Union[int, str]]] = []
+        self.task: Optional[asyncio.Task] = None
+        self.catchup_task: Optional[asyncio.Task] = None
+        self.supervisor_task: Optional[asyncio.Task] = None
+        self.last_update = time.monotonic()
+        self.degraded_since: Optional[float] = None
+        self.supervisor_stats: Dict[str, float] = {
+            "reconnects": 0, "failed_reconnects": 0, "stalls": 0, "degraded_seconds": 0.0
+        }
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self) -> asyncio.Task:
+        """تسجيل المعالجات وبدء التشغيل مرة واحدة فقط"""
+        if self.running:
+            logger.info("خط التحويل للمستخدم %s يعمل بالفعل", self.phone)
+            return self.task
+        if not self.handlers:
+            self.handlers = build_forwarding_handlers(self.client, self.phone)
+            for callback, event, _ in self.handlers:
+                self.client.add_event_handler(callback, event)
+            self.client.add_event_handler(self._heartbeat, events.Raw())
+        self._launch()
+        asyncio.create_task(peers.warm_up(self.client, self.phone))
+        if self.supervisor_task is None or self.supervisor_task.done():
+            self.supervisor_task = asyncio.create_task(self._supervise())
+        return self.task
+
+    def _launch(self):
+        """بدء مهمة التشغيل واستدراك ما فات أثناء الانقطاع بالتوازي مع الأحداث المباشرة"""
+        active_sessions[self.phone] = True
+        self.last_update = time.monotonic()
+        cursors = catchup.cursors(self.phone, [chat for _, _, chat in self.handlers])
+        self.task = asyncio.create_task(self._run())
+        self.catchup_task = asyncio.create_task(
+            catchup.catch_up(self.client, self.phone, [(chat, callback, cursors[chat]) for callback, _, chat in self.handlers])
+        )
+
+    async def _heartbeat(self, update):
+        self.last_update = time.monotonic()
+
+    async def stop(self):
+        """إزالة المعالجات وإيقاف مهمة التشغيل ومراقب الاتصال"""
+        if self.supervisor_task is not None and self.supervisor_task is not asyncio.current_task():
+            self.supervisor_task.cancel()
+            await asyncio.gather(self.supervisor_task, return_exceptions=True)
+            self.supervisor_task = None
+        if self.handlers:
+            self.client.remove_event_handler(self._heartbeat)
+        for callback, event, _ in self.handlers:
+            self.client.remove_event_handler(callback, event)
+        self.handlers = []
+        await self._stop_tasks()
+
+    async def _stop_tasks(self):
+        if self.catchup_task is not None and not self.catchup_task.done():
+            self.catchup_task.cancel()
+            await asyncio.gather(self.catchup_task, return_exceptions=True)
+        self.catchup_task = None
+        if self.running:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    async def restart(self, client: Optional[TelegramClient] = None) -> asyncio.Task:
+        """إعادة تشغيل خط التحويل، مع إمكانية ربطه بعميل جديد"""
+        await self.stop()
+        if client is not None:
+            self.client = client
+        return self.start()
+
+    async def _run(self):
+        try:
+            logger.info("بدء تحويل الرسائل للمستخدم %s", self.phone)
+            # تشغيل العميل
+            await self.client.run_until_disconnected()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("خطأ في عملية تحويل الرسائل للمستخدم %s: %s", self.phone, e)
+        finally:
+            active_sessions[self.phone] = False
+            await catchup.saver.flush()
+            logger.info("انتهت عملية تحويل الرسائل للمستخدم %s", self.phone)
+
+    async def _check(self) -> Optional[str]:
+        """سبب تعطل خط التحويل أو None إذا كان سليماً"""
+        if not self.client.is_connected():
+            return "انقطع الاتصال"
+        if not self.running:
+            return "توقفت مهمة التشغيل"
+        if time.monotonic() - self.last_update < heartbeat_window:
+            return None
+        # لا توجد تحديثات خلال النافذة: التحقق من أن الاتصال ما زال يستجيب
+        try:
+            await asyncio.wait_for(self.client(GetStateRequest()), timeout=30)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.supervisor_stats["stalls"] += 1
+            return f"لا توجد تحديثات منذ {heartbeat_window:.0f} ثانية والاتصال لا يستجيب: {e}"
+        # الاتصال سليم لكن المحادثات هادئة: استدراك احتياطي لأي رسالة لم تصل كتحديث
+        self.last_update = time.monotonic()
+        if self.catchup_task is None or self.catchup_task.done():
+            cursors = catchup.cursors(self.phone, [chat for _, _, chat in self.handlers])
+            self.catchup_task = asyncio.create_task(
+                catchup.catch_up(self.client, self.phone, [(chat, callback, cursors[chat]) for callback, _, chat in self.handlers])
+            )
+        return None
+
+    async def _reconnect(self):
+        """إعادة الاتصال مع تأخير أسي عشوائي حتى النجاح ثم إعادة تشغيل خط التحويل"""
+        attempt = 0
+        while True:
+            try:
+                await self._stop_tasks()
+                if self.client.is_connected():
+                    await self.client.disconnect()
+                await self.client.connect()
+                if not await self.client.is_user_authorized():
+                    logger.error("الجلسة للرقم %s لم تعد مفوضة، يجب تسجيل الدخول يدوياً", self.phone)
+                    RECONNECTS.inc(phone=self.phone, outcome="unauthorized")
+                    return False
+                self._launch()
+                self.supervisor_stats["reconnects"] += 1
+                RECONNECTS.inc(phone=self.phone, outcome="success")
+                logger.info("تمت إعادة الاتصال وتشغيل خط التحويل للمستخدم %s بعد %s محاولة", self.phone, attempt + 1)
+                return True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.supervisor_stats["failed_reconnects"] += 1
+                RECONNECTS.inc(phone=self.phone, outcome="failure")
+                delay = min(reconnect_max_delay, reconnect_base_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning("فشلت إعادة الاتصال للمستخدم %s: %s، المحاولة التالية بعد %.1f ثانية", self.phone, e, delay)
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _supervise(self):
+        """مراقبة الاتصال وتدفق التحديثات وإعادة الاتصال تلقائياً عند التعطل"""
+        while True:
+            await asyncio.sleep(supervisor_interval)
+            try:
+                problem = await self._check()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                problem = f"فشل فحص الاتصال: {e}"
+            if problem is None:
+                continue
+            logger.warning("خط التحويل للمستخدم %s متعطل (%s)، بدء إعادة الاتصال", self.phone, problem)
+            self.degraded_since = time.monotonic()
+            try:
+                recovered = await self._reconnect()
+            finally:
+                degraded = time.monotonic() - self.degraded_since
+                self.degraded_since = None
+                self.supervisor_stats["degraded_seconds"] += degraded
+                DEGRADED_SECONDS.inc(degraded, phone=self.phone)
+            if not recovered:
+                return
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "running": self.running,
+            "degraded": self.degraded_since is not None,
+            "seconds_since_update": round(time.monotonic() - self.last_update, 1),
+            **self.supervisor_stats
+        }
+
+# خط تحويل واحد لكل حساب
+forwarding_runtimes: Dict[str, ForwardingRuntime] = {}
+
+async def start_message_forwarding(client: TelegramClient, phone: str) -> ForwardingRuntime:
+    """بدء عملية تحويل الرسائل مع ضمان وجود خط تحويل نشط واحد فقط لكل حساب"""
+    runtime = forwarding_runtimes.get(phone)
+    if runtime is None:
+        runtime = ForwardingRuntime(client, phone)
+        forwarding_runtimes[phone] = runtime
+        runtime.start()
+    elif runtime.client is not client:
+        logger.info("تم ربط خط التحويل للمستخدم %s بعميل جديد", phone)
+        await runtime.restart(client)
+    else:
+        runtime.start()
+    return runtime
+
+@app.get("/status")
+async def get_status():
+    """عرض حالة الجلسات النشطة"""
+    active_count = sum(active_sessions.values())
+    total_clients = len(clients)
+    
+    return {
+        "active_sessions": active_count,
+        "total_clients": total_clients,
+        "sessions": active_sessions,
+        "file_ops": file_ops_metrics(),
+        "parallel_transfers": parallel_stats,
+        "job_queue": job_queue.metrics(),
+        "accounts": {
+            phone: {
+                "source_channel": account.source_channel,
+                "target_channel_id": account.target_channel_id,
+                "pool_leader": is_pool_leader(phone)
+            }
+            for phone, account in accounts.items()
+        },
+        "delivery": delivery_state,
+        "outbound": outbound.metrics(),
+        "media_dedup": {**media_dedup.stats, "entries": len(media_dedup.entries)},
+        "catchup": {**catchup.stats, "chats": catchup.last_ids},
+        "routing": [rule.name for rule in routing.rules],
+        "peers": {**peers.stats, "cached": len(peers.peers)},
+        "session_store": {"backend": session_store.backend, **session_store.metrics()},
+        "marks_csv": marks_csv.summaries,
+        "marks_zip": marks_zip.changes,
+        "pipelines": {phone: runtime.status() for phone, runtime in forwarding_runtimes.items()},
+        "runtime": leader.status(),
+        "logging": {**log_stats, "queue_depth": log_listener.queue.qsize()},
+        "startup": startup_report.summary(),
+        "identities": {
+            phone: {
+                "id": getattr(me, 'id', None),
+                "username": getattr(me, 'username', None),
+                "first_name": getattr(me, 'first_name', None)
+            }
+            for phone, me in me_cache.items()
+        }
+    }
+
+def render_metrics() -> str:
+    """جميع المقاييس بصيغة Prometheus النصية"""
+    lines: List[str] = []
+    for metric in metrics_registry:
+        lines.extend(metric.render())
+
+    gauges = [
+        ("forwarder_active_sessions", "Number of active forwarding sessions", [((), sum(active_sessions.values()))]),
+        ("forwarder_job_queue_depth", "Jobs waiting in each queue lane",
+         [((("lane", lane),), lane_stats["depth"]) for lane, lane_stats in job_queue.metrics().items()]),
+        ("forwarder_job_queue_running", "Jobs currently running in each queue lane",
+         [((("lane", lane),), lane_stats["running"]) for lane, lane_stats in job_queue.metrics().items()]),
+        ("forwarder_file_ops_queue_depth", "File operations waiting for a worker thread", [((), file_ops_metrics()["queue_depth"])]),
+        ("forwarder_outbound_retry_queue", "Deliveries waiting in the durable retry queue", [((), len(outbound.retry_queue))]),
+        ("forwarder_event_loop_lag_last_seconds", "Most recent event loop lag sample", [((), loop_lag_state["last"])]),
+        ("forwarder_event_loop_lag_max_seconds", "Maximum event loop lag since start", [((), loop_lag_state["max"])])
+    ]
+    for name, help_text, samples in gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(f"{name}{format_labels(labels)} {value}" for labels, value in samples)
+
+    counters = [
+        ("forwarder_flood_waits_total", "FloodWait errors received on outbound sends", outbound.stats["flood_waits"]),
+        ("forwarder_flood_wait_seconds_total", "Total FloodWait seconds requested by Telegram", outbound.stats["flood_wait_seconds"]),
+        ("forwarder_outbound_sent_total", "Successful outbound sends", outbound.stats["sent"]),
+        ("forwarder_outbound_send_errors_total", "Send attempts that raised after inline retries (may be recovered later)", outbound.stats["send_errors"]),
+        ("forwarder_outbound_failed_total", "Deliveries that finally failed after every fallback and durable retry", outbound.stats["failed"])
+    ]
+    for name, help_text, value in counters:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """مقاييس خط التحويل بصيغة Prometheus"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# الجلسة النصية تحتوي على مفتاح التفويض، لذلك لا يُسمح بتصديرها إلا بسر منفصل عن كلمة مرور الواجهة
+session_export_token = settings.session_export_token
+
+@app.post("/session_string")
+async def session_string(phone: str = Form(...), token: str = Form(...)):
+    """تصدير الجلسة النصية لحساب لحفظها في SESSION_STRINGS (معطل ما لم يُعيّن SESSION_EXPORT_TOKEN)"""
+    if not session_export_token:
+        raise HTTPException(status_code=404, detail="تصدير الجلسات غير مفعل")
+    if not hmac.compare_digest(token.encode(), session_export_token.encode()):
+        raise HTTPException(status_code=403, detail="رمز التصدير غير صحيح")
+    value = session_store.export(resolve_phone(phone))
+    if value is None:
+        raise HTTPException(status_code=404, detail="لا توجد جلسة لهذا الحساب")
+    return PlainTextResponse(value)
+
+@app.get("/logout/{phone}")
+async def logout(phone: str):
+    """تسجيل الخروج من حساب معين"""
+    try:
+        if phone in clients:
+            client = clients[phone]
+            runtime = forwarding_runtimes.pop(phone, None)
+            if runtime is not None:
+                await runtime.stop()
+            await client.disconnect()
+            del clients[phone]
+            active_sessions[phone] = False
+            me_cache.pop(phone, None)
+            return {"message": f"تم تسجيل الخروج من {phone}"}
+        else:
+            raise HTTPException(status_code=404, detail="الحساب غير موجود")
+    except Exception as e:
+        logger.error("خطأ في تسجيل الخروج: %s", e)
+        raise HTTPException(status_code=500, detail="خطأ في تسجيل الخروج")
+
+async def restore_session(phone: str) -> bool:
+    """استعادة جلسة محفوظة وبدء التحويل دون حذف ملف الجلسة عند الفشل"""
+    if phone in clients and active_sessions.get(phone):
+        return True
+
+    client = TelegramClient(await session_store.open(phone), api_id, api_hash)
+    try:
+        await client.connect()
+        if not await client.is_user_authorized():
+            logger.warning("الجلسة المحفوظة للرقم %s غير مصرح بها، يجب تسجيل الدخول يدوياً", phone)
+            await client.disconnect()
+            return False
+    except Exception as e:
+        logger.error("فشل في استعادة الجلسة للرقم %s: %s", phone, e)
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
+        return False
+
+    clients[phone] = client
+    await refresh_me(client, phone)
+    await start_message_forwarding(client, phone)
+    logger.info("تمت استعادة الجلسة وبدء التحويل للرقم %s", phone)
+    return True
+
+async def restore_all_sessions():
+    """استعادة جميع الجلسات المحفوظة في مجلد الجلسات بالتوازي"""
+    startup_state["started_at"] = time.time()
+    try:
+        phones = await session_store.phones()
+        logger.info("استعادة الجلسات عند بدء التشغيل: %s", phones)
+
+        results = await asyncio.gather(*(restore_session(phone) for phone in phones), return_exceptions=True)
+        for phone, result in zip(phones, results):
+            if result is True:
+                startup_state["restored"].append(phone)
+            else:
+                startup_state["failed"].append(phone)
+    except Exception as e:
+        logger.error("خطأ في استعادة الجلسات عند بدء التشغيل: %s", e)
+    finally:
+        startup_state["ready"] = True
+        startup_state["finished_at"] = time.time()
+        logger.info("انتهت استعادة الجلسات خلال %.2f ثانية", startup_state['finished_at'] - startup_state['started_at'])
+        startup_report.mark("restore_sessions")
+        logger.info("تفصيل زمن بدء التشغيل: %s", startup_report.summary())
+
+# تشغيل عدة عمليات uvicorn: عملية واحدة فقط (القائد) تملك عملاء Telethon عبر قفل ملف،
+# وباقي العمليات تخدم HTTP وتمرر الطلبات التي تحتاج العملاء إلى القائد عبر مقبس Unix محلي
+runtime_lock_file = settings.runtime_lock_file
+runtime_socket = settings.runtime_socket
+leader_retry_interval = settings.leader_retry_interval
+leader_cache_ttl = settings.leader_cache_ttl
+leader_ipc_timeout = settings.leader_ipc_timeout
+
+class LeaderElection:
+    """انتخاب قائد واحد بين العمليات وتمرير طلبات HTTP إليه من العمليات التابعة"""
+
+    # مسارات تُخدم محلياً في كل عملية دون الرجوع إلى القائد
+    LOCAL_PATHS = {"/health", "/ready"}
+    # مسارات قراءة تُخزن استجابتها مؤقتاً في العمليات التابعة
+    CACHED_PATHS = {"/status", "/metrics"}
+    MAX_MESSAGE = 16 * 1024 * 1024
+
+    def __init__(self, lock_file: str, socket_path: str, retry_interval: float, cache_ttl: float, timeout: float):
+        self.lock_file = lock_file
+        self.socket_path = socket_path
+        self.retry_interval = retry_interval
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+        self.is_leader = False
+        self.lock_fd: Optional[int] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.watch_task: Optional[asyncio.Task] = None
+        self.on_elected: Optional[Callable[[], Awaitable[None]]] = None
+        self.cache: Dict[Tuple[str, str, str], Tuple[float, dict]] = {}
+        self.stats: Dict[str, int] = {"elections": 0, "served": 0, "forwarded": 0, "cache_hits": 0, "failed": 0}
+
+    @property
+    def ipc_supported(self) -> bool:
+        return fcntl is not None and hasattr(asyncio, 'start_unix_server')
+
+    def try_acquire(self) -> bool:
+        """محاولة أخذ القفل دون انتظار؛ يحرره نظام التشغيل تلقائياً عند انتهاء العملية"""
+        if fcntl is None:
+            # بدون fcntl لا يمكن التنسيق بين العمليات، لذا تعمل العملية كقائد (عملية واحدة فقط)
+            return True
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self.lock_fd = fd
+        return True
+
+    def release(self):
+        if self.lock_fd is not None:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    async def start(self, on_elected: Callable[[], Awaitable[None]]):
+        self.on_elected = on_elected
+        if await run_file_op(self.try_acquire):
+            await self._become_leader()
+        else:
+            logger.info("العملية %s تعمل كتابع، عملاء Telegram يديرها القائد", os.getpid())
+            self.watch_task = asyncio.create_task(self._watch())
+
+    async def _become_leader(self):
+        self.is_leader = True
+        self.stats["elections"] += 1
+        self.cache.clear()
+        logger.info("العملية %s أصبحت القائد وستدير عملاء Telegram", os.getpid())
+        if self.ipc_supported:
+            try:
+                if await aio_path_exists(self.socket_path):
+                    # مقبس قديم من قائد سابق (القفل يضمن أنه لم يعد مستخدماً)
+                    await aio_remove(self.socket_path)
+                self.server = await asyncio.start_unix_server(self._handle, path=self.socket_path, limit=self.MAX_MESSAGE)
+            except Exception as e:
+                logger.error("فشل في فتح مقبس القائد %s: %s", self.socket_path, e)
+        await self.on_elected()
+
+    async def _watch(self):
+        """إعادة محاولة أخذ القفل حتى يتولى تابع القيادة عند توقف القائد"""
+        while True:
+            await asyncio.sleep(self.retry_interval)
+            try:
+                if await run_file_op(self.try_acquire):
+                    await self._become_leader()
+                    return
+            except Exception as e:
+                logger.error("خطأ في محاولة تولي القيادة: %s", e)
+
+    async def stop(self):
+        if self.watch_task is not None:
+            self.watch_task.cancel()
+            await asyncio.gather(self.watch_task, return_exceptions=True)
+            self.watch_task = None
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+            try:
+                await aio_remove(self.socket_path)
+            except OSError:
+                pass
+        if self.lock_fd is not None:
+            await run_file_op(self.release)
+        self.is_leader = False
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """خدمة طلب واحد من عملية تابعة عبر تمريره إلى التطبيق داخل عملية القائد"""
+        try:
+            line = await reader.readline()
+            if not line:
+                # اتصال فحص من leader_reachable دون طلب
+                return
+            request = json.loads(line)
+            response = await self.dispatch(request)
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+            self.stats["served"] += 1
+        except Exception as e:
+            logger.error("خطأ في خدمة طلب من عملية تابعة: %s", e)
+        finally:
+            writer.close()
+
+    async def dispatch(self, request: dict) -> dict:
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": request["method"],
+            "scheme": request["scheme"],
+            "path": request["path"],
+            "raw_path": request["path"].encode(),
+            "root_path": "",
+            "query_string": request["query"].encode('latin-1'),
+            "headers": [(name.encode('latin-1'), value.encode('latin-1')) for name, value in request["headers"]],
+            "client": tuple(request["client"]) if request["client"] else None,
+            "server": None
+        }
+        body = base64.b64decode(request["body"])
+        responded = asyncio.Event()
+        pending = [{"type": "http.request", "body": body, "more_body": False}]
+        response: Dict[str, object] = {"status": 500, "headers": [], "body": b""}
+
+        async def receive():
+            if pending:
+                return pending.pop()
+            await responded.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [[name.decode('latin-1'), value.decode('latin-1')] for name, value in message.get("headers", [])]
+            elif message["type"] == "http.response.body":
+                response["body"] += message.get("body", b"")
+                if not message.get("more_body"):
+                    responded.set()
+
+        try:
+            await app(scope, receive, send)
+        except Exception as e:
+            # ServerErrorMiddleware أرسل استجابة 500 بالفعل، تُعاد كما هي إلى العملية التابعة
+            logger.error("خطأ في معالجة طلب %s %s لعملية تابعة: %s", request['method'], request['path'], e)
+        responded.set()
+        response["body"] = base64.b64encode(response["body"]).decode()
+        return response
+
+    async def leader_reachable(self) -> bool:
+        """هل يقبل مقبس القائد الاتصال الآن (فحص جاهزية العملية التابعة)"""
+        if not self.ipc_supported:
+            return False
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_unix_connection(self.socket_path), timeout=min(self.timeout, 1))
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
+
+    async def forward(self, scope: dict, body: bytes) -> dict:
+        """تمرير طلب من عملية تابعة إلى القائد، مع تخزين مؤقت قصير لمسارات الحالة"""
+        key = (scope["method"], scope["path"], scope["query_string"].decode('latin-1'))
+        cacheable = scope["method"] == "GET" and scope["path"] in self.CACHED_PATHS
+        if cacheable:
+            cached = self.cache.get(key)
+            if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+                self.stats["cache_hits"] += 1
+                return cached[1]
+
+        request = {
+            "method": scope["method"],
+            "scheme": scope.get("scheme", "http"),
+            "path": scope["path"],
+            "query": key[2],
+            "headers": [[name.decode('latin-1'), value.decode('latin-1')] for name, value in scope["headers"]],
+            "client": list(scope["client"]) if scope.get("client") else None,
+            "body": base64.b64encode(body).decode()
+        }
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.socket_path, limit=self.MAX_MESSAGE), timeout=self.timeout)
+            try:
+                writer.write(json.dumps(request).encode() + b"\n")
+                await writer.drain()
+                response = json.loads(await asyncio.wait_for(reader.readline(), timeout=self.timeout))
+            finally:
+                writer.close()
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.warning("تعذر الوصول إلى عملية القائد: %s", e)
+            return {
+                "status": 503,
+                "headers": [["content-type", "application/json"]],
+                "body": base64.b64encode(json.dumps({"detail": "عملية القائد غير متاحة حالياً"}).encode()).decode()
+            }
+
+        self.stats["forwarded"] += 1
+        if cacheable and response["status"] == 200:
+            self.cache[key] = (time.monotonic(), response)
+        return response
+
+    def status(self) -> dict:
+        return {
+            "role": "leader" if self.is_leader else "follower",
+            "pid": os.getpid(),
+            "ipc": self.ipc_supported,
+            **self.stats
+        }
+
+leader = LeaderElection(runtime_lock_file, runtime_socket, leader_retry_interval, leader_cache_ttl, leader_ipc_timeout)
+
+class LeaderProxyMiddleware:
+    """في العمليات التابعة: تمرير طلبات HTTP إلى القائد لأنه وحده يملك العملاء والحالة"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or leader.is_leader or scope["path"] in LeaderElection.LOCAL_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        response = await leader.forward(scope, body)
+        await send({
+            "type": "http.response.start",
+            "status": response["status"],
+            "headers": [(name.encode('latin-1'), value.encode('latin-1')) for name, value in response["headers"]]
+        })
+        await send({"type": "http.response.body", "body": base64.b64decode(response["body"])})
+
+app.add_middleware(LeaderProxyMiddleware)
+
+async def start_runtime():
+    """تشغيل عملاء Telegram وخطوط التحويل (في عملية القائد فقط)"""
+    await outbound.start()
+    await peers.start()
+    await catchup.ensure_loaded()
+    asyncio.create_task(restore_all_sessions())
+
+@app.on_event("startup")
+async def startup_event():
+    """انتخاب القائد ثم بدء استعادة الجلسات في الخلفية حتى لا يتأخر فتح المنفذ"""
+    asyncio.create_task(monitor_event_loop_lag())
+    await leader.start(start_runtime)
+    startup_report.mark("app_startup")
+
+async def close_all_sessions():
+    """إيقاف خطوط التحويل وإنهاء المهام الجارية ثم قطع اتصال جميع العملاء"""
+    for runtime in list(forwarding_runtimes.values()):
+        await runtime.stop()
+    await job_queue.join()
+    await asyncio.gather(*(client.disconnect() for client in clients.values()), return_exceptions=True)
+    await session_store.flush()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """إغلاق جميع الجلسات عند إيقاف التطبيق"""
+    if not leader.is_leader:
+        await leader.stop()
+        file_ops_executor.shutdown(wait=False)
+        return
+    logger.info("إغلاق جميع الجلسات...")
+    try:
+        await asyncio.wait_for(close_all_sessions(), timeout=shutdown_timeout)
+    except asyncio.TimeoutError:
+        logger.warning("تجاوز إغلاق الجلسات المهلة المحددة (%s ثانية)", shutdown_timeout)
+    except Exception as e:
+        logger.error("خطأ في إغلاق الجلسات: %s", e)
+    await job_queue.stop()
+    await outbound.stop()
+    await peers.stop()
+    # تحرير القفل بعد قطع اتصال العملاء حتى لا يفتح القائد التالي الجلسات نفسها مبكراً
+    await leader.stop()
+    file_ops_executor.shutdown(wait=False)
+    for phone in list(active_sessions):
+        active_sessions[phone] = False
+
+startup_report.mark("app_module")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+قياس أداء خط تحويل الرسائل دون حساب Telegram حقيقي
+
+يستبدل TelegramClient بعميل محلي يولد أحداث NewMessage اصطناعية (صور، ملف ZIP للعلامات،
+marks.csv، رسائل 'تم') بمعدل وأحجام قابلة للتعديل، ويحاكي سرعة التحميل والرفع و FloodWait.
+يعرض الإنتاجية وزمن الوصول (p50/p99) من الحدث حتى التسليم وأقصى استهلاك للذاكرة.
+
+مثال:
+    python benchmark.py --zips 5 --zip-size-mb 20 --photos 20 --dones 20 --mode stream
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Set
+
+MARKS_ZIP_NAME = "علامات_كلية_الآداب_والعلوم_الانسانية_ـ_ف2_ـ_2024_2025.zip"
+
+# قيم افتراضية حتى يمكن استيراد app.py دون ملف .env
+BENCH_ENV = {
+    "API_ID": "1",
+    "API_HASH": "benchmark",
+    "PASSWORD": "benchmark",
+    "SOURCE_CHANNEL": "-1001000000001",
+    "RECEIVER_ACCOUNT": "-1001000000002",
+    "TARGET_CHANNEL_ID": "-1001000000003",
+    "BOT_AD": "benchmark_bot",
+    "PHONE": "+10000000000",
+}
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.username = "benchmark"
+        self.first_name = "Benchmark"
+
+
+class FakeFile:
+    def __init__(self, size: int, ext: str, name: Optional[str]):
+        self.size = size
+        self.ext = ext
+        self.name = name
+
+
+class FakeAttribute:
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+
+
+class FakeDocument:
+    def __init__(self, doc_id: int, file_name: str, size: int):
+        self.id = doc_id
+        self.access_hash = random.getrandbits(63)
+        self.file_reference = os.urandom(8)
+        self.size = size
+        self.mime_type = "application/octet-stream"
+        self.attributes = [FakeAttribute(file_name)]
+
+
+class FakePhoto:
+    def __init__(self, photo_id: int):
+        self.id = photo_id
+        self.access_hash = random.getrandbits(63)
+        self.file_reference = os.urandom(8)
+
+
+class FakeMedia:
+    """مرجع وسائط رسالة (ما يعادل MessageMediaDocument/MessageMediaPhoto)"""
+
+    def __init__(self, message: "FakeMessage"):
+        self.message = message
+        self.size = message.file.size if message.file else 0
+
+
+class FakeUploaded:
+    """ملف مرفوع (ما يعادل InputFile)"""
+
+    def __init__(self, size: int, name: str):
+        self.size = size
+        self.name = name
+
+
+class FakeMessage:
+    def __init__(self, client: "FakeTelegramClient", message_id: int, chat_id, kind: str,
+                 size: int = 0, file_name: Optional[str] = None, text: str = "", grouped_id: Optional[int] = None):
+        self.client = client
+        self.id = message_id
+        self.grouped_id = grouped_id
+        self.chat_id = chat_id
+        self.kind = kind
+        self.text = text
+        self.raw_text = text
+        self.date = datetime.datetime.now(datetime.timezone.utc)
+        self.photo = FakePhoto(message_id) if kind == "photo" else None
+        self.document = FakeDocument(message_id, file_name, size) if kind == "document" else None
+        if kind == "photo":
+            self.file = FakeFile(size, ".jpg", None)
+        elif kind == "document":
+            self.file = FakeFile(size, os.path.splitext(file_name)[1], file_name)
+        else:
+            self.file = None
+        self.media = FakeMedia(self) if self.file else None
+
+    async def download_media(self, file=None):
+        """محاكاة التحميل إلى مجلد ثم كتابة ملف بنفس الحجم"""
+        await self.client.simulate_download(self.file.size)
+        name = self.file.name or f"photo_{self.id}{self.file.ext}"
+        path = os.path.join(file, name) if file and os.path.isdir(file) else (file or name)
+        with open(path, "wb") as f:
+            remaining = self.file.size
+            chunk = b"\0" * min(remaining, 1024 * 1024)
+            while remaining > 0:
+                f.write(chunk[:remaining])
+                remaining -= len(chunk)
+        return path
+
+
+class FakeEvent:
+    def __init__(self, message: FakeMessage):
+        self.message = message
+        self.raw_text = message.raw_text
+        self.is_private = False
+        self.sender_id = None
+        self.chat_id = message.chat_id
+
+
+class FakeTelegramClient:
+    """عميل Telegram محلي يحاكي النطاق الترددي وزمن الرحلة و FloodWait"""
+
+    def __init__(self, download_mbps: float, upload_mbps: float, rtt: float,
+                 flood_rate: float, flood_seconds: int, reference_failure_rate: float):
+        self.download_bps = download_mbps * 1024 * 1024 / 8
+        self.upload_bps = upload_mbps * 1024 * 1024 / 8
+        self.rtt = rtt
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.reference_failure_rate = reference_failure_rate
+        self.handlers = []
+        self.messages: Dict[int, FakeMessage] = {}
+        self.connected = True
+        self.disconnected = asyncio.Event()
+        self.stats = {"sends": 0, "uploads": 0, "downloads": 0, "bytes_up": 0, "bytes_down": 0, "flood_waits": 0, "resolves": 0}
+
+    # --- واجهة TelegramClient المستخدمة في app.py
+    def add_event_handler(self, callback, event):
+        self.handlers.append((callback, event))
+
+    def remove_event_handler(self, callback, event=None):
+        self.handlers = [(cb, ev) for cb, ev in self.handlers if cb != callback]
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def connect(self):
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+        self.disconnected.set()
+
+    async def is_user_authorized(self) -> bool:
+        return True
+
+    async def get_me(self):
+        await asyncio.sleep(self.rtt)
+        return FakeUser(1)
+
+    async def run_until_disconnected(self):
+        await self.disconnected.wait()
+
+    async def get_input_entity(self, peer):
+        """محاكاة حل الوجهة (ResolveUsername) بزمن رحلة واحد"""
+        from telethon.tl.types import InputPeerChannel
+        await asyncio.sleep(self.rtt)
+        self.stats["resolves"] += 1
+        return InputPeerChannel(abs(hash(str(peer))) % 2 ** 31, 0)
+
+    async def get_entity(self, peer):
+        return await self.get_input_entity(peer)
+
+    async def get_messages(self, chat, ids=None, **kwargs):
+        await asyncio.sleep(self.rtt)
+        return self.messages.get(ids)
+
+    async def send_message(self, entity, message, **kwargs):
+        await self._request()
+        self.stats["sends"] += 1
+        return message
+
+    async def send_file(self, entity, file, caption=None, **kwargs):
+        await self._request()
+        if isinstance(file, (list, tuple)):
+            for item in file:
+                await self._send_one(item)
+        else:
+            await self._send_one(file)
+        self.stats["sends"] += 1
+        return file
+
+    async def upload_file(self, file, file_size=None, file_name=None, **kwargs):
+        if isinstance(file, str):
+            size = os.path.getsize(file)
+        elif file_size is not None:
+            size = file_size
+            file.read()
+        else:
+            size = len(file.read())
+        await self.simulate_upload(size)
+        self.stats["uploads"] += 1
+        return FakeUploaded(size, file_name or "file")
+
+    async def __call__(self, request):
+        """محاكاة طلبات رفع الأجزاء (SaveFilePartRequest / SaveBigFilePartRequest)"""
+        await self.simulate_upload(len(request.bytes))
+        if request.file_part == 0:
+            self.stats["uploads"] += 1
+        return True
+
+    def iter_download(self, media, request_size: int = 512 * 1024, offset: int = 0, limit: Optional[int] = None, **kwargs):
+        size = media.size if isinstance(media, FakeMedia) else 0
+
+        async def chunks():
+            remaining = size - offset
+            count = 0
+            while remaining > 0 and (limit is None or count < limit):
+                part = min(request_size, remaining)
+                await asyncio.sleep(part / self.download_bps)
+                self.stats["bytes_down"] += part
+                remaining -= part
+                count += 1
+                yield b"\0" * part
+            if offset == 0:
+                self.stats["downloads"] += 1
+        return chunks()
+
+    # --- المحاكاة
+    async def _request(self):
+        await asyncio.sleep(self.rtt)
+        if self.flood_rate and random.random() < self.flood_rate:
+            from telethon.errors import FloodWaitError
+            self.stats["flood_waits"] += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+
+    async def _send_one(self, file):
+        if isinstance(file, FakeMedia) or type(file).__name__ == "InputPhoto":
+            if random.random() < self.reference_failure_rate:
+                raise ValueError("FILE_REFERENCE_EXPIRED (simulated)")
+        elif isinstance(file, str):
+            await self.simulate_upload(os.path.getsize(file))
+
+    async def simulate_download(self, size: int):
+        await asyncio.sleep(self.rtt + size / self.download_bps)
+        self.stats["downloads"] += 1
+        self.stats["bytes_down"] += size
+
+    async def simulate_upload(self, size: int):
+        await asyncio.sleep(self.rtt + size / self.upload_bps)
+        self.stats["bytes_up"] += size
+
+    def emit(self, chat, message: FakeMessage):
+        """إرسال حدث NewMessage إلى المعالجات المسجلة لهذه المحادثة"""
+        self.messages[message.id] = message
+        for callback, builder in self.handlers:
+            chats = getattr(builder, "chats", None)
+            chats = chats if isinstance(chats, (list, tuple, set)) else [chats]
+            if chat in chats:
+                asyncio.ensure_future(callback(FakeEvent(message)))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def build_workload(args, client: FakeTelegramClient, source, receiver) -> List[tuple]:
+    """بناء قائمة الأحداث الاصطناعية بترتيب عشوائي ثابت (صور الألبوم الواحد تبقى متتالية)"""
+    units = []
+    message_id = 1000
+    for kind, count in (("photo", args.photos), ("album", args.albums), ("zip", args.zips), ("csv", args.csvs), ("done", args.dones)):
+        for _ in range(count):
+            message_id += 1
+            if kind == "photo":
+                units.append([(source, FakeMessage(client, message_id, source, "photo", int(args.photo_size_kb * 1024)))])
+            elif kind == "album":
+                grouped_id = message_id
+                units.append([
+                    (source, FakeMessage(client, message_id + i, source, "photo", int(args.photo_size_kb * 1024), grouped_id=grouped_id))
+                    for i in range(args.album_size)
+                ])
+                message_id += args.album_size
+            elif kind == "zip":
+                units.append([(source, FakeMessage(client, message_id, source, "document",
+                                                   int(args.zip_size_mb * 1024 * 1024), MARKS_ZIP_NAME))])
+            elif kind == "csv":
+                units.append([(receiver, FakeMessage(client, message_id, receiver, "document",
+                                                     int(args.csv_size_kb * 1024), "marks.csv"))])
+            else:
+                units.append([(receiver, FakeMessage(client, message_id, receiver, "text", text="تم"))])
+    random.shuffle(units)
+    return [event for unit in units for event in unit]
+
+
+async def run_benchmark(args, app) -> dict:
+    app.media_pipeline_mode = args.mode
+    app.media_parallel_threshold = int(args.parallel_threshold_mb * 1024 * 1024)
+    app.media_parallel_workers = args.parallel_workers
+    app.outbound.rate = args.outbound_rate
+    app.outbound.burst = args.outbound_burst
+
+    # تسجيل زمن الوصول الفعلي لكل حدث بدلاً من مدرج المقاييس
+    latencies: Dict[str, List[float]] = {}
+    observe_delivery = app.observe_delivery
+
+    def record_delivery(message, handler):
+        observe_delivery(message, handler)
+        latencies.setdefault(handler, []).append(time.time() - message.date.timestamp())
+    app.observe_delivery = record_delivery
+
+    # كل رسالة تنتهي عبر catchup.finish سواء نجحت مهمتها أو فشلت، فلا ينتظر القياس المهلة كاملة عند الفشل
+    finished: Set[int] = set()
+    finish = app.catchup.finish
+
+    def record_finish(phone, chat, message_id, ok):
+        finish(phone, chat, message_id, ok)
+        finished.add(message_id)
+    app.catchup.finish = record_finish
+
+    client = FakeTelegramClient(args.download_mbps, args.upload_mbps, args.rtt_ms / 1000,
+                                args.flood_rate, args.flood_seconds, args.reference_failure_rate)
+    phone = app.default_phone
+    account = app.accounts[phone]
+    app.clients[phone] = client
+    app.me_cache[phone] = FakeUser(1)
+    await app.start_message_forwarding(client, phone)
+
+    events = build_workload(args, client, account.source_channel, account.receiver_account)
+    interval = 1 / args.rate if args.rate > 0 else 0
+    start = time.perf_counter()
+    for chat, message in events:
+        message.date = datetime.datetime.now(datetime.timezone.utc)
+        client.emit(chat, message)
+        if interval:
+            await asyncio.sleep(interval)
+
+    # انتظار انتهاء جميع المهام
+    expected = len(events)
+    deadline = time.perf_counter() + args.timeout
+    while len(finished) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    await app.job_queue.join()
+    elapsed = time.perf_counter() - start
+    app.catchup.finish = finish
+
+    await client.disconnect()
+    await app.job_queue.stop()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "mode": args.mode,
+        "events": expected,
+        "completed": len(all_latencies),
+        "failed": len(finished) - len(all_latencies),
+        "unfinished": expected - len(finished),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_events_per_second": round(len(all_latencies) / elapsed, 2) if elapsed else 0,
+        "latency_p50_seconds": round(percentile(all_latencies, 50), 4),
+        "latency_p99_seconds": round(percentile(all_latencies, 99), 4),
+        "latency_by_handler": {
+            handler: {
+                "count": len(values),
+                "p50": round(percentile(values, 50), 4),
+                "p99": round(percentile(values, 99), 4),
+            }
+            for handler, values in latencies.items()
+        },
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "client": client.stats,
+        "outbound": app.outbound.metrics(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="قياس أداء خط تحويل الرسائل باستخدام عميل Telegram وهمي")
+    parser.add_argument("--mode", choices=["stream", "disk"], default="stream", help="خط معالجة الوسائط")
+    parser.add_argument("--parallel-threshold-mb", type=float, default=0,
+                        help="حجم الملف الذي يبدأ عنده النقل المتوازي (0 معطل كما في التطبيق)")
+    parser.add_argument("--parallel-workers", type=int, default=4, help="عدد الأجزاء المنقولة بالتوازي")
+    parser.add_argument("--photos", type=int, default=10)
+    parser.add_argument("--albums", type=int, default=0, help="عدد الألبومات (صور بنفس grouped_id)")
+    parser.add_argument("--album-size", type=int, default=5)
+    parser.add_argument("--zips", type=int, default=3)
+    parser.add_argument("--csvs", type=int, default=3)
+    parser.add_argument("--dones", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=20, help="عدد الأحداث في الثانية (0 = دفعة واحدة)")
+    parser.add_argument("--photo-size-kb", type=float, default=200)
+    parser.add_argument("--zip-size-mb", type=float, default=10)
+    parser.add_argument("--csv-size-kb", type=float, default=500)
+    parser.add_argument("--download-mbps", type=float, default=200)
+    parser.add_argument("--upload-mbps", type=float, default=100)
+    parser.add_argument("--rtt-ms", type=float, default=50)
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="احتمال FloodWait لكل طلب إرسال")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--reference-failure-rate", type=float, default=0.0,
+                        help="احتمال فشل الإرسال بالمرجع (يجبر المسار البديل: تحميل ثم رفع)")
+    parser.add_argument("--outbound-rate", type=float, default=100, help="معدل الإرسال لكل وجهة")
+    parser.add_argument("--outbound-burst", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="طباعة النتيجة بصيغة JSON")
+    parser.add_argument("--verbose", action="store_true", help="إظهار سجلات التطبيق")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+
+    # تشغيل القياس داخل مجلد مؤقت حتى لا تتأثر مجلدات session و downloads الحقيقية
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp(prefix="forwarder-bench-")
+    os.chdir(workdir)
+    import app
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        app.logger.setLevel(logging.WARNING)
+
+    result = asyncio.run(run_benchmark(args, app))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+
+    print(f"الوضع: {result['mode']}")
+    print(f"الأحداث: {result['completed']}/{result['events']} خلال {result['elapsed_seconds']} ثانية"
+          f" (فشل: {result['failed']}، لم ينتهِ: {result['unfinished']})")
+    print(f"الإنتاجية: {result['throughput_events_per_second']} حدث/ثانية")
+    print(f"زمن الوصول: p50={result['latency_p50_seconds']}s p99={result['latency_p99_seconds']}s")
+    for handler, stats in result["latency_by_handler"].items():
+        print(f"  {handler}: n={stats['count']} p50={stats['p50']}s p99={stats['p99']}s")
+    print(f"أقصى استهلاك للذاكرة: {result['peak_rss_mb']} MB")
+    print(f"العميل: {result['client']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+تشغيل سريع: فتح المنفذ والإجابة على /health فوراً ثم تحميل التطبيق (app.py مع Telethon) في الخلفية
+
+زمن استيراد app.py و Telethon لا يتغير، وإنما يتم في الخلفية فقط: /health يجيب فوراً وباقي المسارات
+ترد بـ 503 حتى انتهاء التحميل.
+
+الاستخدام: uvicorn faststart:app (أو python run.py مع FAST_START=1)
+"""
+
+import asyncio
+import importlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class StartupReport:
+    """تفصيل زمن بدء التشغيل: كل مرحلة تُقاس من نهاية المرحلة السابقة"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.phases: Dict[str, float] = {}
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = round(now - self.last, 4)
+        self.last = now
+
+    def summary(self) -> dict:
+        return {"phases": dict(self.phases), "total": round(self.last - self.started, 4)}
+
+startup_report = StartupReport()
+
+class FastStartApp:
+    """تطبيق ASGI صغير يجيب على /health أثناء تحميل التطبيق الحقيقي ثم يمرر إليه كل الطلبات"""
+
+    def __init__(self, target: str):
+        self.target = target
+        self.app = None
+        self.error: Optional[str] = None
+        self.load_task: Optional[asyncio.Task] = None
+        self.lifespan_task: Optional[asyncio.Task] = None
+        self.lifespan_events: Optional[asyncio.Queue] = None
+        self.lifespan_replies: Optional[asyncio.Queue] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif self.app is not None:
+            await self.app(scope, receive, send)
+        elif scope["type"] == "http":
+            await self._loading_response(scope, send)
+        elif scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1013})
+
+    async def _loading_response(self, scope, send):
+        if scope["path"] == "/health":
+            if self.error is None:
+                status, content = 200, {"status": "ok", "loading": True}
+            else:
+                status, content = 503, {"status": "error", "detail": self.error}
+        else:
+            status, content = 503, {"detail": "التطبيق قيد التحميل، حاول مرة أخرى بعد لحظات"}
+        body = json.dumps(content, ensure_ascii=False).encode()
+        headers: List[Tuple[bytes, bytes]] = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode())
+        ]
+        if status == 503:
+            headers.append((b"retry-after", b"1"))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # الرد فوراً حتى يفتح uvicorn المنفذ، والتحميل يستمر في الخلفية
+                startup_report.mark("bind")
+                self.load_task = asyncio.create_task(self._load())
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self._shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _load(self):
+        module_name, _, attr = self.target.partition(":")
+        try:
+            # الاستيراد في خيط منفصل حتى تبقى حلقة الأحداث تجيب على /health
+            module = await asyncio.get_running_loop().run_in_executor(None, importlib.import_module, module_name)
+            inner = getattr(module, attr)
+            await self._inner_lifespan(inner, "startup")
+            self.app = inner
+            logger.info("تم تحميل التطبيق خلال %.2f ثانية", time.perf_counter() - startup_report.started)
+        except Exception as e:
+            self.error = str(e)
+            logger.exception("فشل في تحميل التطبيق %s", self.target)
+
+    async def _inner_lifespan(self, inner, stage: str):
+        """إرسال حدث lifespan إلى التطبيق الحقيقي وانتظار رده"""
+        if self.lifespan_task is None:
+            self.lifespan_events = asyncio.Queue()
+            self.lifespan_replies = asyncio.Queue()
+            scope = {"type": "lifespan", "asgi": {"version": "3.0", "spec_version": "2.0"}, "state": {}}
+            self.lifespan_task = asyncio.create_task(inner(scope, self.lifespan_events.get, self.lifespan_replies.put))
+
+        await self.lifespan_events.put({"type": f"lifespan.{stage}"})
+        reply = asyncio.create_task(self.lifespan_replies.get())
+        await asyncio.wait({reply, self.lifespan_task}, return_when=asyncio.FIRST_COMPLETED)
+        if not reply.done():
+            reply.cancel()
+            self.lifespan_task.result()
+            raise RuntimeError(f"انتهى lifespan للتطبيق دون الرد على {stage}")
+        message = reply.result()
+        if message["type"] == f"lifespan.{stage}.failed":
+            raise RuntimeError(message.get("message") or f"فشل {stage}")
+
+    async def _shutdown(self):
+        if self.load_task is not None and not self.load_task.done():
+            self.load_task.cancel()
+            await asyncio.gather(self.load_task, return_exceptions=True)
+        if self.app is not None:
+            try:
+                await self._inner_lifespan(self.app, "shutdown")
+            except Exception as e:
+                logger.error("خطأ في إيقاف التطبيق: %s", e)
+
+app = FastStartApp(os.getenv('FAST_START_APP', 'app:app'))
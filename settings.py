@@ -0,0 +1,312 @@
+"""
+إعدادات التطبيق: تُقرأ من ملف .env والمتغيرات البيئية ويتم التحقق منها مرة واحدة
+"""
+
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
+from dotenv import load_dotenv
+
+# مجلد الجلسات وملفات الحالة الافتراضية
+SESSION_PATH = "session"
+
+def _env_str(name: str, default: Optional[str] = None, choices: Optional[Tuple[str, ...]] = None) -> Optional[str]:
+    """قيمة نصية اختيارية؛ مع choices تُحوّل إلى أحرف صغيرة ويُتحقق من أنها إحدى القيم المسموحة"""
+    value = os.getenv(name) or default
+    if choices is not None and value is not None:
+        value = value.lower()
+        if value not in choices:
+            raise ValueError(f"قيمة {name} غير صالحة: {value} (القيم المسموحة: {'، '.join(choices)})")
+    return value
+
+def _env_number(name: str, default: Union[int, float], kind: type, minimum: Union[int, float] = 0) -> Union[int, float]:
+    """قيمة رقمية من النوع kind لا تقل عن minimum"""
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        value = kind(raw)
+    except ValueError:
+        raise ValueError(f"يجب أن تكون قيمة {name} رقماً{' صحيحاً' if kind is int else ''}: {raw}") from None
+    if value < minimum:
+        raise ValueError(f"يجب ألا تقل قيمة {name} عن {minimum}: {raw}")
+    return value
+
+def _env_int(name: str, default: int, minimum: int = 0) -> int:
+    return _env_number(name, default, int, minimum)
+
+def _env_float(name: str, default: float, minimum: float = 0) -> float:
+    return _env_number(name, default, float, minimum)
+
+def _env_flag(name: str, default: bool) -> bool:
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    if raw not in ('0', '1'):
+        raise ValueError(f"يجب أن تكون قيمة {name} إما 0 أو 1: {raw}")
+    return raw == '1'
+
+def _saved_session_phone() -> Optional[str]:
+    """رقم الحساب الوحيد الذي له جلسة محفوظة في مجلد الجلسات (للنشر القديم بحساب واحد دون PHONE)"""
+    if not os.path.isdir(SESSION_PATH):
+        return None
+    phones = {
+        filename.split('.', 1)[0] for filename in os.listdir(SESSION_PATH)
+        if filename.endswith(('.session', '.session.json')) and filename.split('.', 1)[0].isdigit()
+    }
+    return f"+{phones.pop()}" if len(phones) == 1 else None
+
+def _env_json(name: str, expected: type):
+    """قيمة JSON اختيارية من النوع expected (قائمة أو كائن)"""
+    raw = os.getenv(name)
+    if not raw:
+        return None
+    try:
+        value = json.loads(raw)
+    except ValueError as e:
+        raise ValueError(f"قيمة {name} ليست JSON صالحاً: {e}") from None
+    if not isinstance(value, expected):
+        raise ValueError(f"يجب أن تكون قيمة {name} {'قائمة' if expected is list else 'كائن'} JSON")
+    return value
+
+@dataclass(frozen=True)
+class Settings:
+    """جميع المتغيرات بعد التحقق منها وتحويلها إلى أنواعها"""
+    api_id: int
+    api_hash: str
+    password: str
+    source_channel: int
+    receiver_account: Union[int, str]
+    target_channel_id: int
+    bot_ad: Optional[str]
+
+    # الحسابات: ACCOUNTS (قائمة JSON) أو PHONE لحساب واحد، أو رقم الجلسة المحفوظة الوحيدة
+    accounts: Optional[List[dict]]
+    phone: Optional[str]
+    phone_from_session: bool
+
+    # التشغيل (run.py)
+    web_workers: int
+    fast_start: bool
+
+    # السجلات
+    log_level: str
+    log_format: str
+    log_queue_size: int
+    log_rate_limit: int
+    log_rate_window: float
+
+    # خط معالجة الوسائط
+    media_pipeline_mode: str
+    media_spool_threshold: int
+    media_chunk_size: int
+    album_window: float
+    media_parallel_threshold: int
+    media_parallel_workers: int
+    media_part_size: int
+    media_parts_path: str
+    file_ops_workers: int
+    media_index_file: Optional[str]
+    media_index_days: int
+    shutdown_timeout: float
+    loop_lag_interval: float
+
+    # مخزن الجلسات
+    session_backend: str
+    session_save_delay: float
+    session_strings_file: Optional[str]
+    session_strings: Dict[str, str] = field(repr=False)
+    session_string: Optional[str] = field(repr=False)
+    session_export_token: Optional[str] = field(repr=False)
+
+    # ذاكرة الوجهات المحلولة
+    peer_cache_file: str
+    peer_refresh_interval: float
+
+    # جدولة الإرسال وطابور إعادة المحاولة
+    outbound_rate: float
+    outbound_burst: int
+    outbound_max_retries: int
+    outbound_max_inline_wait: int
+    outbound_retry_file: str
+    outbound_retry_interval: float
+    outbound_retry_max_attempts: int
+
+    # إزالة تكرار الوسائط
+    media_dedup_max: int
+    media_dedup_ttl: float
+    media_dedup_content_hash: bool
+    media_dedup_file: str
+
+    # marks.csv و ملفات ZIP
+    marks_csv_mode: str
+    marks_csv_key_columns: Tuple[str, ...]
+    marks_csv_course_column: Optional[str]
+    marks_csv_state_file: str
+    marks_zip_delivery: str
+    marks_zip_index_file: str
+
+    # طابور المهام والاستدراك
+    text_job_workers: int
+    media_job_workers: int
+    job_queue_max_depth: int
+    catchup_state_file: str
+    catchup_batch_size: int
+    catchup_batch_delay: float
+    catchup_limit: int
+    catchup_max_age: float
+
+    # قواعد التوجيه: ROUTING_RULES (JSON) أو ROUTING_RULES_FILE
+    routing_rules: Optional[List[dict]]
+    routing_rules_file: Optional[str]
+
+    # مراقبة الاتصال وإعادة الاتصال
+    supervisor_interval: float
+    heartbeat_window: float
+    reconnect_base_delay: float
+    reconnect_max_delay: float
+
+    # انتخاب العملية القائدة عند تشغيل عدة عمليات
+    runtime_lock_file: str
+    runtime_socket: str
+    leader_retry_interval: float
+    leader_cache_ttl: float
+    leader_ipc_timeout: float
+
+    # المتغيرات المطلوبة مع مثال لكل منها (يُعرض عند غيابها)
+    REQUIRED = {
+        'API_ID': '12345678',
+        'API_HASH': 'your_api_hash_here',
+        'PASSWORD': 'your_password_here',
+        'SOURCE_CHANNEL': '-1001234567890',
+        'RECEIVER_ACCOUNT': '@receiver',
+        'TARGET_CHANNEL_ID': '-1001234567890'
+    }
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """التحقق من جميع المتغيرات دفعة واحدة حتى تظهر كل الأخطاء في رسالة واحدة"""
+        missing = [name for name in cls.REQUIRED if not os.getenv(name)]
+        if missing:
+            raise ValueError(f"يجب تعيين {'، '.join(missing)} في ملف .env")
+
+        invalid = [name for name in ('API_ID', 'SOURCE_CHANNEL', 'TARGET_CHANNEL_ID') if not os.getenv(name).lstrip('-').isdigit()]
+        if invalid:
+            raise ValueError(f"يجب أن تكون قيم {'، '.join(invalid)} أرقاماً")
+
+        accounts = _env_json('ACCOUNTS', list)
+        phone = os.getenv('PHONE')
+        phone_from_session = False
+        if accounts is None and not phone:
+            # النشر القديم بحساب واحد كان يعتمد على رقم مضمن في الكود وجلسته ما زالت محفوظة
+            phone = _saved_session_phone()
+            phone_from_session = phone is not None
+            if phone is None:
+                raise ValueError("يجب تعيين ACCOUNTS أو PHONE في ملف .env (لا توجد جلسة محفوظة واحدة يمكن استخدام رقمها)")
+
+        # أجزاء النقل المتوازي يجب أن تكون محاذاة لحدود upload.getFile
+        media_part_size = _env_int('MEDIA_PART_SIZE', 512 * 1024, minimum=4096)
+        if media_part_size % 4096 != 0 or (512 * 1024) % media_part_size != 0:
+            raise ValueError("MEDIA_PART_SIZE يجب أن يكون من مضاعفات 4096 ويقسم 524288")
+
+        receiver_account = os.getenv('RECEIVER_ACCOUNT')
+        return cls(
+            api_id=int(os.getenv('API_ID')),
+            api_hash=os.getenv('API_HASH'),
+            password=os.getenv('PASSWORD'),
+            source_channel=int(os.getenv('SOURCE_CHANNEL')),
+            receiver_account=int(receiver_account) if receiver_account.lstrip('-').isdigit() else receiver_account,
+            target_channel_id=int(os.getenv('TARGET_CHANNEL_ID')),
+            bot_ad=os.getenv('BOT_AD'),
+
+            accounts=accounts,
+            phone=phone,
+            phone_from_session=phone_from_session,
+
+            web_workers=_env_int('WEB_WORKERS', 1, minimum=1),
+            fast_start=_env_flag('FAST_START', True),
+
+            log_level=_env_str('LOG_LEVEL', 'INFO', ('debug', 'info', 'warning', 'error', 'critical')).upper(),
+            log_format=_env_str('LOG_FORMAT', 'text', ('text', 'json')),
+            log_queue_size=_env_int('LOG_QUEUE_SIZE', 10000, minimum=1),
+            log_rate_limit=_env_int('LOG_RATE_LIMIT', 20),
+            log_rate_window=_env_float('LOG_RATE_WINDOW', 10),
+
+            media_pipeline_mode=_env_str('MEDIA_PIPELINE_MODE', 'stream', ('stream', 'disk')),
+            media_spool_threshold=_env_int('MEDIA_SPOOL_THRESHOLD', 8 * 1024 * 1024),
+            media_chunk_size=_env_int('MEDIA_CHUNK_SIZE', 512 * 1024, minimum=1),
+            album_window=_env_float('ALBUM_WINDOW', 0.5),
+            media_parallel_threshold=_env_int('MEDIA_PARALLEL_THRESHOLD', 0),
+            media_parallel_workers=_env_int('MEDIA_PARALLEL_WORKERS', 4, minimum=1),
+            media_part_size=media_part_size,
+            media_parts_path=_env_str('MEDIA_PARTS_PATH', os.path.join(SESSION_PATH, 'transfers')),
+            file_ops_workers=_env_int('FILE_OPS_WORKERS', 4, minimum=1),
+            media_index_file=_env_str('MEDIA_INDEX_FILE'),
+            media_index_days=_env_int('MEDIA_INDEX_DAYS', 7, minimum=1),
+            shutdown_timeout=_env_float('SHUTDOWN_TIMEOUT', 10),
+            loop_lag_interval=_env_float('LOOP_LAG_INTERVAL', 0.5, minimum=0.01),
+
+            session_backend=_env_str('SESSION_BACKEND', 'sqlite', ('sqlite', 'memory')),
+            session_save_delay=_env_float('SESSION_SAVE_DELAY', 2),
+            session_strings_file=_env_str('SESSION_STRINGS_FILE'),
+            session_strings=_env_json('SESSION_STRINGS', dict) or {},
+            session_string=_env_str('SESSION_STRING'),
+            session_export_token=_env_str('SESSION_EXPORT_TOKEN'),
+
+            peer_cache_file=_env_str('PEER_CACHE_FILE', os.path.join(SESSION_PATH, 'peer_cache.json')),
+            peer_refresh_interval=_env_float('PEER_REFRESH_INTERVAL', 6 * 3600, minimum=1),
+
+            outbound_rate=_env_float('OUTBOUND_RATE', 1, minimum=0.001),
+            outbound_burst=_env_int('OUTBOUND_BURST', 3, minimum=1),
+            outbound_max_retries=_env_int('OUTBOUND_MAX_RETRIES', 3),
+            outbound_max_inline_wait=_env_int('OUTBOUND_MAX_INLINE_WAIT', 60),
+            outbound_retry_file=_env_str('OUTBOUND_RETRY_FILE', os.path.join(SESSION_PATH, 'outbound_retry.json')),
+            outbound_retry_interval=_env_float('OUTBOUND_RETRY_INTERVAL', 30, minimum=0.1),
+            outbound_retry_max_attempts=_env_int('OUTBOUND_RETRY_MAX_ATTEMPTS', 10, minimum=1),
+
+            media_dedup_max=_env_int('MEDIA_DEDUP_MAX', 1000, minimum=1),
+            media_dedup_ttl=_env_float('MEDIA_DEDUP_TTL', 7 * 24 * 3600),
+            media_dedup_content_hash=_env_flag('MEDIA_DEDUP_CONTENT_HASH', False),
+            media_dedup_file=_env_str('MEDIA_DEDUP_FILE', os.path.join(SESSION_PATH, 'media_dedup.json')),
+
+            marks_csv_mode=_env_str('MARKS_CSV_MODE', 'full', ('full', 'delta')),
+            marks_csv_key_columns=tuple(column.strip() for column in os.getenv('MARKS_CSV_KEY_COLUMNS', '').split(',') if column.strip()),
+            marks_csv_course_column=_env_str('MARKS_CSV_COURSE_COLUMN'),
+            marks_csv_state_file=_env_str('MARKS_CSV_STATE_FILE', os.path.join(SESSION_PATH, 'marks_csv_state.json')),
+            marks_zip_delivery=_env_str('MARKS_ZIP_DELIVERY', 'full', ('full', 'changed', 'files')),
+            marks_zip_index_file=_env_str('MARKS_ZIP_INDEX_FILE', os.path.join(SESSION_PATH, 'marks_zip_index.json')),
+
+            text_job_workers=_env_int('TEXT_JOB_WORKERS', 1, minimum=1),
+            media_job_workers=_env_int('MEDIA_JOB_WORKERS', 2, minimum=1),
+            job_queue_max_depth=_env_int('JOB_QUEUE_MAX_DEPTH', 100, minimum=1),
+            catchup_state_file=_env_str('CATCHUP_STATE_FILE', os.path.join(SESSION_PATH, 'catchup_state.json')),
+            catchup_batch_size=_env_int('CATCHUP_BATCH_SIZE', 20, minimum=1),
+            catchup_batch_delay=_env_float('CATCHUP_BATCH_DELAY', 1),
+            catchup_limit=_env_int('CATCHUP_LIMIT', 200),
+            catchup_max_age=_env_float('CATCHUP_MAX_AGE', 6 * 3600),
+
+            routing_rules=_env_json('ROUTING_RULES', list),
+            routing_rules_file=_env_str('ROUTING_RULES_FILE'),
+
+            supervisor_interval=_env_float('SUPERVISOR_INTERVAL', 15, minimum=0.1),
+            heartbeat_window=_env_float('HEARTBEAT_WINDOW', 300),
+            reconnect_base_delay=_env_float('RECONNECT_BASE_DELAY', 2),
+            reconnect_max_delay=_env_float('RECONNECT_MAX_DELAY', 300),
+
+            runtime_lock_file=_env_str('RUNTIME_LOCK_FILE', os.path.join(SESSION_PATH, 'runtime.lock')),
+            runtime_socket=_env_str('RUNTIME_SOCKET', os.path.join(SESSION_PATH, 'runtime.sock')),
+            leader_retry_interval=_env_float('LEADER_RETRY_INTERVAL', 5, minimum=0.1),
+            leader_cache_ttl=_env_float('LEADER_CACHE_TTL', 1),
+            leader_ipc_timeout=_env_float('LEADER_IPC_TIMEOUT', 60, minimum=0.1)
+        )
+
+_settings: Optional[Settings] = None
+
+def get_settings() -> Settings:
+    """تحميل .env والتحقق من الإعدادات عند أول استدعاء فقط (run.py و app.py في نفس العملية)"""
+    global _settings
+    if _settings is None:
+        load_dotenv()
+        _settings = Settings.from_env()
+    return _settings
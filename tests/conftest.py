@@ -0,0 +1,25 @@
+"""
+إعداد الاختبارات: متغيرات بيئة صالحة ومجلد عمل مؤقت قبل استيراد app
+
+app.py يقرأ الإعدادات وينشئ مجلدات session و downloads عند الاستيراد، لذلك يتم ذلك هنا مرة واحدة
+قبل جمع أي اختبار.
+"""
+
+import os
+import tempfile
+
+TEST_ENV = {
+    'API_ID': '1',
+    'API_HASH': 'hash',
+    'PASSWORD': 'password',
+    'SOURCE_CHANNEL': '-1001',
+    'RECEIVER_ACCOUNT': '@receiver',
+    'TARGET_CHANNEL_ID': '-1002',
+    'PHONE': '+10000000000',
+    'LOG_LEVEL': 'WARNING'
+}
+
+for name, value in TEST_ENV.items():
+    os.environ.setdefault(name, value)
+
+os.chdir(tempfile.mkdtemp(prefix='app-tests-'))
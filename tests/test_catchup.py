@@ -0,0 +1,48 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def state():
+    state = app.CatchUpState()
+    state.saver.path = None
+    return state
+
+
+def test_claim_rejects_duplicates(state):
+    assert state.claim("+1", -100, 5)
+    assert not state.claim("+1", -100, 5)
+    assert state.claim("+1", -200, 5)
+    assert state.claim("+2", -100, 5)
+    assert state.stats["duplicates"] == 1
+
+
+def test_cursor_stops_before_pending_message(state):
+    for message_id in (1, 2, 3):
+        state.claim("+1", -100, message_id)
+    state.finish("+1", -100, 2, True)
+    assert state.cursors("+1", [-100]) == {-100: None}
+    state.finish("+1", -100, 1, True)
+    assert state.last_ids["+1:-100"] == 2
+    state.finish("+1", -100, 3, True)
+    assert state.last_ids["+1:-100"] == 3
+
+
+def test_failed_message_blocks_cursor_and_can_be_reclaimed(state):
+    for message_id in (10, 11):
+        state.claim("+1", -100, message_id)
+    state.finish("+1", -100, 10, False)
+    state.finish("+1", -100, 11, True)
+    assert state.last_ids["+1:-100"] == 9
+    assert state.stats["failed"] == 1
+    assert state.claim("+1", -100, 10)
+    state.finish("+1", -100, 10, True)
+    assert state.last_ids["+1:-100"] == 11
+
+
+def test_cursor_never_moves_back(state):
+    state.last_ids["+1:-100"] = 50
+    state.claim("+1", -100, 20)
+    state.finish("+1", -100, 20, True)
+    assert state.last_ids["+1:-100"] == 50
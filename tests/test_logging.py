@@ -0,0 +1,33 @@
+import logging
+
+import app
+
+
+def record(msg, *args, level=logging.INFO):
+    return logging.LogRecord("app", level, __file__, 1, msg, args, None)
+
+
+def test_limit_per_message_template():
+    limiter = app.LogRateLimiter(limit=2, window=60)
+    results = [limiter.filter(record("رسالة %s", number)) for number in range(4)]
+    assert results == [True, True, False, False]
+    assert limiter.filter(record("رسالة أخرى %s", 1))
+    assert limiter.filter(record("رسالة %s", 1, level=logging.ERROR))
+
+
+def test_suppressed_count_reported_in_next_window():
+    limiter = app.LogRateLimiter(limit=1, window=60)
+    for number in range(3):
+        limiter.filter(record("رسالة %s", number))
+    limiter.windows[("app", logging.INFO, "رسالة %s")][0] -= 60
+    first = record("رسالة %s", 3)
+    assert limiter.filter(first)
+    assert first.suppressed == 2
+    second = record("رسالة %s", 4)
+    assert not limiter.filter(second)
+    assert not hasattr(second, "suppressed")
+
+
+def test_zero_limit_disables_filter():
+    limiter = app.LogRateLimiter(limit=0, window=60)
+    assert all(limiter.filter(record("رسالة")) for _ in range(100))
@@ -0,0 +1,71 @@
+import csv
+import io
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def relay():
+    relay = app.MarksCsvRelay()
+    relay.key_columns = ["id"]
+    relay.course_column = "course"
+    return relay
+
+
+def run_diff(relay, text, previous=None):
+    delta = io.BytesIO()
+    result = relay.diff(io.BytesIO(text.encode('utf-8-sig')), previous, delta)
+    rows = list(csv.reader(io.StringIO(delta.getvalue().decode('utf-8'))))
+    return result, rows
+
+
+def test_first_file_is_sent_in_full(relay):
+    result, rows = run_diff(relay, "id,course,mark\n1,math,90\n2,art,80\n")
+    assert rows == [["op", "id", "course", "mark"], ["upsert", "1", "math", "90"], ["upsert", "2", "art", "80"]]
+    summary = result["summary"]
+    assert summary["full"] and summary["added"] == 2
+    assert summary["courses"] == {"math": 1, "art": 1}
+
+
+def test_delta_contains_only_changes(relay):
+    previous, _ = run_diff(relay, "id,course,mark\n1,math,90\n2,art,80\n3,math,70\n")
+    result, rows = run_diff(relay, "id,course,mark\n1,math,90\n2,art,85\n4,art,60\n", previous)
+    assert rows == [
+        ["op", "id", "course", "mark"],
+        ["upsert", "2", "art", "85"],
+        ["upsert", "4", "art", "60"],
+        ["delete", "3", "", ""],
+    ]
+    summary = result["summary"]
+    assert not summary["full"]
+    assert (summary["unchanged"], summary["changed"], summary["added"], summary["removed"]) == (1, 1, 1, 1)
+
+
+def test_header_change_resends_everything(relay):
+    previous, _ = run_diff(relay, "id,course,mark\n1,math,90\n")
+    result, rows = run_diff(relay, "id,course,mark,grade\n1,math,90,A\n", previous)
+    assert result["summary"]["full"]
+    assert rows[1:] == [["upsert", "1", "math", "90", "A"]]
+
+
+def test_invalid_and_duplicate_rows(relay):
+    result, _ = run_diff(relay, "id,course,mark\n1,math,90\n1,math,95\n2,art\n,,\n")
+    summary = result["summary"]
+    assert summary["rows"] == 4
+    assert summary["invalid"] == 2
+    assert summary["invalid_lines"] == [4, 5]
+    assert summary["duplicates"] == 1
+
+
+def test_whole_row_is_key_without_key_columns(relay):
+    relay.key_columns = []
+    previous, _ = run_diff(relay, "id,course,mark\n1,math,90\n")
+    _, rows = run_diff(relay, "id,course,mark\n1,math,95\n", previous)
+    assert rows[1:] == [["upsert", "1", "math", "95"], ["delete", "1", "math", "90"]]
+
+
+def test_empty_file(relay):
+    with pytest.raises(ValueError):
+        run_diff(relay, "")
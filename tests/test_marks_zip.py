@@ -0,0 +1,63 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+
+def archive(name):
+    return SimpleNamespace(
+        id=1, photo=None, file=SimpleNamespace(ext='.zip'),
+        document=SimpleNamespace(mime_type='application/zip', attributes=[SimpleNamespace(file_name=name)])
+    )
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = app.MarksZipIndex()
+    index.index_file = index.saver.path = str(tmp_path / "index.json")
+    return index
+
+
+def inspect(index, members, name="marks.zip"):
+    async def read_members(client, message):
+        return members
+    index.read_members = read_members
+    return asyncio.run(index.inspect(None, archive(name), -100))
+
+
+def test_inspect_does_not_persist_until_commit(index, tmp_path):
+    changes = inspect(index, {"a.pdf": [1, 10], "b.pdf": [2, 20]})
+    assert changes["added"] == ["a.pdf", "b.pdf"]
+    assert changes["previous"] is None
+    assert index.indexes == {}
+    assert not (tmp_path / "index.json").exists()
+
+    # إعادة معالجة نفس الملف قبل التسليم تعطي نفس التغييرات
+    assert inspect(index, {"a.pdf": [1, 10], "b.pdf": [2, 20]})["added"] == ["a.pdf", "b.pdf"]
+
+    asyncio.run(index.commit(-100, changes))
+    saved = json.loads((tmp_path / "index.json").read_text(encoding='utf-8'))
+    assert saved == {"-100": {"archive": "marks.zip", "members": {"a.pdf": [1, 10], "b.pdf": [2, 20]}}}
+
+
+def test_changes_against_committed_index(index):
+    asyncio.run(index.commit(-100, inspect(index, {"a.pdf": [1, 10], "b.pdf": [2, 20], "c.pdf": [3, 30]})))
+    changes = inspect(index, {"a.pdf": [1, 10], "b.pdf": [9, 25], "d.pdf": [4, 40]}, "marks_v2.zip")
+    assert changes["previous"] == "marks.zip"
+    assert changes["added"] == ["d.pdf"]
+    assert changes["changed"] == ["b.pdf"]
+    assert changes["removed"] == ["c.pdf"]
+    assert changes["unchanged"] == 1
+    assert changes["changed_bytes"] == 65
+    assert changes["total_bytes"] == 75
+    assert index.changes["-100"]["added"] == 1
+
+
+def test_unreadable_archive(index):
+    async def read_members(client, message):
+        raise app.zipfile.BadZipFile("broken")
+    index.read_members = read_members
+    assert asyncio.run(index.inspect(None, archive("marks.zip"), -100)) is None
@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def cache():
+    cache = app.MediaDedupCache()
+    cache.saver.path = None
+    cache.loaded = True
+    return cache
+
+
+def test_lru_eviction_keeps_recently_seen(cache):
+    cache.max_entries = 2
+    cache.add("a")
+    cache.add("b")
+    assert cache.seen("a")
+    cache.add("c")
+    assert list(cache.entries) == ["a", "c"]
+    assert not cache.seen("b")
+
+
+def test_expired_entries_are_removed(cache):
+    cache.ttl = 60
+    cache.add("old")
+    cache.entries["old"] = time.time() - 61
+    assert not cache.seen("old")
+    assert "old" not in cache.entries
+
+
+def test_fresh_content_skips_destinations_with_same_hash(cache):
+    cache.add("sha256:abc:-100")
+    deliveries = [(-100, "caption"), ("@other", "caption")]
+    assert cache.fresh_content("abc", deliveries) == [("@other", "caption")]
+    assert cache.fresh_content("def", deliveries) == deliveries
+    assert cache.stats["content_duplicates"] == 1
@@ -0,0 +1,32 @@
+import asyncio
+import time
+
+import app
+
+
+def test_token_bucket_allows_burst_then_waits():
+    bucket = app.TokenBucket(rate=20, capacity=2)
+
+    async def run():
+        start = time.monotonic()
+        await bucket.acquire()
+        await bucket.acquire()
+        burst = time.monotonic() - start
+        await bucket.acquire()
+        return burst, time.monotonic() - start
+
+    burst, total = asyncio.run(run())
+    assert burst < 0.04
+    assert total >= 0.045
+
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = app.TokenBucket(rate=1000, capacity=3)
+    bucket.tokens = 0
+    bucket.updated -= 10
+
+    async def run():
+        await bucket.acquire()
+
+    asyncio.run(run())
+    assert bucket.tokens == 2
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import app
+
+
+def test_write_json_atomic_roundtrip(tmp_path):
+    path = str(tmp_path / "state.json")
+    app.write_json_atomic(path, {"key": "قيمة"})
+    assert app.read_json(path) == {"key": "قيمة"}
+    assert not (tmp_path / "state.json.tmp").exists()
+
+
+def test_read_json_default_for_missing_or_corrupt(tmp_path):
+    path = tmp_path / "state.json"
+    assert app.read_json(str(path), {}) == {}
+    path.write_text("{broken", encoding='utf-8')
+    assert app.read_json(str(path), []) == []
+    assert app.read_json(None, {}) == {}
+
+
+def test_debounced_saver_batches_writes(tmp_path):
+    path = tmp_path / "state.json"
+    state = {"count": 0}
+    saver = app.DebouncedSaver(str(path), lambda: dict(state), delay=0.01)
+
+    async def run():
+        for count in range(1, 4):
+            state["count"] = count
+            saver.schedule()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert saver.writes == 1
+    # اللقطة تؤخذ عند الكتابة وليس عند الجدولة
+    assert json.loads(path.read_text(encoding='utf-8')) == {"count": 3}
+
+
+def test_debounced_saver_flush_and_skip(tmp_path):
+    path = tmp_path / "state.json"
+    snapshots = [None, {"saved": True}]
+    saver = app.DebouncedSaver(str(path), lambda: snapshots.pop(0), delay=60)
+
+    async def run():
+        saver.schedule()
+        assert not await saver.flush()
+        assert saver.task is None
+        assert await saver.save()
+
+    asyncio.run(run())
+    assert saver.writes == 1
+    assert json.loads(path.read_text(encoding='utf-8')) == {"saved": True}
+
+
+def test_debounced_saver_without_path():
+    saver = app.DebouncedSaver(None, lambda: {})
+    saver.schedule()
+    assert saver.task is None
+    assert not asyncio.run(saver.save())
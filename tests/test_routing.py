@@ -0,0 +1,99 @@
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import RoutingTable
+
+
+def document(file_name, mime_type='application/octet-stream'):
+    return SimpleNamespace(
+        id=1, photo=None, file=SimpleNamespace(ext=''),
+        document=SimpleNamespace(mime_type=mime_type, attributes=[SimpleNamespace(file_name=file_name)])
+    )
+
+
+def text_message():
+    return SimpleNamespace(id=1, photo=None, document=None, file=None)
+
+
+def photo():
+    return SimpleNamespace(id=1, photo=object(), document=None, file=SimpleNamespace(ext='.jpg'))
+
+
+def names(table, chat, message, text=''):
+    rule = table.match(chat, message, text)
+    return rule.name if rule else None
+
+
+def test_default_rules():
+    table = RoutingTable(app.DEFAULT_ROUTING_RULES)
+    assert names(table, "source", photo()) == "photo"
+    assert names(table, "receiver", text_message(), " تم ") == "done"
+    assert names(table, "receiver", document("marks.csv", "text/csv")) == "marks_csv"
+    assert names(table, "source", document("marks.csv")) is None
+    assert names(table, "receiver", text_message(), "hello") is None
+
+
+def test_inline_flags_are_per_rule():
+    table = RoutingTable([
+        {"name": "upper", "chat": "receiver", "text_regex": "^DONE$", "action": "done"},
+        {"name": "any_case", "chat": "receiver", "text_regex": "(?i)^finished$", "action": "done"},
+    ])
+    assert names(table, "receiver", text_message(), "FINISHED") == "any_case"
+    assert names(table, "receiver", text_message(), "done") is None
+    assert names(table, "receiver", text_message(), "DONE") == "upper"
+
+
+def test_named_groups_and_backreferences():
+    table = RoutingTable([
+        {"name": "pair", "chat": "source", "file_regex": r"(?P<term>f\d)_(?P=term)\.zip", "action": "marks_zip"},
+        {"name": "same", "chat": "source", "file_regex": r"(?P<term>\w+)\.bak", "action": "marks_zip"},
+        {"name": "twice", "chat": "receiver", "text_regex": r"(\w+) \1", "action": "test"},
+    ])
+    assert names(table, "source", document("f2_f2.zip")) == "pair"
+    assert names(table, "source", document("f2_f3.zip")) is None
+    assert names(table, "source", document("marks.bak")) == "same"
+    assert names(table, "receiver", text_message(), "go go") == "twice"
+    assert names(table, "receiver", text_message(), "go stop") is None
+
+
+def test_patterns_are_tried_in_rule_order():
+    table = RoutingTable([
+        {"name": "csv_only", "chat": "source", "file_glob": "*.zip", "mime": "text/csv", "action": "marks_csv"},
+        {"name": "first", "chat": "source", "file_glob": "marks*.zip", "action": "marks_zip"},
+        {"name": "second", "chat": "source", "file_regex": r"marks.*", "action": "marks_zip"},
+    ])
+    assert names(table, "source", document("marks_2025.zip")) == "first"
+    assert names(table, "source", document("marks_2025.zip", "text/csv")) == "csv_only"
+    assert names(table, "source", document("marks.txt")) == "second"
+
+
+def test_exact_conditions_win_over_patterns_and_defaults():
+    table = RoutingTable([
+        {"name": "fallback", "chat": "source", "action": "photo"},
+        {"name": "pattern", "chat": "source", "file_glob": "*.zip", "action": "marks_zip"},
+        {"name": "exact", "chat": "source", "file_name": "marks.zip", "action": "marks_zip"},
+        {"name": "photos", "chat": "source", "media": "photo", "action": "photo"},
+    ])
+    assert names(table, "source", document("marks.zip")) == "exact"
+    assert names(table, "source", document("other.zip")) == "pattern"
+    assert names(table, "source", document("other.txt")) == "fallback"
+    assert names(table, "source", photo()) == "photos"
+
+
+@pytest.mark.parametrize('field', ['file_regex', 'text_regex'])
+def test_invalid_regex_names_rule(field):
+    with pytest.raises(ValueError, match=f"{field}.*broken"):
+        RoutingTable([{"name": "broken", field: "(unclosed", "action": "test"}])
+
+
+@pytest.mark.parametrize('rule, error', [
+    ({"action": "unknown"}, "unknown"),
+    ({"action": "test", "chat": "channel"}, "source"),
+    ({"action": "test", "media": "video"}, "video"),
+    ({"action": "test", "lane": "slow"}, "slow"),
+])
+def test_invalid_rules(rule, error):
+    with pytest.raises(ValueError, match=error):
+        RoutingTable([rule])
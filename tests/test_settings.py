@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+import settings
+from settings import Settings
+from conftest import TEST_ENV
+
+
+@pytest.fixture
+def env(monkeypatch, tmp_path):
+    """بيئة صالحة فقط، في مجلد عمل فارغ (بدون جلسات محفوظة)"""
+    for name in list(os.environ):
+        monkeypatch.delenv(name)
+    for name, value in TEST_ENV.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.chdir(tmp_path)
+    return monkeypatch
+
+
+def test_defaults(env):
+    config = Settings.from_env()
+    assert config.api_id == 1
+    assert config.receiver_account == '@receiver'
+    assert config.log_format == 'text'
+    assert config.session_backend == 'sqlite'
+    assert config.marks_zip_delivery == 'full'
+    assert config.phone == '+10000000000'
+    assert not config.phone_from_session
+
+
+def test_missing_required_are_listed_together(env):
+    env.delenv('API_HASH')
+    env.delenv('PASSWORD')
+    with pytest.raises(ValueError, match='API_HASH') as error:
+        Settings.from_env()
+    assert 'PASSWORD' in str(error.value)
+
+
+def test_numeric_receiver_account(env):
+    env.setenv('RECEIVER_ACCOUNT', '-1003')
+    assert Settings.from_env().receiver_account == -1003
+
+
+@pytest.mark.parametrize('name, value', [
+    ('API_ID', 'abc'),
+    ('OUTBOUND_RATE', 'fast'),
+    ('OUTBOUND_BURST', '0'),
+    ('MEDIA_DEDUP_CONTENT_HASH', 'yes'),
+    ('LOG_FORMAT', 'xml'),
+    ('MARKS_ZIP_DELIVERY', 'diff'),
+    ('ROUTING_RULES', '{"not": "a list"}'),
+    ('ACCOUNTS', '[broken'),
+])
+def test_invalid_value_names_variable(env, name, value):
+    env.setenv(name, value)
+    with pytest.raises(ValueError, match=name):
+        Settings.from_env()
+
+
+def test_choices_are_case_insensitive(env):
+    env.setenv('LOG_FORMAT', 'JSON')
+    env.setenv('MARKS_ZIP_DELIVERY', 'Files')
+    config = Settings.from_env()
+    assert config.log_format == 'json'
+    assert config.marks_zip_delivery == 'files'
+
+
+@pytest.mark.parametrize('size', ['1000', '12288', '1048576'])
+def test_media_part_size_alignment(env, size):
+    env.setenv('MEDIA_PART_SIZE', size)
+    with pytest.raises(ValueError, match='MEDIA_PART_SIZE'):
+        Settings.from_env()
+
+
+def test_phone_from_single_saved_session(env, tmp_path):
+    env.delenv('PHONE')
+    (tmp_path / settings.SESSION_PATH).mkdir()
+    (tmp_path / settings.SESSION_PATH / '9665000.session').touch()
+    (tmp_path / settings.SESSION_PATH / 'peer_cache.json').touch()
+    config = Settings.from_env()
+    assert config.phone == '+9665000'
+    assert config.phone_from_session
+
+
+@pytest.mark.parametrize('files', [[], ['111.session', '222.session.json']])
+def test_phone_required_without_single_saved_session(env, tmp_path, files):
+    env.delenv('PHONE')
+    (tmp_path / settings.SESSION_PATH).mkdir()
+    for filename in files:
+        (tmp_path / settings.SESSION_PATH / filename).touch()
+    with pytest.raises(ValueError, match='PHONE'):
+        Settings.from_env()
+
+
+def test_accounts_without_phone(env):
+    env.delenv('PHONE')
+    env.setenv('ACCOUNTS', '[{"phone": "+1"}]')
+    config = Settings.from_env()
+    assert config.accounts == [{"phone": "+1"}]
+    assert config.phone is None